@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from typing import Optional
+from uuid import UUID
+from app.services.analytics_rollup import analytics_rollup
+
+router = APIRouter()
+
+@router.get("/{patient_id}/metrics")
+async def get_patient_metrics(patient_id: str, days: int = Query(30, ge=1, le=365),
+                              authorization: Optional[str] = Header(None)):
+    """
+    A patient's practice metrics from the analytics rollups: compliance,
+    streak (distinct active days) and hours practiced, the /predict/summary
+    inputs, plus the consecutive-day streak and daily and weekly session
+    series over the last `days` days. Needs the caller's Supabase access
+    token (Authorization: Bearer ...); rows are limited to what RLS lets them
+    read.
+    """
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    try:
+        patient_id = str(UUID(patient_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid patient_id")
+
+    try:
+        return await analytics_rollup.get_metrics(authorization.split(" ", 1)[1].strip(), patient_id, days)
+    except Exception as e:
+        print(f"[API] Error reading analytics metrics: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to read analytics")
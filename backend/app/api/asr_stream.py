@@ -5,24 +5,93 @@ Receives audio chunks and returns partial transcriptions in real-time
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from app.services.asr import asr_service
 from app.services.audio_chunker import audio_chunker
+from app.services.stream_session import StreamSession, InferenceCancelled, stream_metrics
+import asyncio
 import json
 import base64
-import numpy as np
 
 router = APIRouter()
 
+async def _inference_worker(websocket: WebSocket, session: StreamSession):
+    """
+    Runs queued chunks through ASR one at a time, off the event loop,
+    so the receive loop keeps listening and notices a disconnect immediately.
+    """
+    while True:
+        message = await session.next_message()
+        if message is None:
+            return
+
+        language = message.get("language", "en")
+        chunk_id = message.get("chunk_id", 0)
+        audio_seconds = 0.0
+
+        try:
+            # Decode base64 audio
+            audio_bytes = base64.b64decode(message["audio"])
+
+            # Decode audio to numpy array
+            audio_data, sample_rate = await asyncio.to_thread(
+                audio_chunker.decode_audio_bytes, audio_bytes
+            )
+            audio_seconds = len(audio_data) / sample_rate
+
+            # Transcribe chunk (aborts early if the client disconnects)
+            result = await asyncio.to_thread(
+                asr_service.transcribe,
+                audio_data,
+                language=language,
+                sampling_rate=sample_rate,
+                cancel_event=session.cancel_event
+            )
+
+            # Send partial result back to client
+            response = {
+                "text": result["text"],
+                "chunk_id": chunk_id,
+                "model": result["model"],
+                "is_final": False,  # Partial result
+                "language": language
+            }
+
+            try:
+                await websocket.send_json(response)
+                print(f"[WebSocket] ✅ Sent transcription for chunk {chunk_id}: {result['text'][:50]}...")
+            except RuntimeError:
+                print(f"[WebSocket] ⚠️ Cannot send chunk {chunk_id}, connection closed")
+                session.cancel()
+
+        except InferenceCancelled as e:
+            if e.started:
+                stream_metrics.record_abort(audio_seconds)
+                print(f"[WebSocket] ⏹️ Aborted chunk {chunk_id} after client disconnect")
+            else:
+                stream_metrics.record_drop(len(message.get("audio") or ""))
+            return
+
+        except Exception as e:
+            print(f"[WebSocket] Error processing chunk {chunk_id}: {str(e)}")
+            try:
+                # Try to send error to client, but ignore if closed
+                await websocket.send_json({
+                    "error": f"Transcription failed: {str(e)}",
+                    "chunk_id": chunk_id
+                })
+            except:
+                pass
+
 @router.websocket("/stream")
 async def stream_transcription(websocket: WebSocket):
     """
     WebSocket endpoint for live transcription
-    
+
     Client sends:
     {
         "audio": "base64_encoded_audio_chunk",
         "language": "en" | "tw",
         "chunk_id": 0
     }
-    
+
     Server responds:
     {
         "text": "partial transcription",
@@ -33,64 +102,27 @@ async def stream_transcription(websocket: WebSocket):
     """
     await websocket.accept()
     print("[WebSocket] Client connected for live transcription")
-    
+
+    session = StreamSession()
+    worker = asyncio.create_task(_inference_worker(websocket, session))
+
     try:
         while True:
             # Receive audio chunk from client
             data = await websocket.receive_text()
             message = json.loads(data)
-            
-            audio_b64 = message.get("audio")
-            language = message.get("language", "en")
-            chunk_id = message.get("chunk_id", 0)
-            
-            if not audio_b64:
+
+            if not message.get("audio"):
                 await websocket.send_json({
                     "error": "No audio data provided",
-                    "chunk_id": chunk_id
+                    "chunk_id": message.get("chunk_id", 0)
                 })
                 continue
-            
-            try:
-                # Decode base64 audio
-                audio_bytes = base64.b64decode(audio_b64)
-                
-                # Decode audio to numpy array
-                audio_data, sample_rate = audio_chunker.decode_audio_bytes(audio_bytes)
-                
-                # Transcribe chunk
-                result = asr_service.transcribe(
-                    audio_data, 
-                    language=language, 
-                    sampling_rate=sample_rate
-                )
-                
-                # Send partial result back to client
-                response = {
-                    "text": result["text"],
-                    "chunk_id": chunk_id,
-                    "model": result["model"],
-                    "is_final": False,  # Partial result
-                    "language": language
-                }
-                
-                try:
-                    await websocket.send_json(response)
-                    print(f"[WebSocket] ✅ Sent transcription for chunk {chunk_id}: {result['text'][:50]}...")
-                except RuntimeError:
-                    print(f"[WebSocket] ⚠️ Cannot send chunk {chunk_id}, connection closed")
-                
-            except Exception as e:
-                print(f"[WebSocket] Error processing chunk {chunk_id}: {str(e)}")
-                try:
-                    # Try to send error to client, but ignore if closed
-                    await websocket.send_json({
-                        "error": f"Transcription failed: {str(e)}",
-                        "chunk_id": chunk_id
-                    })
-                except:
-                    pass
-                
+
+            # Hand the chunk to the inference worker and go straight back to listening
+            if session.submit(message):
+                print("[WebSocket] ⚠️ Inference is behind, dropped the oldest queued chunk")
+
     except WebSocketDisconnect:
         print("[WebSocket] Client disconnected")
     except Exception as e:
@@ -99,4 +131,15 @@ async def stream_transcription(websocket: WebSocket):
             await websocket.close()
         except:
             pass
+    finally:
+        dropped = session.cancel()
+        if dropped:
+            print(f"[WebSocket] Dropped {dropped} queued chunk(s) for closed session")
+        await worker
 
+@router.get("/stream/metrics")
+async def stream_metrics_snapshot():
+    """
+    Inference avoided by cancelling work for disconnected streaming clients.
+    """
+    return stream_metrics.snapshot()
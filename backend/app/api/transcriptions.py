@@ -1,10 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
-from app.services.transcription_db import transcription_db
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Query, Header
+from pydantic import BaseModel, ValidationError
+from typing import Optional, Dict, Any, List
+from uuid import UUID
+from app.services.transcription_db import transcription_db, OutboxFull
 
 router = APIRouter()
 
+# Seconds a client is asked to wait after a 503 from a full outbox
+OUTBOX_FULL_RETRY_AFTER = "5"
+
+def outbox_full(e: OutboxFull) -> HTTPException:
+    print(f"[API] Rejecting transcription save: {str(e)}")
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": OUTBOX_FULL_RETRY_AFTER})
+
 class TranscriptionSaveRequest(BaseModel):
     user_id: str
     text: str
@@ -16,6 +25,9 @@ class TranscriptionSaveRequest(BaseModel):
     # client should upload to storage then send URL if needed.
     # OR we could accept base64. But let's start with text + metadata.
     audio_url: Optional[str] = None
+    # True: respond once the row is written. False: respond as soon as it is
+    # queued (fire-and-forget); the returned id is final either way.
+    durable: bool = True
 
 @router.post("/save")
 async def save_transcription(request: TranscriptionSaveRequest):
@@ -32,14 +44,138 @@ async def save_transcription(request: TranscriptionSaveRequest):
             language=request.language,
             metadata=request.metadata,
             audio_url=request.audio_url,
-            duration=request.duration
+            duration=request.duration,
+            wait=request.durable
         )
         
         if result:
-            return {"status": "success", "data": result}
+            # Not yet in Supabase: fire-and-forget, or a durable save past its
+            # ack timeout. Either way the row is safe in the local outbox.
+            synced = result.pop("synced", False)
+            return {"status": "success" if synced else "queued", "data": result}
         else:
             raise HTTPException(status_code=500, detail="Failed to save to database")
             
+    except OutboxFull as e:
+        raise outbox_full(e)
     except Exception as e:
         print(f"[API] Error saving transcription: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+class TranscriptionBatchSaveRequest(BaseModel):
+    # TranscriptionSaveRequest objects; validated one by one so a bad item
+    # is reported in its result instead of rejecting the whole batch
+    items: List[Dict[str, Any]]
+    durable: bool = True
+
+MAX_BATCH_ITEMS = 500
+
+@router.post("/save_batch")
+async def save_transcription_batch(request: TranscriptionBatchSaveRequest):
+    """
+    Saves many transcriptions (e.g. the partial and final transcripts of a
+    live session) in one request. Items are validated in one pass and the
+    valid ones are stored together; results keep the order of items.
+    """
+    if not request.items or len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_BATCH_ITEMS} items")
+
+    results: List[Dict[str, Any]] = [{"index": i} for i in range(len(request.items))]
+    valid, records = [], []
+    for i, item in enumerate(request.items):
+        try:
+            parsed = TranscriptionSaveRequest(**item)
+        except ValidationError as e:
+            results[i]["error"] = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            continue
+        if not parsed.user_id or not parsed.text.strip():
+            results[i]["error"] = "Missing user_id or text"
+            continue
+        valid.append(i)
+        records.append(dict(user_id=parsed.user_id, text=parsed.text, language=parsed.language,
+                            metadata=parsed.metadata, audio_url=parsed.audio_url, duration=parsed.duration))
+
+    try:
+        rows = await transcription_db.save_transcriptions(records, wait=request.durable) if records else []
+    except OutboxFull as e:
+        raise outbox_full(e)
+    if rows is None:
+        raise HTTPException(status_code=500, detail="Failed to save to database")
+    for i, row in zip(valid, rows):
+        results[i].update(id=row["id"], status="saved" if row["synced"] else "queued")
+
+    failed = len(request.items) - len(rows)
+    return {
+        "status": "partial" if failed else ("success" if all(r["synced"] for r in rows) else "queued"),
+        "saved": len(rows),
+        "failed": failed,
+        "results": results,
+    }
+
+@router.get("/users/{user_id}")
+async def list_transcriptions(user_id: str,
+                              limit: int = Query(50, ge=1, le=200),
+                              cursor: Optional[str] = None,
+                              authorization: Optional[str] = Header(None)):
+    """
+    A user's transcriptions, newest first, one page at a time. Pass the
+    returned next_cursor to get the following page; it is null on the last.
+    Needs the caller's Supabase access token (Authorization: Bearer ...);
+    rows are limited to what RLS lets them read.
+    """
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    try:
+        return await transcription_db.list_transcriptions(authorization.split(" ", 1)[1].strip(), user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[API] Error listing transcriptions: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to read transcriptions")
+
+SEARCH_SOURCES = {"transcriptions", "journals"}
+
+@router.get("/search")
+async def search_history(q: str = Query(..., min_length=2, max_length=200),
+                         patient_id: Optional[str] = None,
+                         sources: str = "transcriptions,journals",
+                         limit: int = Query(20, ge=1, le=100),
+                         offset: int = Query(0, ge=0, le=1000),
+                         authorization: Optional[str] = Header(None)):
+    """
+    Searches transcriptions and voice journals for words like "yare", "pain"
+    or "nsuo", best matches first. Needs the caller's Supabase access token
+    (Authorization: Bearer ...); results are limited to what RLS lets them
+    read. Akan ɛ/ɔ may be typed as e/o.
+    """
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    wanted = {s.strip() for s in sources.split(",") if s.strip()}
+    if not wanted or wanted - SEARCH_SOURCES:
+        raise HTTPException(status_code=400, detail=f"sources must be a subset of {sorted(SEARCH_SOURCES)}")
+    if patient_id:
+        try:
+            patient_id = str(UUID(patient_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid patient_id")
+
+    try:
+        results = await transcription_db.search_history(
+            authorization.split(" ", 1)[1].strip(), q, patient_id,
+            transcriptions="transcriptions" in wanted, journals="journals" in wanted,
+            limit=limit, offset=offset,
+        )
+    except Exception as e:
+        print(f"[API] Error searching history: {str(e)}")
+        raise HTTPException(status_code=500, detail="Search failed")
+    return {
+        "results": results,
+        "next_offset": offset + limit if len(results) == limit else None,
+    }
+
+@router.get("/stats")
+async def transcription_writer_stats():
+    """Counters of the write-behind transcription writer and its local outbox."""
+    outbox = await asyncio.to_thread(transcription_db.outbox.stats)
+    return {**transcription_db.stats, "backlog": transcription_db.backlog, "outbox": outbox,
+            "read_cache": transcription_db.read_stats}
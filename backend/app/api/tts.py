@@ -1,38 +1,205 @@
-from fastapi import APIRouter, HTTPException, Response
+import asyncio
+import time
+from typing import Optional, List
+from fastapi import APIRouter, HTTPException, Response, Header
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.services.tts import tts_service
+from app.services.tts import (
+    tts_service, split_segments, wav_stream_header, pack_audio_archive,
+    VOICE_PITCH_SEMITONES, MIN_SPEED, MAX_SPEED
+)
+from app.services.tts_cache import tts_cache
+from app.services.phrase_pack import phrase_packs
+from app.services.audio_encoder import audio_encoder
 
 router = APIRouter()
 
 class TTSRequest(BaseModel):
     text: str
     language: str = "tw"
+    stream: bool = False
+    format: Optional[str] = None
+    speed: float = 1.0
+    voice: str = "default"
+
+def validate_voice(speed: float, voice: str):
+    if not MIN_SPEED <= speed <= MAX_SPEED:
+        raise HTTPException(status_code=400, detail=f"speed must be between {MIN_SPEED} and {MAX_SPEED}")
+    if voice not in VOICE_PITCH_SEMITONES:
+        raise HTTPException(status_code=400, detail=f"voice must be one of {', '.join(VOICE_PITCH_SEMITONES)}")
 
 @router.post("/synthesize")
-async def synthesize_text_post(request: TTSRequest):
+async def synthesize_text_post(request: TTSRequest, accept: Optional[str] = Header(None),
+                               if_none_match: Optional[str] = Header(None)):
     """
-    Receives text and language, and returns synthesized audio (WAV).
+    Receives text and language, and returns synthesized audio.
+    The output format (wav, opus, mp3, flac, pcm) comes from `format` or the Accept header; WAV by default.
+    Set stream=true to receive audio sentence by sentence as it is generated.
+    speed (0.5 - 2.0) and voice (default, male, female, deep) adjust the delivery.
     """
-    return await process_tts(request.text, request.language)
+    validate_voice(request.speed, request.voice)
+    audio_format = audio_encoder.negotiate(accept, request.format)
+    if request.stream:
+        return await stream_tts(request.text, request.language, audio_format, request.speed, request.voice)
+    return await process_tts(request.text, request.language, audio_format, if_none_match,
+                             request.speed, request.voice)
 
 @router.get("/synthesize")
-async def synthesize_text_get(text: str, language: str = "tw"):
+async def synthesize_text_get(text: str, language: str = "tw", stream: bool = False, format: Optional[str] = None,
+                              speed: float = 1.0, voice: str = "default",
+                              accept: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)):
     """
     GET version for easy playback in Swagger UI and standard browsers.
     Type your text here and click execute to play!
     """
-    return await process_tts(text, language)
+    validate_voice(speed, voice)
+    audio_format = audio_encoder.negotiate(accept, format)
+    if stream:
+        return await stream_tts(text, language, audio_format, speed, voice)
+    return await process_tts(text, language, audio_format, if_none_match, speed, voice)
+
+MAX_BATCH_ITEMS = 100
+
+class TTSBatchItem(BaseModel):
+    text: str
+    language: str = "tw"
+
+class TTSBatchRequest(BaseModel):
+    items: List[TTSBatchItem]
+    format: str = "wav"
+
+@router.post("/synthesize_batch")
+async def synthesize_batch(request: TTSBatchRequest):
+    """
+    Synthesizes a whole phrase board in one call.
+
+    Returns an indexed archive (application/vnd.voiceaid.audio-pack):
+    b"VAPK", a uint32 LE index length, a JSON index with one entry per item
+    (text, language, etag, offset, length or error), then the audio clips
+    encoded in the requested format.
+    Cached phrases are reused; only misses go through VITS, in padded batches.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to synthesize")
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    audio_format = audio_encoder.negotiate(requested=request.format)
+
+    # Cache lookups, model loading, VITS, encoding and cache writes all block:
+    # the whole batch runs in one worker thread
+    index, blobs, synthesized = await asyncio.to_thread(render_batch, request.items, audio_format)
+
+    return Response(
+        content=pack_audio_archive(index, blobs),
+        media_type="application/vnd.voiceaid.audio-pack",
+        headers={"X-Batch-Synthesized": str(synthesized), "X-Audio-Format": audio_format}
+    )
+
+def render_batch(items: List[TTSBatchItem], audio_format: str):
+    """Index entries and clips for a batch, plus how many clips went through VITS."""
+    index = []
+    blobs: List[Optional[bytes]] = []
+    misses = []
+    for i, item in enumerate(items):
+        key = tts_service.cache_key(item.text, item.language, audio_format)
+        entry = {"text": item.text, "language": item.language, "etag": f'"{key}"'}
+        audio = None
+        if not item.text.strip():
+            entry["error"] = "Empty text"
+        else:
+            audio = tts_service.lookup(item.text, item.language, audio_format)
+            if audio is None and audio_format != "wav":
+                wav = tts_service.lookup(item.text, item.language)
+                if wav is not None:
+                    audio = audio_encoder.transcode_wav(wav, audio_format)
+                    tts_cache.put(key, audio)
+            if audio is None:
+                if tts_service.supports(item.language):
+                    misses.append((i, key))
+                else:
+                    entry["error"] = "Language not supported"
+        index.append(entry)
+        blobs.append(audio)
+
+    if misses:
+        rendered = tts_service.synthesize_batch([items[i].text for i, _ in misses])
+        for (i, key), audio in zip(misses, rendered):
+            if audio is None:
+                index[i]["error"] = "Generation failed"
+                continue
+            audio = audio_encoder.transcode_wav(audio, audio_format)
+            tts_cache.put(key, audio)
+            blobs[i] = audio
+    return index, blobs, len(misses)
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters and tier sizes of the TTS audio cache and phrase packs.
+    """
+    return {**tts_cache.stats(), "phrase_packs": phrase_packs.stats()}
+
+async def process_tts(text: str, language: str, audio_format: str = "wav", if_none_match: Optional[str] = None,
+                      speed: float = 1.0, voice: str = "default"):
+    # The ETag is the content address of the request, so a phone that already
+    # holds this phrase can revalidate without the server touching VITS or the cache.
+    etag = f'"{tts_service.cache_key(text, language, audio_format, speed, voice)}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400", "Vary": "Accept"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
 
-async def process_tts(text: str, language: str):
     try:
-        audio_io, sampling_rate = tts_service.synthesize(text, language)
-        
-        if audio_io is None:
+        # VITS, effects and encoding are CPU-bound: keep them off the event loop
+        audio = await asyncio.to_thread(tts_service.synthesize_cached, text, language, audio_format, speed, voice)
+
+        if audio is None:
              raise HTTPException(status_code=400, detail="Language not supported or generation failed")
 
-        return StreamingResponse(audio_io, media_type="audio/wav")
+        media_type = audio_encoder.media_type(audio_format, tts_service.sampling_rate or 16000)
+        return Response(content=audio, media_type=media_type, headers=headers)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"TTS Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
+
+async def stream_tts(text: str, language: str, audio_format: str = "wav",
+                     speed: float = 1.0, voice: str = "default"):
+    """
+    Streams a WAV whose header declares an unknown length, followed by PCM
+    for each sentence/clause as soon as VITS finishes it. The first clause
+    is synthesized alone, so time-to-first-audio is one short segment.
+    With format=pcm the header is omitted and raw audio/L16 is streamed;
+    compressed formats are not streamed and fall back to WAV.
+    """
+    if not tts_service.supports(language):
+        raise HTTPException(status_code=400, detail="Language not supported or generation failed")
+
+    segments = split_segments(text)
+    if not segments:
+        raise HTTPException(status_code=400, detail="No text to synthesize")
+
+    raw_pcm = audio_format == "pcm"
+
+    async def audio_stream():
+        start_time = time.time()
+        if not raw_pcm:
+            yield wav_stream_header(tts_service.sampling_rate)
+        for i, segment in enumerate(segments):
+            # Short breath after sentence-final segments, none inside a sentence
+            pause = 0.15 if segment[-1] in ".!?" else 0.0
+            try:
+                pcm = await asyncio.to_thread(
+                    tts_service.synthesize_segment_pcm, segment, pause, raw_pcm, speed, voice
+                )
+            except Exception as e:
+                print(f"[TTS] ❌ Streaming segment {i} failed: {str(e)}")
+                return
+            if i == 0:
+                print(f"[TTS] ⏱️ Time to first audio: {round(time.time() - start_time, 3)}s "
+                      f"({len(segments)} segments)")
+            yield pcm
+
+    media_type = audio_encoder.media_type("pcm", tts_service.sampling_rate) if raw_pcm else "audio/wav"
+    return StreamingResponse(audio_stream(), media_type=media_type)
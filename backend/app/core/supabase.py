@@ -1,6 +1,7 @@
 
 import os
 from supabase import create_client, Client
+from postgrest import SyncPostgrestClient
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,3 +16,13 @@ supabase: Client = create_client(url, key)
 
 def get_supabase() -> Client:
     return supabase
+
+def get_user_postgrest(access_token: str) -> SyncPostgrestClient:
+    """
+    PostgREST client that acts as the caller (their Supabase JWT), so Row
+    Level Security applies to its queries. Use it as a context manager.
+    """
+    return SyncPostgrestClient(
+        f"{url}/rest/v1",
+        headers={"apikey": key, "Authorization": f"Bearer {access_token}"},
+    )
@@ -16,11 +16,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-from app.api import asr, tts, asr_stream, transcriptions
+from app.api import asr, tts, asr_stream, transcriptions, analytics
 app.include_router(asr.router, prefix="/asr", tags=["ASR"])
 app.include_router(asr_stream.router, prefix="/asr", tags=["ASR Streaming"])
 app.include_router(transcriptions.router, prefix="/transcriptions", tags=["Transcriptions"])
 app.include_router(tts.router, prefix="/tts", tags=["TTS"])
+app.include_router(analytics.router, prefix="/analytics", tags=["Analytics"])
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    # Periodic insight precompute, enabled by INSIGHT_PRECOMPUTE_INTERVAL + INSIGHTS_DATABASE_URL
+    from app.services.insight_precompute import start_precompute_scheduler
+    start_precompute_scheduler()
+    # Replay transcriptions left in the local outbox by an earlier run
+    from app.services.transcription_db import transcription_db
+    transcription_db.start()
+
+
+@app.on_event("shutdown")
+async def flush_pending_writes():
+    from app.services.transcription_db import transcription_db
+    await transcription_db.close()
 
 
 @app.get("/")
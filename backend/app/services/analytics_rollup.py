@@ -0,0 +1,109 @@
+"""
+Patient Analytics Metrics
+Practice metrics read from the daily/weekly rollups of patient_analytics
+(migration 024) instead of the raw session rows: compliance, streak and
+hours practiced, the inputs /predict/summary expects, plus the consecutive
+day streak and per-day and per-week series for dashboards. Days are UTC
+calendar days, as in the rollup tables. Queries run as the caller, so RLS
+decides which patients they can read.
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List
+from app.core.supabase import get_user_postgrest
+
+# Used by the app when a patient has no goals assigned today
+DEFAULT_COMPLIANCE = 80
+
+# Longest run of consecutive days that is looked up, counted over daily rows
+MAX_CONSECUTIVE_DAYS = 366
+
+
+class AnalyticsRollupService:
+    async def get_metrics(self, access_token: str, patient_id: str, days: int = 30) -> Dict[str, Any]:
+        """
+        Metrics of one patient over the last `days` days (today included).
+        streak and hours_practiced are the /predict/summary inputs as the
+        patient detail screen and the insight precompute job build them:
+        distinct active days and total practice hours over the window.
+        consecutive_days is the dashboards' streak, active days in a row
+        ending today (or yesterday).
+
+        Args:
+            access_token: The caller's Supabase JWT; rows are limited to what
+                RLS lets them read
+            patient_id: patient_profiles.id, or the patient's user id for
+                sessions recorded without a profile
+            days: Window for streak, hours practiced and the daily/weekly series
+        """
+        today = datetime.now(timezone.utc).date()
+        window_start = today - timedelta(days=days - 1)
+        since = today - timedelta(days=max(days, MAX_CONSECUTIVE_DAYS) - 1)
+        daily, weekly, goals = await asyncio.gather(
+            asyncio.to_thread(self._select_daily, access_token, patient_id, since),
+            asyncio.to_thread(self._select_weekly, access_token, patient_id,
+                              window_start - timedelta(days=window_start.weekday())),
+            asyncio.to_thread(self._select_goals, access_token, patient_id, today),
+        )
+        window = [row for row in daily if date.fromisoformat(row["day"]) >= window_start]
+
+        completed = sum(1 for goal in goals if goal.get("completed"))
+        duration_s = sum(row["duration_s"] or 0 for row in window)
+        return {
+            "patient_id": patient_id,
+            "days": days,
+            "compliance_rate": round(completed / len(goals) * 100) if goals else DEFAULT_COMPLIANCE,
+            "streak": len(window),
+            "hours_practiced": round(duration_s / 3600, 1),
+            "consecutive_days": self.consecutive_days({row["day"] for row in daily}, today),
+            "active_days": len(window),
+            "sessions": sum(row["sessions"] for row in window),
+            "word_count": sum(row["word_count"] for row in window),
+            "message_count": sum(row["message_count"] for row in window),
+            "goals": {"assigned_today": len(goals), "completed_today": completed},
+            "daily": window,
+            "weekly": weekly,
+        }
+
+    @staticmethod
+    def consecutive_days(active_days, today: date) -> int:
+        """Consecutive active days ending today, or yesterday if today has no session yet (as on the dashboards)."""
+        day = today if today.isoformat() in active_days else today - timedelta(days=1)
+        count = 0
+        while day.isoformat() in active_days:
+            count += 1
+            day -= timedelta(days=1)
+        return count
+
+    def _select_daily(self, access_token: str, patient_id: str, since: date) -> List[Dict[str, Any]]:
+        with get_user_postgrest(access_token) as client:
+            result = (client.from_("patient_analytics_daily")
+                      .select("day,sessions,duration_s,word_count,message_count")
+                      .eq("subject_id", patient_id)
+                      .gte("day", since.isoformat())
+                      .order("day")
+                      .execute())
+        return result.data or []
+
+    def _select_weekly(self, access_token: str, patient_id: str, since: date) -> List[Dict[str, Any]]:
+        with get_user_postgrest(access_token) as client:
+            result = (client.from_("patient_analytics_weekly")
+                      .select("week_start,sessions,active_days,duration_s,word_count,message_count")
+                      .eq("subject_id", patient_id)
+                      .gte("week_start", since.isoformat())
+                      .order("week_start")
+                      .execute())
+        return result.data or []
+
+    def _select_goals(self, access_token: str, patient_id: str, today: date) -> List[Dict[str, Any]]:
+        with get_user_postgrest(access_token) as client:
+            result = (client.from_("patient_goals")
+                      .select("completed")
+                      .eq("patient_id", patient_id)
+                      .eq("assigned_date", today.isoformat())
+                      .execute())
+        return result.data or []
+
+
+# Singleton
+analytics_rollup = AnalyticsRollupService()
@@ -1,6 +1,9 @@
+import threading
+from typing import Optional
 import torch
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline, StoppingCriteriaList
 import numpy as np
+from app.services.stream_session import CancellationStoppingCriteria, InferenceCancelled
 
 # Model IDs
 MODEL_ID_EN = "openai/whisper-base"
@@ -54,12 +57,14 @@ class ASRService:
             print(f"Error loading model {model_id}: {str(e)}")
             raise e
 
-    def transcribe(self, audio_data: np.ndarray, language: str = "en", sampling_rate: int = 16000) -> dict:
+    def transcribe(self, audio_data: np.ndarray, language: str = "en", sampling_rate: int = 16000,
+                   cancel_event: Optional[threading.Event] = None) -> dict:
         """
         Transcribes the given audio data.
         :param audio_data: Numpy array of audio samples (float32).
         :param language: Language code ('en' or 'tw').
         :param sampling_rate: Sampling rate of the audio (default 16000).
+        :param cancel_event: Optional event; once set, generation stops and InferenceCancelled is raised.
         :return: Dict containing transcription and metadata.
         """
         # Determine model based on language
@@ -107,8 +112,18 @@ class ASRService:
              # Multilingual mode with auto-detection
              pass
         
+        stop_on_cancel = None
+        if cancel_event is not None:
+            if cancel_event.is_set():
+                raise InferenceCancelled("Session cancelled before inference", started=False)
+            stop_on_cancel = CancellationStoppingCriteria(cancel_event)
+            gen_kwargs["stopping_criteria"] = StoppingCriteriaList([stop_on_cancel])
+
         # Run inference
         result = pipe(audio_data, generate_kwargs=gen_kwargs)
+
+        if stop_on_cancel is not None and stop_on_cancel.triggered:
+            raise InferenceCancelled("Session cancelled during generation")
         
         if not result or 'text' not in result:
              return {"text": "", "model": model_id, "detectedLanguage": language}
@@ -0,0 +1,116 @@
+"""
+Audio Encoder Service
+In-process encoding of synthesized speech to compressed formats through
+libsndfile (soundfile), negotiated from the Accept header or a format parameter.
+"""
+import io
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.io.wavfile
+import soundfile as sf
+
+# format name -> (libsndfile container, libsndfile subtype, media type)
+AUDIO_FORMATS = {
+    "wav": ("WAV", "PCM_16", "audio/wav"),
+    "flac": ("FLAC", "PCM_16", "audio/flac"),
+    "opus": ("OGG", "OPUS", "audio/ogg; codecs=opus"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "audio/mpeg"),
+    "pcm": (None, None, "audio/L16"),
+}
+
+# Accept media types -> format name
+MEDIA_TYPE_FORMATS = {
+    "audio/wav": "wav", "audio/wave": "wav", "audio/x-wav": "wav",
+    "audio/flac": "flac", "audio/x-flac": "flac",
+    "audio/ogg": "opus", "audio/opus": "opus",
+    "audio/mpeg": "mp3", "audio/mp3": "mp3",
+    "audio/l16": "pcm", "audio/pcm": "pcm",
+}
+
+# Opus only accepts these input rates
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+class AudioEncoder:
+    def __init__(self, default_format: str = "wav"):
+        """
+        Probes the linked libsndfile once so every request knows which
+        encoders are actually available (MP3 needs libsndfile >= 1.1,
+        Opus needs >= 1.0.29) without trial-and-error encoding.
+
+        Args:
+            default_format: Format used when the client expresses no preference
+        """
+        self.default_format = default_format
+        self.available = {"wav", "pcm"}
+        formats = sf.available_formats()
+        for name, (container, subtype, _) in AUDIO_FORMATS.items():
+            if container and container in formats and subtype in sf.available_subtypes(container):
+                self.available.add(name)
+        print(f"[AudioEncoder] Available formats: {', '.join(sorted(self.available))}")
+
+    def negotiate(self, accept: Optional[str] = None, requested: Optional[str] = None) -> str:
+        """
+        Picks the output format.
+        An explicit format parameter wins; otherwise the highest-q supported
+        Accept media type is used. Falls back to the default (WAV).
+        """
+        if requested:
+            requested = requested.lower().strip()
+            if requested in self.available:
+                return requested
+
+        best, best_q = None, 0.0
+        for part in (accept or "").split(","):
+            fields = [f.strip() for f in part.split(";")]
+            media_type = fields[0].lower()
+            q = 1.0
+            for param in fields[1:]:
+                if param.startswith("q="):
+                    try:
+                        q = float(param[2:])
+                    except ValueError:
+                        q = 0.0
+            fmt = MEDIA_TYPE_FORMATS.get(media_type)
+            if fmt in self.available and q > best_q:
+                best, best_q = fmt, q
+        return best or self.default_format
+
+    def media_type(self, fmt: str, sample_rate: int = 16000) -> str:
+        if fmt == "pcm":
+            return f"audio/L16; rate={sample_rate}; channels=1"
+        return AUDIO_FORMATS[fmt][2]
+
+    def encode(self, audio_int16: np.ndarray, sample_rate: int, fmt: str) -> bytes:
+        """Encodes mono 16-bit PCM samples to the given format."""
+        if fmt == "pcm":
+            return audio_int16.astype(">i2").tobytes()  # audio/L16 is big-endian
+        if fmt == "wav":
+            buffer = io.BytesIO()
+            scipy.io.wavfile.write(buffer, sample_rate, audio_int16)
+            return buffer.getvalue()
+
+        container, subtype, _ = AUDIO_FORMATS[fmt]
+        if fmt == "opus" and sample_rate not in OPUS_RATES:
+            audio_int16, sample_rate = self._resample(audio_int16, sample_rate, 48000)
+        buffer = io.BytesIO()
+        sf.write(buffer, audio_int16, sample_rate, format=container, subtype=subtype)
+        return buffer.getvalue()
+
+    def transcode_wav(self, wav_bytes: bytes, fmt: str) -> bytes:
+        """Re-encodes an already rendered WAV clip (e.g. from a phrase pack)."""
+        if fmt == "wav":
+            return wav_bytes
+        sample_rate, audio_int16 = scipy.io.wavfile.read(io.BytesIO(wav_bytes))
+        return self.encode(audio_int16, sample_rate, fmt)
+
+    @staticmethod
+    def _resample(audio_int16: np.ndarray, sample_rate: int, target_rate: int) -> Tuple[np.ndarray, int]:
+        from scipy.signal import resample_poly
+        divisor = np.gcd(sample_rate, target_rate)
+        resampled = resample_poly(audio_int16.astype(np.float32), target_rate // divisor, sample_rate // divisor)
+        return np.clip(resampled, -32768, 32767).astype(np.int16), target_rate
+
+# Singleton instance
+audio_encoder = AudioEncoder()
@@ -0,0 +1,149 @@
+"""
+Phrase Pack Service
+Pre-rendered TTS audio for fixed clinical vocabulary, stored as one packed
+file per language and memory-mapped at startup. Hits are served straight
+from the page cache without loading or running VITS.
+
+File layout (all integers little-endian):
+    header   b"VAPP" | uint16 version | uint32 entry count
+    index    count x (32-byte SHA-256 key | uint64 offset | uint32 length), sorted by key
+    data     concatenated WAV clips; offsets are relative to the start of this section
+"""
+import mmap
+import os
+import struct
+from typing import Dict, Optional
+
+PACK_MAGIC = b"VAPP"
+PACK_VERSION = 1
+HEADER = struct.Struct("<4sHI")
+ENTRY = struct.Struct("<32sQI")
+
+DEFAULT_PACK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models", "phrase_packs")
+
+
+def write_phrase_pack(path: str, clips: Dict[str, bytes]):
+    """
+    Writes a phrase pack.
+
+    Args:
+        path: Output file (written to a temp file, then swapped in atomically)
+        clips: Mapping of hex cache key -> WAV bytes
+    """
+    keys = sorted(bytes.fromhex(k) for k in clips)
+    index = []
+    offset = 0
+    for digest in keys:
+        length = len(clips[digest.hex()])
+        index.append(ENTRY.pack(digest, offset, length))
+        offset += length
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, len(keys)))
+        f.writelines(index)
+        for digest in keys:
+            f.write(clips[digest.hex()])
+    os.replace(tmp_path, path)
+
+
+class PhrasePack:
+    def __init__(self, path: str):
+        """
+        Memory-map a phrase pack for lookups
+
+        Args:
+            path: Path to a .pack file written by write_phrase_pack
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # mmap refuses empty files
+            self._file.close()
+            raise
+
+        if len(self._mm) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+        magic, version, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {PACK_VERSION} phrase pack")
+        if len(self._mm) < HEADER.size + self.count * ENTRY.size:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+        self._index_start = HEADER.size
+        self._data_start = self._index_start + self.count * ENTRY.size
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Binary-search the sorted index for a hex cache key.
+
+        Returns:
+            WAV bytes sliced from the mapping, or None if the phrase is not packed
+        """
+        digest = bytes.fromhex(key)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._index_start + mid * ENTRY.size
+            probe = self._mm[pos:pos + 32]
+            if probe < digest:
+                lo = mid + 1
+            elif probe > digest:
+                hi = mid
+            else:
+                _, offset, length = ENTRY.unpack_from(self._mm, pos)
+                start = self._data_start + offset
+                return self._mm[start:start + length]
+        return None
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+class PhrasePackStore:
+    def __init__(self, pack_dir: str = DEFAULT_PACK_DIR):
+        """
+        All phrase packs found in a directory, keyed by language (the file stem, e.g. tw.pack)
+
+        Args:
+            pack_dir: Directory scanned for *.pack files; missing directory means no packs
+        """
+        self.pack_dir = pack_dir
+        self.packs: Dict[str, PhrasePack] = {}
+        self.hits = 0
+
+        if not os.path.isdir(pack_dir):
+            return
+        for name in sorted(os.listdir(pack_dir)):
+            if not name.endswith(".pack"):
+                continue
+            try:
+                pack = PhrasePack(os.path.join(pack_dir, name))
+                self.packs[name[:-len(".pack")]] = pack
+                print(f"[TTS] 📦 Mapped phrase pack {name} ({pack.count} phrases)")
+            except (OSError, ValueError) as e:
+                print(f"[TTS] ⚠️ Skipping phrase pack {name}: {e}")
+
+    def get(self, language: str, key: str) -> Optional[bytes]:
+        pack = self.packs.get(language)
+        if pack is None:
+            return None
+        audio = pack.get(key)
+        if audio is not None:
+            self.hits += 1
+        return audio
+
+    def stats(self) -> dict:
+        return {
+            "packs": {language: pack.count for language, pack in self.packs.items()},
+            "hits": self.hits,
+        }
+
+# Singleton instance
+phrase_packs = PhrasePackStore(os.environ.get("TTS_PHRASE_PACK_DIR", DEFAULT_PACK_DIR))
@@ -0,0 +1,164 @@
+"""
+Stream Session Service for Live Transcription
+Tracks the inference work queued for one WebSocket so it can be cancelled
+as soon as the client disconnects, instead of being finished and thrown away.
+"""
+import asyncio
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import torch
+from transformers import StoppingCriteria
+
+# Chunks a session may have waiting for inference. Receiving no longer waits
+# for inference, so a client sending faster than ASR keeps up is bounded here
+MAX_PENDING_CHUNKS = int(os.environ.get("STREAM_MAX_PENDING_CHUNKS", "8"))
+
+
+class InferenceCancelled(Exception):
+    """Raised when a transcription is aborted because its session was cancelled."""
+
+    def __init__(self, message: str, started: bool = True):
+        super().__init__(message)
+        # False when the session was cancelled before generation began
+        self.started = started
+
+
+class CancellationStoppingCriteria(StoppingCriteria):
+    """
+    Stopping criteria that ends generation once the session's cancel event is set.
+    Checked by `generate` after every decoding step, so a running Whisper
+    generation stops within one token of the client disconnecting.
+    """
+
+    def __init__(self, cancel_event: threading.Event):
+        self.cancel_event = cancel_event
+        self.triggered = False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.cancel_event.is_set():
+            self.triggered = True
+        return torch.full(
+            (input_ids.shape[0],), self.triggered, dtype=torch.bool, device=input_ids.device
+        )
+
+
+class StreamMetrics:
+    def __init__(self):
+        """
+        Counters for inference avoided by cancelling disconnected sessions.
+        Updated from the event loop and from inference threads, hence the lock.
+        """
+        self._lock = threading.Lock()
+        self.sessions_cancelled = 0
+        self.chunks_dropped = 0
+        self.bytes_dropped = 0
+        self.generations_aborted = 0
+        self.audio_seconds_aborted = 0.0
+        self.chunks_shed = 0
+        self.bytes_shed = 0
+
+    def record_shed(self, bytes_shed: int):
+        with self._lock:
+            self.chunks_shed += 1
+            self.bytes_shed += bytes_shed
+
+    def record_cancel(self, chunks_dropped: int, bytes_dropped: int):
+        with self._lock:
+            self.sessions_cancelled += 1
+            self.chunks_dropped += chunks_dropped
+            self.bytes_dropped += bytes_dropped
+
+    def record_drop(self, bytes_dropped: int):
+        """A chunk taken off the queue whose session was cancelled before its inference began."""
+        with self._lock:
+            self.chunks_dropped += 1
+            self.bytes_dropped += bytes_dropped
+
+    def record_abort(self, audio_seconds: float):
+        with self._lock:
+            self.generations_aborted += 1
+            self.audio_seconds_aborted += audio_seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions_cancelled": self.sessions_cancelled,
+                "chunks_dropped": self.chunks_dropped,
+                "bytes_dropped": self.bytes_dropped,
+                "generations_aborted": self.generations_aborted,
+                "audio_seconds_aborted": round(self.audio_seconds_aborted, 2),
+                "chunks_shed": self.chunks_shed,
+                "bytes_shed": self.bytes_shed,
+            }
+
+
+class StreamSession:
+    def __init__(self, max_pending: int = MAX_PENDING_CHUNKS):
+        """
+        Per-WebSocket inference state
+
+        Holds the queue of chunks waiting for inference and the cancel event
+        shared with the inference thread.
+
+        Args:
+            max_pending: Queued chunks kept at most; older ones are shed first
+        """
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def submit(self, message: Dict[str, Any]) -> bool:
+        """
+        Queue a chunk message for the inference worker. When the queue is full
+        the oldest waiting chunk is dropped, so live results stay current.
+
+        Returns:
+            True if an older chunk was shed to make room
+        """
+        shed = False
+        if self.queue.full():
+            oldest = self.queue.get_nowait()
+            stream_metrics.record_shed(len(oldest.get("audio") or "") if oldest else 0)
+            shed = True
+        self.queue.put_nowait(message)
+        return shed
+
+    async def next_message(self) -> Optional[Dict[str, Any]]:
+        """Wait for the next queued chunk, or None once the session is cancelled."""
+        message = await self.queue.get()
+        if self.cancelled:
+            return None
+        return message
+
+    def cancel(self) -> int:
+        """
+        Cancel the session: stop any running generation and drop queued chunks.
+
+        Returns:
+            Number of queued chunks that were dropped before inference
+        """
+        if self.cancelled:
+            return 0
+        self.cancel_event.set()
+
+        dropped = 0
+        dropped_bytes = 0
+        while not self.queue.empty():
+            message = self.queue.get_nowait()
+            if message is not None:
+                dropped += 1
+                dropped_bytes += len(message.get("audio") or "")
+
+        # Wake the worker if it is blocked waiting for a chunk
+        self.queue.put_nowait(None)
+
+        stream_metrics.record_cancel(dropped, dropped_bytes)
+        return dropped
+
+# Singleton instance
+stream_metrics = StreamMetrics()
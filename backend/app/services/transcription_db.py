@@ -1,58 +1,446 @@
+"""
+Transcription Persistence
+Write-behind storage for transcription records. Each save is first committed
+to a local SQLite outbox (see transcription_outbox), so it survives Supabase
+outages and worker restarts. A background replayer drains the outbox to
+Supabase in append order as multi-row upserts, either when a batch fills or
+after a short time window, retrying failed batches with exponential backoff.
+The outbox is bounded: once max_depth rows are waiting, saves wait briefly
+for the replayer to make room and then fail with OutboxFull, so a long
+outage pushes back on clients instead of filling the disk.
+supabase-py and sqlite3 are synchronous, so both run in worker threads and
+never block the event loop.
+
+History reads run as the caller (their Supabase JWT) so RLS applies, are
+keyset-paginated on (user_id, created_at, id), select only the list columns
+and are cached per user and caller for a few seconds; a user's cached pages
+are dropped as soon as the replayer writes new rows for them.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+from collections import OrderedDict
 from datetime import datetime
-from uuid import uuid4
-from typing import Optional, Dict, Any
-from app.core.supabase import get_supabase
+from uuid import UUID, uuid4
+from typing import Optional, Dict, Any, List
+from app.core.supabase import get_supabase, get_user_postgrest
+from app.services.transcription_outbox import TranscriptionOutbox, DEFAULT_OUTBOX_PATH
+
+# Columns returned by history reads
+LIST_COLUMNS = "id,text,language,created_at,confidence_score,model_used,is_live_mode,duration_seconds,audio_url"
+
+
+class OutboxFull(Exception):
+    """Raised when a save finds the outbox at max_depth and no room is made within full_wait."""
+
 
 class TranscriptionDBService:
-    def __init__(self):
+    def __init__(self,
+                 outbox: TranscriptionOutbox,
+                 batch_size: int = 50,
+                 flush_interval: float = 0.2,
+                 ack_timeout: float = 10.0,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 30.0,
+                 max_depth: int = 10000,
+                 full_wait: float = 2.0,
+                 read_cache_ttl: float = 15.0,
+                 read_cache_users: int = 1024):
+        """
+        Initialize the service
+
+        Args:
+            outbox: Local outbox every save is committed to first
+            batch_size: Most rows written in one upsert
+            flush_interval: Seconds a partial batch waits for more rows
+            ack_timeout: Longest a durable save waits for Supabase before it
+                answers with the row still pending in the outbox
+            backoff_base: First retry delay in seconds, doubled on every retry
+            backoff_max: Upper bound of a retry delay in seconds
+            max_depth: Most rows waiting in the outbox; a batch larger than
+                this is still accepted into an empty outbox
+            full_wait: Seconds a save waits for room in a full outbox before
+                it raises OutboxFull
+            read_cache_ttl: Seconds a cached history page is served
+            read_cache_users: Users whose pages are cached at once (LRU)
+        """
         self.supabase = get_supabase()
         self.table_name = "transcriptions"
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ack_timeout = ack_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_depth = max_depth
+        self.full_wait = full_wait
+
+        self._depth = 0  # Outbox entries not yet written, mirrored in memory
+        self._reserved = 0  # Rows of saves between the depth check and the append
+        self._space: Optional[asyncio.Event] = None
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._replayer: Optional[asyncio.Task] = None
+        self._closing = False
+        self.stats = {"saved": 0, "written": 0, "dead_letters": 0, "batches": 0, "retries": 0,
+                      "rejected_full": 0}
+
+        self.read_cache_ttl = read_cache_ttl
+        self.read_cache_users = read_cache_users
+        # user_id -> {(caller, limit, cursor): (expires_at, page)}
+        self._read_cache: "OrderedDict[str, Dict[tuple, tuple]]" = OrderedDict()
+        # user_id -> invalidation count, so a read that raced a write is not cached
+        self._read_generation: Dict[str, int] = {}
+        self.read_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _build_row(self, user_id: str, text: str, language: str,
+                   metadata: Optional[Dict[str, Any]] = None, audio_url: Optional[str] = None,
+                   duration: Optional[int] = None) -> Dict[str, Any]:
+        now = datetime.now().isoformat()
+        # The id is assigned here: it is returned to fire-and-forget callers
+        # immediately and is the idempotency key of the outbox and the upsert
+        data = {
+            "id": str(uuid4()),
+            "user_id": user_id,
+            "text": text,
+            "language": language,
+            "created_at": now,
+            "updated_at": now
+        }
+
+        if metadata:
+            if "confidence" in metadata:
+                data["confidence_score"] = metadata["confidence"]
+            if "model" in metadata:
+                data["model_used"] = metadata["model"]
+            if "is_live" in metadata:
+                data["is_live_mode"] = metadata["is_live"]
+
+        if audio_url:
+            data["audio_url"] = audio_url
+
+        if duration:
+            data["duration_seconds"] = duration
 
-    async def save_transcription(self, 
-                               user_id: str, 
-                               text: str, 
-                               language: str, 
+        return data
+
+    def start(self):
+        """Starts the outbox replayer on the running event loop (idempotent); replays rows left by earlier runs."""
+        if self._replayer is None or self._replayer.done():
+            self._wake, self._full, self._stop = asyncio.Event(), asyncio.Event(), asyncio.Event()
+            self._space = asyncio.Event()
+            self._closing = False
+            self._depth = self.outbox.depth()
+            if self._depth:
+                print(f"[DB] Replaying {self._depth} transcription(s) from the outbox")
+            self._replayer = asyncio.create_task(self._replay_loop())
+
+    async def save_transcription(self,
+                               user_id: str,
+                               text: str,
+                               language: str,
                                metadata: Dict[str, Any] = None,
                                audio_url: Optional[str] = None,
-                               duration: Optional[int] = None) -> Dict[str, Any]:
+                               duration: Optional[int] = None,
+                               wait: bool = True) -> Optional[Dict[str, Any]]:
         """
         Saves a transcription record to the database.
+
+        The row is committed to the local outbox before this returns, so it is
+        never lost; 'synced' in the result says whether it has also reached
+        Supabase. Returns None only if the outbox itself cannot be written.
+
+        Args:
+            wait: Acknowledged-durable mode: wait (up to ack_timeout) for the
+                batch holding the row to be written to Supabase. With False the
+                row is returned as soon as it is in the outbox (fire-and-forget).
         """
+        rows = await self.save_transcriptions(
+            [dict(user_id=user_id, text=text, language=language, metadata=metadata,
+                  audio_url=audio_url, duration=duration)],
+            wait=wait,
+        )
+        return rows[0] if rows else None
+
+    async def save_transcriptions(self, records: List[Dict[str, Any]], wait: bool = True) -> Optional[List[Dict[str, Any]]]:
+        """
+        Saves several transcription records with one outbox transaction; the
+        replayer writes them to Supabase as multi-row upserts.
+
+        Args:
+            records: Keyword arguments of save_transcription (without wait), one per row
+            wait: As for save_transcription, with one ack_timeout for the whole batch
+
+        Returns:
+            The rows in input order, each with 'synced', or None if the outbox
+            cannot be written
+
+        Raises:
+            OutboxFull: If the outbox stays at max_depth for full_wait seconds
+        """
+        rows = [self._build_row(**record) for record in records]
+        futures = {}
+        reserved = 0
+        if not self._closing:
+            self.start()
+            await self._wait_for_space(len(rows))
+            self._reserved += len(rows)
+            reserved = len(rows)
+            if wait:
+                # Registered before the append: the replayer may write the rows before we resume
+                loop = asyncio.get_running_loop()
+                futures = {row["id"]: loop.create_future() for row in rows}
+                self._waiters.update(futures)
         try:
-            data = {
-                "user_id": user_id,
-                "text": text,
-                "language": language,
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }
-            
-            if metadata:
-                if "confidence" in metadata:
-                    data["confidence_score"] = metadata["confidence"]
-                if "model" in metadata:
-                    data["model_used"] = metadata["model"]
-                if "is_live" in metadata:
-                    data["is_live_mode"] = metadata["is_live"]
-                    
-            if audio_url:
-                data["audio_url"] = audio_url
-            
-            if duration:
-                data["duration_seconds"] = duration
-
-            # Insert into Supabase
-            result = self.supabase.table(self.table_name).insert(data).execute()
-            
-            if result.data and len(result.data) > 0:
-                print(f"[DB] Saved transcription: {result.data[0]['id']}")
-                return result.data[0]
-            return None
-            
+            await asyncio.to_thread(self.outbox.append, rows)
         except Exception as e:
-            print(f"[DB] Error saving transcription: {str(e)}")
-            # Don't raise, just log. We don't want to break the app if DB fails.
+            for key in futures:
+                self._waiters.pop(key, None)
+            print(f"[DB] Error writing {len(rows)} transcription(s) to the outbox: {str(e)}")
             return None
+        finally:
+            self._reserved -= reserved
+
+        self.stats["saved"] += len(rows)
+        if self._closing:
+            # Left in the outbox for the next start
+            return [{**row, "synced": False} for row in rows]
+        self._depth += len(rows)
+        self._wake.set()
+        if self._depth >= self.batch_size:
+            self._full.set()
+
+        if futures:
+            try:
+                await asyncio.wait(list(futures.values()), timeout=self.ack_timeout)
+            finally:
+                for key in futures:
+                    self._waiters.pop(key, None)
+        return [
+            {**row, "synced": bool(futures) and futures[row["id"]].done() and futures[row["id"]].result()}
+            for row in rows
+        ]
+
+    async def _wait_for_space(self, count: int):
+        deadline = time.monotonic() + self.full_wait
+        while self._depth + self._reserved > 0 and self._depth + self._reserved + count > self.max_depth:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats["rejected_full"] += 1
+                raise OutboxFull(f"Transcription outbox is full ({self._depth} rows waiting for Supabase)")
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _replay_loop(self):
+        failures, isolate = 0, False
+        while True:
+            if self._depth <= 0:
+                if self._closing:
+                    break
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            if self._depth < self.batch_size and not (self._closing or failures or isolate):
+                # Give a partial batch a short window to fill
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            entries = await asyncio.to_thread(self.outbox.peek, 1 if isolate else self.batch_size)
+            if not entries:
+                self._depth = 0
+                self._space.set()
+                continue
+            seqs = [seq for seq, _ in entries]
+            try:
+                await asyncio.to_thread(self._insert, [row for _, row in entries])
+            except Exception as e:
+                if self._is_rejected(e):
+                    if len(entries) > 1:
+                        # Retry one row at a time to find the one Supabase rejects
+                        isolate = True
+                    else:
+                        await asyncio.to_thread(self.outbox.dead_letter, seqs[0], str(e))
+                        self._depth -= 1
+                        self._space.set()
+                        self.stats["dead_letters"] += 1
+                        self._resolve(entries, False)
+                        print(f"[DB] Transcription {entries[0][1]['id']} rejected, moved to dead letters: {str(e)}")
+                    continue
+                await asyncio.to_thread(self.outbox.record_failure, seqs, str(e))
+                if self._closing:
+                    print(f"[DB] Supabase unavailable at shutdown, {self._depth} transcription(s) stay in the outbox")
+                    break
+                self.stats["retries"] += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** failures) * random.uniform(0.5, 1.0)
+                failures += 1
+                print(f"[DB] Insert failed ({str(e)}), {self._depth} pending, retrying in {delay:.1f}s")
+                try:
+                    await asyncio.wait_for(self._stop.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            failures, isolate = 0, False
+            await asyncio.to_thread(self.outbox.ack, seqs)
+            self._depth -= len(entries)
+            self._space.set()
+            self.stats["batches"] += 1
+            self.stats["written"] += len(entries)
+            self._resolve(entries, True)
+            self.invalidate_reads({row["user_id"] for _, row in entries})
+            print(f"[DB] Saved {len(entries)} transcription(s)")
+
+    def _resolve(self, entries, synced: bool):
+        for _, row in entries:
+            future = self._waiters.get(row["id"])
+            if future is not None and not future.done():
+                future.set_result(synced)
+
+    @staticmethod
+    def _is_rejected(error: Exception) -> bool:
+        """Postgres data and integrity errors (SQLSTATE 22xxx/23xxx) fail on every retry."""
+        return str(getattr(error, "code", "") or "")[:2] in ("22", "23")
+
+    def _insert(self, rows: List[Dict[str, Any]]):
+        # Rows carry their own ids (the idempotency key), so replaying a batch
+        # after an ambiguous failure does not insert anything twice
+        self.supabase.table(self.table_name).upsert(rows, on_conflict="id", ignore_duplicates=True).execute()
+
+    async def list_transcriptions(self, access_token: str, user_id: str, limit: int = 50,
+                                  cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        One page of a user's transcriptions, newest first, read as the caller
+        so RLS decides which rows they can see.
+
+        Args:
+            access_token: The caller's Supabase access token
+            user_id: Owner of the transcriptions
+            limit: Page size
+            cursor: next_cursor of the previous page; None for the first page
+
+        Returns:
+            {"items": [...], "next_cursor": str or None, "cached": bool}
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        # Pages are cached per caller: RLS may show two callers different rows
+        key = (hashlib.sha256(access_token.encode()).hexdigest(), limit, cursor)
+        entry = self._read_cache.get(user_id, {}).get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._read_cache.move_to_end(user_id)
+            self.read_stats["hits"] += 1
+            return {**entry[1], "cached": True}
+
+        self.read_stats["misses"] += 1
+        after = self._decode_cursor(cursor) if cursor else None
+        generation = self._read_generation.get(user_id, 0)
+        rows = await asyncio.to_thread(self._select_page, access_token, user_id, limit + 1, after)
+        items = rows[:limit]
+        next_cursor = self._encode_cursor(items[-1]) if len(rows) > limit else None
+        page = {"items": items, "next_cursor": next_cursor}
+        if self._read_generation.get(user_id, 0) != generation:
+            # New rows were written while we read; this page may already be stale
+            return {**page, "cached": False}
+
+        pages = self._read_cache.setdefault(user_id, {})
+        pages[key] = (time.monotonic() + self.read_cache_ttl, page)
+        self._read_cache.move_to_end(user_id)
+        while len(self._read_cache) > self.read_cache_users:
+            self._read_cache.popitem(last=False)
+        return {**page, "cached": False}
+
+    def _select_page(self, access_token: str, user_id: str, limit: int, after: Optional[tuple]) -> List[Dict[str, Any]]:
+        # Seek past the previous page on (created_at, id) instead of using an
+        # offset, so every page is an index range scan of the same cost. The
+        # lte bound starts the scan; the or_ only breaks created_at ties on id
+        with get_user_postgrest(access_token) as client:
+            query = (client.from_(self.table_name)
+                     .select(LIST_COLUMNS)
+                     .eq("user_id", user_id))
+            if after:
+                created_at, row_id = after
+                query = (query.lte("created_at", created_at)
+                         .or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id})'))
+            result = query.order("created_at", desc=True).order("id", desc=True).limit(limit).execute()
+        return result.data or []
+
+    @staticmethod
+    def _encode_cursor(row: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps([row["created_at"], row["id"]]).encode()).decode().rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple:
+        try:
+            created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+            return str(created_at), str(UUID(str(row_id)))
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    async def search_history(self, access_token: str, query: str, patient_id: Optional[str] = None,
+                             transcriptions: bool = True, journals: bool = True,
+                             limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Ranked full-text/trigram search over transcriptions and voice journals
+        (search_history() in migration 023), run as the caller so RLS decides
+        what they can see.
+        """
+        params = {
+            "query": query,
+            "patient_id": patient_id,
+            "include_transcriptions": transcriptions,
+            "include_journals": journals,
+            "result_limit": limit,
+            "result_offset": offset,
+        }
+
+        def run():
+            with get_user_postgrest(access_token) as client:
+                return client.rpc("search_history", params).execute().data or []
+
+        return await asyncio.to_thread(run)
+
+    def invalidate_reads(self, user_ids):
+        """Drops cached history pages of users whose transcriptions changed."""
+        for user_id in user_ids:
+            self._read_generation[user_id] = self._read_generation.get(user_id, 0) + 1
+            if self._read_cache.pop(user_id, None) is not None:
+                self.read_stats["invalidations"] += 1
+
+    @property
+    def backlog(self) -> int:
+        return max(self._depth, 0)
+
+    async def close(self):
+        """Writes as much of the outbox as Supabase accepts and stops the replayer; call on shutdown."""
+        if self._replayer is None or self._replayer.done():
+            return
+        self._closing = True
+        for event in (self._stop, self._wake, self._full):
+            event.set()
+        await self._replayer
+        print(f"[DB] Transcription writer stopped: {self.stats}, {self.backlog} left in the outbox")
 
 # Singleton
-transcription_db = TranscriptionDBService()
+transcription_db = TranscriptionDBService(
+    TranscriptionOutbox(os.environ.get("TRANSCRIPTION_OUTBOX_PATH", DEFAULT_OUTBOX_PATH)),
+    batch_size=int(os.environ.get("TRANSCRIPTION_BATCH_SIZE", "50")),
+    flush_interval=int(os.environ.get("TRANSCRIPTION_FLUSH_MS", "200")) / 1000,
+    ack_timeout=int(os.environ.get("TRANSCRIPTION_ACK_TIMEOUT_MS", "10000")) / 1000,
+    max_depth=int(os.environ.get("TRANSCRIPTION_OUTBOX_MAX_DEPTH", "10000")),
+    full_wait=int(os.environ.get("TRANSCRIPTION_OUTBOX_FULL_WAIT_MS", "2000")) / 1000,
+    read_cache_ttl=float(os.environ.get("TRANSCRIPTION_READ_CACHE_TTL", "15")),
+)
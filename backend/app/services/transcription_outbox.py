@@ -0,0 +1,117 @@
+"""
+Transcription Outbox
+Append-only local SQLite outbox for transcription rows. Every save is
+committed here first (WAL journal, synchronous=FULL), so a row survives
+Supabase outages and worker restarts; the replayer in transcription_db
+drains entries to Supabase in append order and deletes them once written.
+Rows are keyed by their transcription id, which doubles as the idempotency
+key for the remote upsert.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_OUTBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models", "outbox", "transcriptions.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    seq INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    error TEXT
+);
+"""
+
+
+class TranscriptionOutbox:
+    def __init__(self, path: str = DEFAULT_OUTBOX_PATH):
+        """
+        Open (or create) the outbox
+
+        Args:
+            path: SQLite file; its directory is created if needed
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Autocommit mode; writes use explicit transactions
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def append(self, rows: List[Dict[str, Any]]):
+        """Commits rows to the outbox in one transaction; rows already present are ignored."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO outbox (key, payload, created_at) VALUES (?, ?, ?)",
+                    [(row["id"], json.dumps(row, ensure_ascii=False), now) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def peek(self, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """Oldest (seq, row) entries, in append order."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT seq, payload FROM outbox ORDER BY seq LIMIT ?", (limit,))
+            return [(seq, json.loads(payload)) for seq, payload in cursor.fetchall()]
+
+    def ack(self, seqs: List[int]):
+        """Removes entries that were written to Supabase."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def record_failure(self, seqs: List[int], error: str):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE seq = ?",
+                [(error, seq) for seq in seqs],
+            )
+
+    def dead_letter(self, seq: int, error: str):
+        """Moves an entry Supabase rejects outright out of the way of the rest."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dead_letters (seq, key, payload, created_at, failed_at, error) "
+                "SELECT seq, key, payload, created_at, ?, ? FROM outbox WHERE seq = ?",
+                (time.time(), error, seq),
+            )
+            self._conn.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+            self._conn.execute("COMMIT")
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            depth, oldest = self._conn.execute("SELECT COUNT(*), MIN(created_at) FROM outbox").fetchone()
+            dead = self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        return {
+            "depth": depth,
+            "oldest_age_s": round(time.time() - oldest, 1) if oldest is not None else None,
+            "dead_letters": dead,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -4,9 +4,109 @@ Model: facebook/mms-tts-aka
 """
 
 import io
+import os
+import re
+import json
+import struct
+from fractions import Fraction
+from typing import Optional, List, Dict, Any
+import numpy as np
 import torch
 import scipy.io.wavfile
+from scipy.signal import resample_poly
 from transformers import VitsModel, AutoTokenizer
+from app.services.tts_cache import tts_cache
+from app.services.phrase_pack import phrase_packs
+from app.services.audio_encoder import audio_encoder
+from app.services.tts_engine import create_engine
+
+# Sentence and clause boundaries used to cut text for streaming synthesis
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+CLAUSE_BOUNDARY = re.compile(r'(?<=[,;:])\s+')
+
+def split_segments(text: str, max_chars: int = 120) -> List[str]:
+    """
+    Splits text into segments for streaming synthesis.
+
+    The first segment is the first clause on its own so audio starts as early
+    as possible; later clauses are merged back up to max_chars per sentence
+    to keep natural prosody.
+    """
+    segments = []
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        current = ""
+        for clause in CLAUSE_BOUNDARY.split(sentence):
+            clause = clause.strip()
+            if not clause:
+                continue
+            if not segments and not current:
+                segments.append(clause)
+                continue
+            if current and len(current) + len(clause) + 1 > max_chars:
+                segments.append(current)
+                current = clause
+            else:
+                current = f"{current} {clause}" if current else clause
+        if current:
+            segments.append(current)
+    return segments
+
+def wav_stream_header(sample_rate: int, bits_per_sample: int = 16, channels: int = 1) -> bytes:
+    """
+    WAV header for audio of unknown length.
+    RIFF and data sizes are set to the maximum, which players treat as "read until EOF".
+    """
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF - 36)
+    )
+
+ARCHIVE_MAGIC = b"VAPK"
+
+def pack_audio_archive(index: List[Dict[str, Any]], blobs: List[Optional[bytes]]) -> bytes:
+    """
+    Packs several audio clips into one indexed archive.
+
+    Layout: b"VAPK" | uint32 LE index length | UTF-8 JSON index | concatenated clips.
+    Each index entry gains "offset" and "length" into the clip section
+    (both 0 for entries whose blob is None, which should carry an "error").
+    """
+    offset = 0
+    for entry, blob in zip(index, blobs):
+        entry["offset"] = offset
+        entry["length"] = len(blob) if blob is not None else 0
+        offset += entry["length"]
+    index_bytes = json.dumps(index, ensure_ascii=False).encode("utf-8")
+    return b"".join(
+        [ARCHIVE_MAGIC, struct.pack("<I", len(index_bytes)), index_bytes]
+        + [blob for blob in blobs if blob is not None]
+    )
+
+# Pitch offset per voice, in semitones
+VOICE_PITCH_SEMITONES = {"default": 0.0, "male": 0.0, "female": 3.5, "deep": -2.0}
+MIN_SPEED, MAX_SPEED = 0.5, 2.0
+
+def voice_variant(speed: float = 1.0, voice: str = "default") -> str:
+    """Cache-key suffix for the voice settings; empty for the default voice at normal speed."""
+    if speed == 1.0 and VOICE_PITCH_SEMITONES.get(voice, 0.0) == 0.0:
+        return ""
+    return f"speed={speed:.2f};voice={voice}"
+
+def shift_pitch(audio: np.ndarray, ratio: float) -> np.ndarray:
+    """
+    Raises (ratio > 1) or lowers the pitch by resampling, which also shortens
+    or stretches the clip by the same ratio. Callers compensate for the
+    duration change at generation time through the VITS speaking rate, so no
+    phase vocoder is needed. resample_poly applies its anti-aliasing filter
+    in one vectorized polyphase pass.
+    """
+    if ratio == 1.0:
+        return audio
+    fraction = Fraction(ratio).limit_denominator(64)
+    return resample_poly(audio, fraction.denominator, fraction.numerator)
 
 class TTSService:
     def __init__(self):
@@ -14,50 +114,140 @@ class TTSService:
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model = None
         self.tokenizer = None
-        self.models_available = self._load_model()
-        
+        self.engine = None
+        self.models_available = False
+        self._load_attempted = False
+        # TTS_PRELOAD=0 defers the model load to the first phrase that is not
+        # pre-rendered, so nodes serving mostly phrase-pack hits never load VITS.
+        if os.environ.get("TTS_PRELOAD", "1") != "0":
+            self._ensure_model()
+
+    def _ensure_model(self) -> bool:
+        """Loads the model on first use; returns whether it is available."""
+        if not self._load_attempted:
+            self._load_attempted = True
+            self.models_available = self._load_model()
+        return self.models_available
+
     def _load_model(self) -> bool:
         """Load the MMS Akan TTS model from Hugging Face"""
         try:
             print(f"[TTS] Downloading/Loading {self.model_id} on {self.device}...")
             self.model = VitsModel.from_pretrained(self.model_id).to(self.device)
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+            self.engine = create_engine(self.model, self.model_id, self.device)
             print(f"[TTS] ✅ Akan TTS voice loaded successfully!")
             return True
         except Exception as e:
             print(f"[TTS] ❌ Error loading TTS model: {str(e)}")
             return False
 
-    def synthesize(self, text: str, language: str = "tw") -> tuple[io.BytesIO, int]:
+    def supports(self, language: str) -> bool:
+        """Whether a request in this language can be synthesized right now."""
+        return language in ["tw", "aka", "akan"] and self._ensure_model()
+
+    @property
+    def sampling_rate(self) -> int:
+        return self.model.config.sampling_rate if self.model is not None else 0
+
+    def _generate_pcm(self, text: str, speed: float = 1.0, voice: str = "default") -> np.ndarray:
+        """
+        Runs VITS on the text and returns 16-bit integer PCM samples.
+
+        :param speed: Speaking rate multiplier, applied through the VITS length scale
+        :param voice: Key of VOICE_PITCH_SEMITONES; the pitch shift is resampling-based
+        """
+        speed = min(max(speed, MIN_SPEED), MAX_SPEED)
+        pitch_ratio = 2.0 ** (VOICE_PITCH_SEMITONES.get(voice, 0.0) / 12.0)
+
+        # Tokenize text
+        inputs = self.tokenizer(text, return_tensors="pt")
+
+        # Generate audio waveform, slowed by the pitch ratio so that the
+        # resampling below brings the duration back to the requested speed
+        waveforms, _ = self.engine.run(inputs["input_ids"], inputs["attention_mask"], speed / pitch_ratio)
+
+        # Convert to numpy array (1D) and scale to 16-bit integer PCM
+        audio_numpy = shift_pitch(waveforms[0], pitch_ratio)
+        return (np.clip(audio_numpy, -1.0, 1.0) * 32767.0).astype(np.int16)
+
+    def _encode_wav(self, audio_int16: np.ndarray) -> bytes:
+        audio_bytes = io.BytesIO()
+        scipy.io.wavfile.write(audio_bytes, self.sampling_rate, audio_int16)
+        return audio_bytes.getvalue()
+
+    def synthesize_batch(self, texts: List[str], batch_size: int = 8) -> List[Optional[bytes]]:
+        """
+        Synthesizes many short phrases with padded VITS forward passes.
+
+        Texts are grouped by length to keep padding small. Padding is masked
+        through the tokenizer's attention mask and each waveform is cut back
+        to its own length using the model's per-item sequence_lengths.
+
+        :param texts: Phrases to synthesize (all in the model's language)
+        :param batch_size: Phrases per forward pass
+        :return: WAV bytes per text in input order (None where a batch failed)
+        """
+        results: List[Optional[bytes]] = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            try:
+                inputs = self.tokenizer(
+                    [texts[i] for i in indices], padding=True, return_tensors="pt"
+                )
+                waveforms, lengths = self.engine.run(inputs["input_ids"], inputs["attention_mask"])
+            except Exception as e:
+                print(f"[TTS] ❌ Batch synthesis error: {str(e)}")
+                continue
+
+            for i, waveform, length in zip(indices, waveforms, lengths):
+                audio_int16 = (np.clip(waveform[:int(length)], -1.0, 1.0) * 32767.0).astype(np.int16)
+                results[i] = self._encode_wav(audio_int16)
+
+        print(f"[TTS] ✅ Batch synthesized {sum(r is not None for r in results)}/{len(texts)} phrases")
+        return results
+
+    def synthesize_segment_pcm(self, text: str, pause: float = 0.0, big_endian: bool = False,
+                               speed: float = 1.0, voice: str = "default") -> bytes:
+        """
+        Synthesizes one streaming segment to raw 16-bit PCM bytes.
+
+        :param text: Segment text (a sentence or clause)
+        :param pause: Seconds of silence appended after the segment
+        :param big_endian: Network byte order for audio/L16; WAV data is little-endian
+        :param speed: Speaking rate multiplier
+        :param voice: Voice preset (see VOICE_PITCH_SEMITONES)
+        """
+        audio = self._generate_pcm(text, speed, voice)
+        if pause > 0:
+            audio = np.pad(audio, (0, int(pause * self.sampling_rate)), mode='constant')
+        return audio.astype('>i2' if big_endian else '<i2').tobytes()
+
+    def synthesize(self, text: str, language: str = "tw", speed: float = 1.0,
+                   voice: str = "default") -> tuple[io.BytesIO, int]:
         """
         Synthesizes text to speech using MMS.
         
         :param text: Text to synthesize
         :param language: Language code ('tw' for Twi/Akan)
+        :param speed: Speaking rate multiplier (0.5 - 2.0)
+        :param voice: Voice preset (see VOICE_PITCH_SEMITONES)
         :return: Tuple of (wav_bytes_io, sampling_rate) or (None, 0) for fallback
         """
         if language not in ["tw", "aka", "akan"]:
             print(f"[TTS] Language {language} not supported by this model.")
             return None, 0
             
-        if not self.models_available or self.model is None:
+        if not self._ensure_model():
             print(f"[TTS] Model not available.")
             return None, 0
         
         try:
             print(f"[TTS] 🎤 Synthesizing: '{text[:60]}...'")
             
-            # Tokenize text
-            inputs = self.tokenizer(text, return_tensors="pt").to(self.device)
-            
-            # Generate audio waveform
-            with torch.no_grad():
-                output = self.model(**inputs).waveform
-                
-            # Convert to numpy array (1D) and scale to 16-bit integer PCM
-            import numpy as np
-            audio_numpy = output.squeeze().cpu().numpy()
-            audio_numpy_int16 = (audio_numpy * 32767.0).astype(np.int16)
+            audio_numpy_int16 = self._generate_pcm(text, speed, voice)
             sample_rate = self.model.config.sampling_rate
             
             # Write to BytesIO Buffer
@@ -75,4 +265,58 @@ class TTSService:
             traceback.print_exc()
             return None, 0
 
+    @staticmethod
+    def canonical_language(language: str) -> str:
+        """Maps the accepted Akan codes onto one, so they share cache keys and phrase packs."""
+        language = (language or "").lower().strip()
+        return "tw" if language in ["tw", "aka", "akan"] else language
+
+    def cache_key(self, text: str, language: str = "tw", audio_format: str = "wav",
+                  speed: float = 1.0, voice: str = "default") -> str:
+        """Content address (and ETag) of the audio this service produces for the request."""
+        return tts_cache.make_key(text, self.canonical_language(language), self.model_id, audio_format,
+                                  voice_variant(speed, voice))
+
+    def lookup(self, text: str, language: str = "tw", audio_format: str = "wav",
+               speed: float = 1.0, voice: str = "default") -> Optional[bytes]:
+        """
+        Returns already-rendered audio from the TTS cache or, for WAV, a phrase
+        pack, without touching the model. None means the phrase needs synthesis.
+        """
+        key = self.cache_key(text, language, audio_format, speed, voice)
+        if audio_format == "wav" and not voice_variant(speed, voice):
+            audio = phrase_packs.get(self.canonical_language(language), key)
+            if audio is not None:
+                return audio
+        return tts_cache.get(key)
+
+    def synthesize_cached(self, text: str, language: str = "tw", audio_format: str = "wav",
+                          speed: float = 1.0, voice: str = "default") -> Optional[bytes]:
+        """
+        Returns encoded audio for the text, serving pre-rendered and repeat
+        phrases from the phrase packs and TTS cache. The cache stores the
+        encoded bytes, so compressed formats are only encoded once.
+
+        :return: The cached bytes object itself (not a copy), or None if synthesis failed
+        """
+        audio = self.lookup(text, language, audio_format, speed, voice)
+        if audio is not None:
+            print(f"[TTS] ⚡ Cache hit: '{text[:60]}' ({audio_format})")
+            return audio
+
+        # A pre-rendered WAV only needs re-encoding, not another VITS pass
+        wav = self.lookup(text, language, "wav", speed, voice) if audio_format != "wav" else None
+        if wav is None:
+            audio_io, _ = self.synthesize(text, language, speed, voice)
+            if audio_io is None:
+                return None
+            wav = audio_io.getvalue()
+            if audio_format == "wav":
+                tts_cache.put(self.cache_key(text, language, "wav", speed, voice), wav)
+                return wav
+
+        audio = audio_encoder.transcode_wav(wav, audio_format)
+        tts_cache.put(self.cache_key(text, language, audio_format, speed, voice), audio)
+        return audio
+
 tts_service = TTSService()
@@ -0,0 +1,170 @@
+"""
+TTS Audio Cache
+Content-addressed cache of synthesized audio with an in-memory LRU tier
+and a size-capped on-disk tier. AAC users replay the same short phrases
+constantly, so most requests never need to reach VITS.
+"""
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models", "tts_cache")
+
+
+def normalize_text(text: str) -> str:
+    """NFC-normalize, lowercase and collapse whitespace so equivalent phrases share a key."""
+    text = unicodedata.normalize("NFC", text or "")
+    return " ".join(text.lower().split())
+
+
+class TTSCache:
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR,
+                 memory_bytes: int = 64 * 1024 * 1024,
+                 disk_bytes: int = 512 * 1024 * 1024):
+        """
+        Initialize the audio cache
+
+        Args:
+            cache_dir: Directory for the on-disk tier (created on first write)
+            memory_bytes: Capacity of the in-memory LRU tier
+            disk_bytes: Capacity of the on-disk tier
+        """
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None  # Scanned lazily on first disk access
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text: str, language: str, model_id: str, audio_format: str = "wav", variant: str = "") -> str:
+        """
+        Build the content address for a synthesis request.
+        Used both as the cache key and as the HTTP ETag.
+        variant describes non-default voice settings (speed/pitch); the
+        default voice leaves it empty so its keys match the phrase packs.
+        """
+        parts = [normalize_text(text), language.lower().strip(), model_id, audio_format]
+        if variant:
+            parts.append(variant)
+        material = "\x1f".join(parts)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Look up cached audio. Returns the stored bytes object itself (no copy),
+        promoting disk hits into the memory tier.
+        """
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        audio = self._read_disk(key)
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_memory(key, audio)
+        return audio
+
+    def put(self, key: str, audio: bytes):
+        """Store audio in both tiers."""
+        with self._lock:
+            self._put_memory(key, audio)
+        self._write_disk(key, audio)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size or 0,
+            }
+
+    def _put_memory(self, key: str, audio: bytes):
+        if len(audio) > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            # Touch so eviction drops the least recently used files first
+            os.utime(path, None)
+            return audio
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, audio: bytes):
+        if self.disk_bytes <= 0 or len(audio) > self.disk_bytes:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            existed = os.path.exists(path)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._disk_size is None:
+                    self._disk_size = self._scan_disk_size()
+                elif not existed:
+                    self._disk_size += len(audio)
+                if self._disk_size > self.disk_bytes:
+                    self._evict_disk()
+        except OSError as e:
+            print(f"[TTS Cache] ⚠️ Disk write failed: {e}")
+
+    def _scan_disk_size(self) -> int:
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".bin"):
+                total += entry.stat().st_size
+        return total
+
+    def _evict_disk(self):
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith(".bin")]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries:
+            if self._disk_size <= self.disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.unlink(entry.path)
+                self._disk_size -= size
+            except OSError:
+                pass
+
+# Singleton instance
+tts_cache = TTSCache(
+    cache_dir=os.environ.get("TTS_CACHE_DIR", DEFAULT_CACHE_DIR),
+    memory_bytes=int(os.environ.get("TTS_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+    disk_bytes=int(os.environ.get("TTS_CACHE_DISK_MB", "512")) * 1024 * 1024,
+)
@@ -0,0 +1,188 @@
+"""
+VITS Inference Engines
+Runs the MMS VITS checkpoints either through ONNX Runtime on CPU (exported
+graphs in models/onnx) or through PyTorch, behind one interface. The ONNX
+engine is used when an exported graph and onnxruntime are available, with
+PyTorch as the fallback.
+"""
+import os
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+DEFAULT_ONNX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models", "onnx")
+
+# Graph inputs/outputs of the exported model (see export_onnx)
+ONNX_INPUTS = ["input_ids", "attention_mask", "speaking_rate", "noise_scale", "noise_scale_duration"]
+ONNX_OUTPUTS = ["waveform", "sequence_lengths"]
+
+
+def onnx_path(model_id: str, onnx_dir: str = DEFAULT_ONNX_DIR) -> str:
+    """Location of the exported graph for a Hugging Face model id, e.g. models/onnx/mms-tts-aka.onnx"""
+    return os.path.join(onnx_dir, f"{model_id.split('/')[-1]}.onnx")
+
+
+class _ExportableVits(torch.nn.Module):
+    """
+    Wraps VitsModel so speaking rate and noise scales become graph inputs.
+    VitsModel reads them as attributes inside forward, so assigning the
+    traced input tensors here makes them dynamic in the exported graph.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, speaking_rate, noise_scale, noise_scale_duration):
+        self.model.speaking_rate = speaking_rate
+        self.model.noise_scale = noise_scale
+        self.model.noise_scale_duration = noise_scale_duration
+        output = self.model(input_ids=input_ids, attention_mask=attention_mask)
+        return output.waveform, output.sequence_lengths
+
+
+def export_onnx(model, tokenizer, path: str, opset: int = 17):
+    """
+    Exports a VitsModel to ONNX with dynamic batch, text and audio lengths.
+
+    Args:
+        model: Loaded VitsModel (moved to CPU for export)
+        tokenizer: Matching tokenizer, used for the example input
+        path: Output .onnx file
+        opset: ONNX opset version
+    """
+    model = model.to("cpu").eval()
+    saved = (model.speaking_rate, model.noise_scale, model.noise_scale_duration)
+    example = tokenizer("Medaase", return_tensors="pt")
+    args = (
+        example["input_ids"],
+        example["attention_mask"],
+        torch.tensor(1.0),
+        torch.tensor(float(model.config.noise_scale)),
+        torch.tensor(float(model.config.noise_scale_duration)),
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                _ExportableVits(model), args, path,
+                input_names=ONNX_INPUTS,
+                output_names=ONNX_OUTPUTS,
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "text"},
+                    "attention_mask": {0: "batch", 1: "text"},
+                    "waveform": {0: "batch", 1: "samples"},
+                    "sequence_lengths": {0: "batch"},
+                },
+                opset_version=opset,
+            )
+    finally:
+        model.speaking_rate, model.noise_scale, model.noise_scale_duration = saved
+
+
+class TorchVitsEngine:
+    name = "torch"
+
+    def __init__(self, model, device: str, threads: int = 0):
+        """
+        Eager PyTorch engine
+
+        Args:
+            model: Loaded VitsModel
+            device: Device the model lives on
+            threads: Intra-op threads; 0 keeps PyTorch's default. Note this is
+                process-wide in PyTorch, so it also applies to the ASR models.
+        """
+        self.model = model.eval()
+        self.device = device
+        # speaking_rate is a model attribute, so it is changed under this lock
+        self._lock = threading.Lock()
+        if threads > 0:
+            torch.set_num_threads(threads)
+
+    def run(self, input_ids: torch.Tensor, attention_mask: torch.Tensor,
+            speaking_rate: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (waveforms [batch, samples], sequence_lengths [batch]) as float32/int arrays.
+        """
+        with self._lock:
+            default_rate = self.model.speaking_rate
+            self.model.speaking_rate = speaking_rate
+            try:
+                with torch.inference_mode():
+                    output = self.model(
+                        input_ids=input_ids.to(self.device),
+                        attention_mask=attention_mask.to(self.device)
+                    )
+            finally:
+                self.model.speaking_rate = default_rate
+        return output.waveform.float().cpu().numpy(), output.sequence_lengths.cpu().numpy()
+
+
+class OnnxVitsEngine:
+    name = "onnx"
+
+    def __init__(self, path: str, noise_scale: float, noise_scale_duration: float, threads: int = 0):
+        """
+        ONNX Runtime CPU engine
+
+        Args:
+            path: Exported graph from export_onnx
+            noise_scale: Default VITS noise scale (from the model config)
+            noise_scale_duration: Default duration-predictor noise scale
+            threads: Intra-op threads for this session; 0 lets ONNX Runtime use all physical cores
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.noise_scale = np.array(noise_scale, dtype=np.float32)
+        self.noise_scale_duration = np.array(noise_scale_duration, dtype=np.float32)
+
+    def run(self, input_ids: torch.Tensor, attention_mask: torch.Tensor,
+            speaking_rate: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (waveforms [batch, samples], sequence_lengths [batch]).
+        Session.run is thread-safe, so no lock is needed.
+        """
+        waveform, lengths = self.session.run(ONNX_OUTPUTS, {
+            "input_ids": input_ids.cpu().numpy().astype(np.int64),
+            "attention_mask": attention_mask.cpu().numpy().astype(np.int64),
+            "speaking_rate": np.array(speaking_rate, dtype=np.float32),
+            "noise_scale": self.noise_scale,
+            "noise_scale_duration": self.noise_scale_duration,
+        })
+        return waveform, lengths
+
+
+def create_engine(model, model_id: str, device: str, preference: Optional[str] = None):
+    """
+    Picks the VITS engine for a loaded model.
+
+    TTS_ENGINE selects "onnx", "torch" or "auto" (default): auto uses ONNX on CPU
+    when an exported graph exists; any ONNX failure falls back to PyTorch.
+    TTS_INTRA_OP_THREADS sets the intra-op thread count for either engine.
+    """
+    preference = (preference or os.environ.get("TTS_ENGINE", "auto")).lower()
+    threads = int(os.environ.get("TTS_INTRA_OP_THREADS", "0"))
+    path = onnx_path(model_id, os.environ.get("TTS_ONNX_DIR", DEFAULT_ONNX_DIR))
+
+    wants_onnx = preference == "onnx" or (preference == "auto" and device == "cpu" and os.path.exists(path))
+    if wants_onnx:
+        try:
+            engine = OnnxVitsEngine(
+                path, model.config.noise_scale, model.config.noise_scale_duration, threads
+            )
+            print(f"[TTS] ⚙️ Using ONNX Runtime engine ({os.path.basename(path)})")
+            return engine
+        except Exception as e:
+            print(f"[TTS] ⚠️ ONNX engine unavailable, falling back to PyTorch: {str(e)}")
+
+    print(f"[TTS] ⚙️ Using PyTorch engine on {device}")
+    return TorchVitsEngine(model, device, threads)
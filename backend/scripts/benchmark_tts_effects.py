@@ -0,0 +1,89 @@
+"""
+Benchmark speed/pitch controls: the librosa phase-vocoder path used by the
+notebook backends (patch_notebook.py) against the TTS service's approach
+(VITS speaking rate + resampling-based pitch shift).
+
+Usage (from the backend directory):
+    python scripts/benchmark_tts_effects.py                 # DSP only, synthetic speech-like clip
+    python scripts/benchmark_tts_effects.py --with-model    # end to end through VITS
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def timed(fn, repeats: int) -> float:
+    fn()  # warm-up (librosa builds its FFT plans lazily)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def synthetic_clip(seconds: float, sr: int) -> np.ndarray:
+    """Harmonic tone with a wandering pitch, roughly the spectral shape of voiced speech."""
+    t = np.arange(int(seconds * sr)) / sr
+    f0 = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    return sum(np.sin(k * phase) / k for k in range(1, 12)).astype(np.float32) * 0.2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare librosa speed/pitch with the TTS service path")
+    parser.add_argument("--with-model", action="store_true", help="Include VITS generation in the timings")
+    parser.add_argument("--text", default="Me pɛ nsuo, medaase. Me ho yɛ me yaw nnɛ.")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Synthetic clip length (DSP mode)")
+    parser.add_argument("--speed", type=float, default=1.25)
+    parser.add_argument("--voice", default="female")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    if not args.with_model:
+        os.environ["TTS_PRELOAD"] = "0"
+    import librosa
+    from app.services.tts import tts_service, shift_pitch, VOICE_PITCH_SEMITONES
+
+    semitones = VOICE_PITCH_SEMITONES[args.voice]
+    ratio = 2.0 ** (semitones / 12.0)
+
+    if args.with_model:
+        if not tts_service.supports("tw"):
+            sys.exit("TTS model could not be loaded")
+        sr = tts_service.sampling_rate
+
+        def librosa_path():
+            audio = tts_service._generate_pcm(args.text).astype(np.float32) / 32767.0
+            audio = librosa.effects.pitch_shift(audio, sr=sr, n_steps=semitones)
+            return librosa.effects.time_stretch(audio, rate=args.speed)
+
+        def service_path():
+            return tts_service._generate_pcm(args.text, args.speed, args.voice)
+
+        baseline = timed(lambda: tts_service._generate_pcm(args.text), args.repeats)
+        print(f"VITS only:                    {baseline:8.1f} ms")
+    else:
+        sr = 16000
+        clip = synthetic_clip(args.seconds, sr)
+
+        def librosa_path():
+            audio = librosa.effects.pitch_shift(clip, sr=sr, n_steps=semitones)
+            return librosa.effects.time_stretch(audio, rate=args.speed)
+
+        def service_path():
+            # Speed is free here: it is applied inside VITS through the length scale
+            return shift_pitch(clip, ratio)
+
+    librosa_ms = timed(librosa_path, args.repeats)
+    service_ms = timed(service_path, args.repeats)
+    print(f"librosa pitch_shift+stretch:  {librosa_ms:8.1f} ms")
+    print(f"speaking_rate + resample:     {service_ms:8.1f} ms")
+    print(f"speed-up:                     {librosa_ms / max(service_ms, 1e-6):8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
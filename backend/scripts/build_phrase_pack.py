@@ -0,0 +1,79 @@
+"""
+Pre-render a phrase list into a memory-mappable phrase pack.
+
+Usage (from the backend directory):
+    python scripts/build_phrase_pack.py --language tw --phrases phrases.txt
+    python scripts/build_phrase_pack.py --language tw --csv ../resources/akan_dataset.csv --column text --limit 2000
+
+The pack is written to models/phrase_packs/<language>.pack, which the TTS
+endpoints map at startup and serve without running VITS.
+"""
+import argparse
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.tts import tts_service
+from app.services.tts_cache import normalize_text
+from app.services.phrase_pack import write_phrase_pack, DEFAULT_PACK_DIR
+
+
+def read_phrases(args) -> list:
+    phrases = []
+    for path in args.phrases or []:
+        with open(path, encoding="utf-8") as f:
+            phrases += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    for path in args.csv or []:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            phrases += [row[args.column].strip() for row in csv.DictReader(f) if row.get(args.column, "").strip()]
+
+    # De-duplicate on the same normalization the cache key uses
+    seen = set()
+    unique = []
+    for phrase in phrases:
+        norm = normalize_text(phrase)
+        if norm not in seen:
+            seen.add(norm)
+            unique.append(phrase)
+    return unique[:args.limit] if args.limit else unique
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render TTS phrases into a phrase pack")
+    parser.add_argument("--language", default="tw", help="Language code of the phrases")
+    parser.add_argument("--phrases", action="append", help="Text file with one phrase per line (repeatable)")
+    parser.add_argument("--csv", action="append", help="CSV file with a phrase column (repeatable)")
+    parser.add_argument("--column", default="text", help="CSV column holding the phrase text")
+    parser.add_argument("--limit", type=int, default=0, help="Maximum number of phrases to render")
+    parser.add_argument("--batch-size", type=int, default=8, help="Phrases per VITS forward pass")
+    parser.add_argument("--out", help="Output path (default: models/phrase_packs/<language>.pack)")
+    args = parser.parse_args()
+
+    if not args.phrases and not args.csv:
+        parser.error("Provide at least one --phrases or --csv source")
+
+    language = tts_service.canonical_language(args.language)
+    if not tts_service.supports(language):
+        sys.exit(f"Language '{args.language}' is not supported by {tts_service.model_id}")
+
+    phrases = read_phrases(args)
+    print(f"[PhrasePack] Rendering {len(phrases)} phrases ({language})...")
+
+    clips = {}
+    rendered = tts_service.synthesize_batch(phrases, batch_size=args.batch_size)
+    for phrase, audio in zip(phrases, rendered):
+        if audio is None:
+            print(f"[PhrasePack] ⚠️ Skipped: {phrase[:60]}")
+            continue
+        clips[tts_service.cache_key(phrase, language)] = audio
+
+    out = args.out or os.path.join(DEFAULT_PACK_DIR, f"{language}.pack")
+    write_phrase_pack(out, clips)
+    size_mb = os.path.getsize(out) / (1024 * 1024)
+    print(f"[PhrasePack] ✅ Wrote {len(clips)} phrases to {out} ({size_mb:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
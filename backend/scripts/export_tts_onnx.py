@@ -0,0 +1,116 @@
+"""
+Export the MMS VITS checkpoints to ONNX, check waveform parity against
+PyTorch and benchmark latency.
+
+Usage (from the backend directory):
+    python scripts/export_tts_onnx.py                       # aka, gaa, eng -> models/onnx/
+    python scripts/export_tts_onnx.py --languages aka --benchmark --threads 4
+
+Parity is checked with the VITS noise scales set to zero, which makes both
+engines deterministic; the exit code is non-zero if any model fails.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import VitsModel, AutoTokenizer
+from app.services.tts_engine import export_onnx, onnx_path, OnnxVitsEngine, TorchVitsEngine, DEFAULT_ONNX_DIR
+
+SAMPLE_TEXTS = {
+    "aka": ["Me pɛ nsuo.", "Medaase, me ho yɛ.", "Me ti yɛ me yaw, mepa wo kyɛw frɛ dɔkota no."],
+    "gaa": ["Ofainɛ, mihe nu.", "Oyiwaladɔŋŋ.", "Mitsui mli yeɔ mi hewalɛ."],
+    "eng": ["I need water.", "Thank you.", "My head hurts, please call the doctor for me."],
+}
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-9))
+
+
+def check_parity(model, tokenizer, path: str, texts, threshold: float) -> bool:
+    torch_engine = TorchVitsEngine(model, "cpu")
+    onnx_engine = OnnxVitsEngine(path, 0.0, 0.0)
+    model.noise_scale, model.noise_scale_duration = 0.0, 0.0
+
+    ok = True
+    for text in texts:
+        inputs = tokenizer(text, return_tensors="pt")
+        ref, ref_len = torch_engine.run(inputs["input_ids"], inputs["attention_mask"])
+        out, out_len = onnx_engine.run(inputs["input_ids"], inputs["attention_mask"])
+        ref, out = ref[0][:int(ref_len[0])], out[0][:int(out_len[0])]
+        n = min(len(ref), len(out))
+        similarity = cosine(ref[:n], out[:n])
+        passed = len(ref) == len(out) and similarity >= threshold
+        ok &= passed
+        print(f"  {'✅' if passed else '❌'} cos={similarity:.5f} len={len(ref)}/{len(out)} "
+              f"max|Δ|={np.abs(ref[:n] - out[:n]).max():.4f}  '{text}'")
+
+    model.noise_scale, model.noise_scale_duration = model.config.noise_scale, model.config.noise_scale_duration
+    return ok
+
+
+def benchmark(model, tokenizer, path: str, texts, repeats: int, threads: int):
+    onnx_engine = OnnxVitsEngine(path, model.config.noise_scale, model.config.noise_scale_duration, threads)
+    torch_engine = TorchVitsEngine(model, "cpu", threads)
+    batches = [tokenizer(text, return_tensors="pt") for text in texts]
+
+    def eager():
+        with torch.no_grad():
+            model(**inputs)
+
+    runners = [
+        ("torch no_grad (baseline)", eager),
+        ("torch inference_mode", lambda: torch_engine.run(inputs["input_ids"], inputs["attention_mask"])),
+        ("onnxruntime", lambda: onnx_engine.run(inputs["input_ids"], inputs["attention_mask"])),
+    ]
+    for name, run in runners:
+        timings = []
+        for inputs in batches:
+            run()  # warm-up
+            for _ in range(repeats):
+                start = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"  {name:26s} mean={statistics.mean(timings):7.1f} ms  "
+              f"p50={timings[len(timings) // 2]:7.1f} ms  p95={timings[int(len(timings) * 0.95) - 1]:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export MMS VITS models to ONNX")
+    parser.add_argument("--languages", nargs="+", default=["aka", "gaa", "eng"])
+    parser.add_argument("--out-dir", default=DEFAULT_ONNX_DIR)
+    parser.add_argument("--threshold", type=float, default=0.99, help="Minimum waveform cosine similarity")
+    parser.add_argument("--benchmark", action="store_true", help="Also time PyTorch against ONNX Runtime")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (0 = library default)")
+    args = parser.parse_args()
+
+    all_ok = True
+    for language in args.languages:
+        model_id = f"facebook/mms-tts-{language}"
+        path = onnx_path(model_id, args.out_dir)
+        print(f"[ONNX] Exporting {model_id} -> {path}")
+        model = VitsModel.from_pretrained(model_id).eval()
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        export_onnx(model, tokenizer, path)
+
+        texts = SAMPLE_TEXTS.get(language, SAMPLE_TEXTS["eng"])
+        print("[ONNX] Parity (noise scales = 0):")
+        all_ok &= check_parity(model, tokenizer, path, texts, args.threshold)
+        if args.benchmark:
+            print("[ONNX] Latency:")
+            benchmark(model, tokenizer, path, texts, args.repeats, args.threads)
+
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -299,284 +299,62 @@ async def synthesize_post(req: TTSRequest):
 
 # ── AI Diagnostics and Therapist Insights (LLM) ──────────────────────────────
 
-from typing import List, Optional, Dict, Any
-
-class SummaryRequest(BaseModel):
-    patient_name: str
-    transcripts: List[str]
-    compliance_rate: float
-    streak: int
-    hours_practiced: float
-    struggles: Optional[List[Dict[str, Any]]] = None
-    completed_assignments: Optional[List[Dict[str, Any]]] = None
-
-class SentimentRequest(BaseModel):
-    transcripts: List[str]
-    mood_levels: List[int] = []
-
-class RecommendationRequest(BaseModel):
-    patient_name: str
-    language: str
-    difficulty: str
-
-def query_hf_llm(prompt: str, max_tokens: int = 250, temperature: float = 0.3) -> str:
-    """Query LLM with Google Gemini as primary, HuggingFace as fallback."""
-    import os
-
-    # ── Layer 0: Try Google Gemini (best quality) ────────────────────────────
-    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-    if gemini_key:
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=gemini_key)
-            # Try listing models to get the exact matching identifier for this key/region
-            model_to_use = 'gemini-1.5-flash'
-            try:
-                available = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-                if available:
-                    # Match case-insensitively for gemini-1.5-flash (e.g. models/gemini-1.5-flash or gemini-1.5-flash-latest)
-                    flash_models = [name for name in available if 'gemini-1.5-flash' in name.lower()]
-                    if flash_models:
-                        model_to_use = flash_models[0]
-                    else:
-                        # Fallback to any model containing 'gemini'
-                        any_gemini = [name for name in available if 'gemini' in name.lower()]
-                        if any_gemini:
-                            model_to_use = any_gemini[0]
-            except Exception as list_err:
-                print(f"[AI Backend] ⚠️ Could not list Gemini models dynamically, using default name: {list_err}")
-
-            print(f"[AI Backend] Using GenerativeModel: {model_to_use}")
-            gemini_model = genai.GenerativeModel(model_to_use)
-            response = gemini_model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=max_tokens,
-                    temperature=temperature,
-                )
-            )
-            if response and response.text and response.text.strip():
-                print(f"[AI Backend] ✅ Gemini ({model_to_use}) responded successfully")
-                return response.text.strip()
-        except Exception as e:
-            print(f"[AI Backend] ⚠️ Gemini failed, falling back to HuggingFace: {e}")
-    
-    # Layer 1: Try official Hugging Face SDK client (uses internal routing and HF_ENDPOINT)
-    try:
-        from huggingface_hub import InferenceClient
-        token = os.environ.get("HF_TOKEN") or os.environ.get("HUGGINGFACE_CO_RESOLVE_PROVIDER") or os.environ.get("HF_API_KEY")
-        
-        # Try Qwen model first, fall back to Llama-3.2
-        sdk_models = [
-            "Qwen/Qwen2.5-7B-Instruct",
-            "meta-llama/Llama-3.2-3B-Instruct"
-        ]
-        
-        for model_name in sdk_models:
-            try:
-                client = InferenceClient(model=model_name, token=token, timeout=10)
-                # First try chat_completion (recommended for conversational/instruct models)
-                try:
-                    response = client.chat_completion(
-                        messages=[{"role": "user", "content": prompt}],
-                        max_tokens=max_tokens,
-                        temperature=temperature
-                    )
-                    if response and response.choices and len(response.choices) > 0:
-                        content = response.choices[0].message.content
-                        if content and content.strip():
-                            return content.strip()
-                except Exception as chat_err:
-                    print(f"[AI Backend] Warning: chat_completion failed for {model_name} via SDK: {chat_err}. Trying text_generation...")
-                
-                # Fall back to text_generation if chat_completion failed
-                response = client.text_generation(
-                    prompt,
-                    max_new_tokens=max_tokens,
-                    temperature=temperature
-                )
-                if response and response.strip():
-                    return response.strip()
-            except Exception as e:
-                print(f"[AI Backend] Warning: LLM query failed for {model_name} via SDK client: {e}")
-                continue
-    except Exception as e:
-        print(f"[AI Backend] Warning: Failed to initialize SDK InferenceClient: {e}")
+from clinical_heuristics import clinical_matcher
+from prompt_budget import PromptBudget
+from llm_gateway import LLMGateway, InsightCache, InsightDeadlines
+from insight_routes import (
+    SummaryRequest, SentimentRequest, RecommendationRequest, JournalAnalysisRequest, BulkInsightRequest,
+    sse_answer, stream_insight, summary_insight, no_journals_answer, journal_insight, bulk_response,
+)
 
-    # Layer 2: Fall back to raw requests library if SDK is unavailable or fails
-    import requests
-    import json
-    
-    token = os.environ.get("HF_TOKEN") or os.environ.get("HUGGINGFACE_CO_RESOLVE_PROVIDER") or os.environ.get("HF_API_KEY")
-    headers = {
-        "Content-Type": "application/json"
-    }
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-        
-    models = [
-        "Qwen/Qwen2.5-7B-Instruct",
-        "meta-llama/Llama-3.2-3B-Instruct"
-    ]
-    
-    for model_name in models:
-        # Try chat completions endpoint first
-        chat_url = f"https://api-inference.huggingface.co/models/{model_name}/v1/chat/completions"
-        chat_payload = {
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": max_tokens,
-            "temperature": temperature
-        }
-        try:
-            response = requests.post(chat_url, json=chat_payload, headers=headers, timeout=10)
-            if response.status_code == 200:
-                res_json = response.json()
-                text = res_json.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-                if text:
-                    return text
-            else:
-                print(f"[AI Backend] Warning: chat request failed for {model_name} ({response.status_code}): {response.text}")
-        except Exception as e:
-            print(f"[AI Backend] Warning: chat request failed for {model_name} via requests: {e}")
-
-        # Fall back to text generation endpoint
-        text_url = f"https://api-inference.huggingface.co/models/{model_name}"
-        text_payload = {
-            "inputs": prompt,
-            "parameters": {
-                "max_new_tokens": max_tokens,
-                "temperature": temperature,
-                "return_full_text": False
-            }
-        }
-        try:
-            response = requests.post(text_url, json=text_payload, headers=headers, timeout=10)
-            if response.status_code == 200:
-                res_json = response.json()
-                if isinstance(res_json, list) and len(res_json) > 0:
-                    text = res_json[0].get("generated_text", "").strip()
-                    if text:
-                        return text
-                elif isinstance(res_json, dict):
-                    text = res_json.get("generated_text", "").strip()
-                    if text:
-                        return text
-            else:
-                print(f"[AI Backend] Warning: text request failed for {model_name} ({response.status_code}): {response.text}")
-        except Exception as e:
-            print(f"[AI Backend] Warning: text request failed for {model_name} via requests: {e}")
-            
-    raise RuntimeError("All inference model APIs are unreachable or timed out.")
+# ── LLM Gateway ───────────────────────────────────────────────────────────
+# Provider chain, insight cache, deadlines and streaming live in llm_gateway.py
 
-@backend.post('/predict/summary')
-async def predict_summary(req: SummaryRequest):
-    transcripts_str = "\n".join([f'- "{t}"' for t in req.transcripts]) if req.transcripts else "No recent speech recordings."
-    
-    struggles_str = ""
-    if req.struggles:
-        struggles_str = "\n".join([
-            f'- {s.get("questTitle", "Exercise")}: {s.get("incorrectAttempts", s.get("attempts", 1))} mistake(s). Detail: {s.get("detail", "Incorrect attempt")}'
-            for s in req.struggles
-        ])
-    else:
-        struggles_str = "No recent struggles or mistakes logged."
-
-    assignments_str = ""
-    if req.completed_assignments:
-        assignments_str = "\n".join([
-            f'- {a.get("title")} (Category: {a.get("category")}, Completed: {a.get("completed")})' +
-            (f' Voice Response: "{a.get("voice_transcript")}"' if a.get("voice_transcript") else '')
-            for a in req.completed_assignments
-        ])
-    else:
-        assignments_str = "No recent completed assignments."
+llm_gateway = LLMGateway()
+insight_cache = InsightCache(int(os.environ.get('INSIGHT_CACHE_SIZE', '512')),
+                             float(os.environ.get('INSIGHT_CACHE_TTL', '3600')))
+insight_deadlines = InsightDeadlines(insight_cache, float(os.environ.get('INSIGHT_RESULT_TTL', '900')))
+answer_within_deadline = insight_deadlines.answer
 
-    prompt = (
-        f"You are a clinical Speech-Language Pathologist (SLP) AI reviewer.\n"
-        f"Synthesize this progress status for patient '{req.patient_name}':\n"
-        f"- Speech Exercises Compliance Rate: {req.compliance_rate}%\n"
-        f"- Consecutive Practice Streak: {req.streak} days\n"
-        f"- Total Practiced Time: {req.hours_practiced} hours\n"
-        f"- Patient Voice Journals & Transcripts:\n{transcripts_str}\n"
-        f"- Recent Game Struggles / Mistakes (Words/Quests patient got wrong):\n{struggles_str}\n"
-        f"- Completed Daily Assignments (and spoken voice responses):\n{assignments_str}\n\n"
-        f"Write a concise, professional clinical progress summary for the therapist as 3 short, standard text paragraphs:\n"
-        f"1. PATIENT PERFORMANCE SUMMARY: Describe compliance, consistency, and progress.\n"
-        f"2. JOURNAL & SENTIMENT ANALYSIS: Reflect on what the patient said in their voice journals, their emotions, and clinical symptoms (like pain, fatigue, recovery signs).\n"
-        f"3. BRAINSTORMED THERAPIST IMPROVEMENT GUIDE: Give specific, actionable tips on what the therapist should do next to help the patient improve. Brainstorm ideas based on the exact words/quests they got wrong (e.g. phoneme drills for those words) and how they completed their assignments."
-        f"\n\nDo NOT use markdown bold, list bullets, hashes, or list markers. Return ONLY clean, readable plain text paragraphs."
-    )
-    
-    try:
-        # Run the blocking query in a separate thread to keep fastapi responsive
-        summary = await asyncio.to_thread(query_hf_llm, prompt, max_tokens=350, temperature=0.3)
-        # Strip any accidental markdown formatting the LLM might have returned
-        summary = re.sub(r'\*+', '', summary)
-        summary = re.sub(r'#+', '', summary)
-        summary = re.sub(r'^- ', '', summary, flags=re.MULTILINE)
-        return {'summary': summary.strip(), 'source': 'AI (HuggingFace Serverless LLM)'}
-    except Exception as e:
-        print(f"[AI Backend] Fallback triggered for Summary: {e}")
-        
-        # 1. Dynamic compliance evaluation
-        paragraph1 = f"Clinical review for patient {req.patient_name} shows a current exercise compliance rate of {req.compliance_rate}%. "
-        if req.compliance_rate == 0:
-            paragraph1 += f"At this stage, {req.patient_name} has not registered any recent completed exercises in the database, meaning they require immediate therapist outreach to establish engagement, check device accessibility, and identify early barriers."
-        elif req.compliance_rate < 50:
-            paragraph1 += f"Engagement is currently low, showing that {req.patient_name} is completing less than half of their assigned drills. More frequent follow-ups, caregiver reinforcement, or adjusting the goal target down to shorter daily intervals is recommended to build confidence."
-        elif req.compliance_rate < 80:
-            paragraph1 += f"The patient shows moderate participation. While some sessions are missed, there is a steady baseline of practice. Encouraging a fixed daily time for speech drills could help bridge the remaining compliance gap."
-        else:
-            paragraph1 += f"This represents excellent commitment, indicating that {req.patient_name} is consistently keeping up with daily rehabilitation requirements, which establishes the necessary vocal repetitions for motor-speech neural recovery."
+@backend.on_event('shutdown')
+async def close_llm_gateway():
+    await llm_gateway.close()
 
-        # 2. Dynamic habit & acoustic evaluation
-        paragraph2 = ""
-        if req.streak > 0:
-            paragraph2 += f"Consistency is supported by a continuous {req.streak}-day streak, indicating strong habit building. "
-        else:
-            paragraph2 += f"No active consecutive streak is currently logged, suggesting that practice sessions are sparse or unscheduled. "
+async def query_hf_llm(prompt: str, max_tokens: int = 250, temperature: float = 0.3) -> str:
+    """Query LLM with Google Gemini as primary, HuggingFace as fallback."""
+    return await llm_gateway.query(prompt, max_tokens, temperature)
 
-        if req.hours_practiced > 0:
-            paragraph2 += f"Across these sessions, {req.patient_name} has accumulated {req.hours_practiced} hours of voice activity. "
+@backend.get('/predict/llm/stats')
+async def llm_stats():
+    """Per-provider latency, error and circuit-breaker state for the LLM chain, plus insight cache stats."""
+    return {**llm_gateway.stats(), 'insight_cache': insight_cache.stats()}
 
-        twi_count = sum(1 for t in req.transcripts if any(w in t.lower() for w in ['nsuo', 'kasa', 'paa', 'twi', 'ɛyɛ', 'mami', 'dodo', 'yare', 'medaase', 'mepɛ', 'pa', 'pe', 'pi', 'po', 'pu', 'firi', 'sɔre', 'sua', 'kofi', 'kosoko']))
-        pain_count = sum(1 for t in req.transcripts if any(w in t.lower() for w in ['pain', 'hurt', 'sad', 'bad', 'tired', 'cry', 'help', 'emergency', 'stop', 'difficult', 'stuck', 'ɛyaw', 'yare']))
+@backend.get('/predict/upgrade/{token}')
+async def predict_upgrade(token: str, wait_ms: int = 0):
+    """LLM version of an insight that missed its deadline. wait_ms long-polls for up to 30 s."""
+    status, body = await insight_deadlines.upgrade(token, wait_ms)
+    return body if status == 200 else JSONResponse(status_code=status, content=body)
 
-        if req.transcripts:
-            recent_quotes = ", ".join([f'"{t}"' for t in req.transcripts[:2]])
-            paragraph2 += f"Review of recent acoustic output (such as {recent_quotes}) "
-            if twi_count > 0:
-                paragraph2 += "shows prominent usage of Akan Twi dialect, confirming the speech classifier is correctly parsing localized phonology and dialect-specific sound targets. "
-            else:
-                paragraph2 += "indicates primarily English speech exercises. "
-                
-            if pain_count > 0:
-                paragraph2 += f"Of clinical note, several transcript entries contain indicators of frustration, pain, or struggle, signaling that physical or vocal fatigue may be present during training."
-        else:
-            paragraph2 += f"Acoustic logs are currently empty, so active vocal characteristics and speech clarity cannot be evaluated."
+# ── Streaming insights ────────────────────────────────────────────────────
+# SSE variants of the long-form insights, see insight_routes.stream_insight.
 
-        # 3. Dynamic therapist recommendations (Brainstormed therapist improvement guide)
-        paragraph3 = f"Therapist Guidance & Brainstormed Tips: "
-        
-        # Inject struggle feedback if present
-        if req.struggles and len(req.struggles) > 0:
-            wrong_items = [s.get("questTitle", "drills") for s in req.struggles[:2]]
-            paragraph3 += f"Based on recent session errors, the patient is experiencing coordination blocks on {', '.join(wrong_items)}. We brainstormed that the therapist should introduce slow tactile placement drills or syllable segmentation to bypass these specific phonetic traps. "
-        else:
-            paragraph3 += f"No specific exercise struggles were logged, showing that phonetic placement is stable. "
+async def insight_stream(prompt, max_tokens, temperature):
+    """(source, text delta) pairs from the hosted providers."""
+    async for delta in llm_gateway.stream(prompt, max_tokens, temperature):
+        yield 'AI (HuggingFace Serverless LLM)', delta
 
-        # Inject assignment feedback if present
-        if req.completed_assignments and len(req.completed_assignments) > 0:
-            comp_list = [a.get("title") for a in req.completed_assignments if a.get("completed")]
-            if comp_list:
-                paragraph3 += f"The patient successfully completed their assigned missions: {', '.join(comp_list[:2])}. If these required voice recordings, their response shows sufficient phonation duration, and the therapist can now advance them to multi-syllable phrases."
-            else:
-                paragraph3 += "Recent assignments are currently pending completion. Therapist should check if the patient finds the instructions too complex."
-        else:
-            paragraph3 += "No clinical assignments were recently completed. Suggest assigning low-demand vocal play exercises to re-engage."
 
-        summary_text = f"{paragraph1}\n\n{paragraph2}\n\n{paragraph3}"
-        return {'summary': summary_text, 'source': 'Deterministic Clinical Heuristic Analyzer'}
+@backend.post('/predict/summary')
+async def predict_summary(req: SummaryRequest):
+    _, _, llm_answer, heuristic_answer = summary_insight(req, query_hf_llm)
+    return await answer_within_deadline('Summary', llm_answer, heuristic_answer, req.deadline_ms,
+                                        insight_cache.key('Summary', req, 0.3))
+
+@backend.post('/predict/summary/stream')
+async def predict_summary_stream(req: SummaryRequest):
+    prompt, budget, _, heuristic_answer = summary_insight(req, query_hf_llm)
+    return stream_insight('Summary', 'summary', insight_stream(prompt, 350, 0.3), budget, heuristic_answer,
+                          insight_cache, insight_cache.key('Summary', req, 0.3))
 
 @backend.post('/predict/sentiment')
 async def predict_sentiment(req: SentimentRequest):
@@ -588,7 +366,8 @@ async def predict_sentiment(req: SentimentRequest):
         }
         
     mood_str = f"Recent daily self-reported moods (1=Very Sad, 2=Sad, 3=Okay, 4=Good, 5=Very Happy): {req.mood_levels}" if req.mood_levels else "No self-reported daily moods logged today."
-    transcripts_str = "\n".join([f'- "{t}"' for t in req.transcripts])
+    budget = PromptBudget('Sentiment')
+    transcripts_str = "\n".join([f'- "{t}"' for t in budget.fit('transcripts', req.transcripts)])
     prompt = (
         f"Analyze the emotional state of a speech-impaired patient.\n"
         f"Their daily self-reported mood levels from the app check-in are:\n{mood_str}\n\n"
@@ -601,16 +380,15 @@ async def predict_sentiment(req: SentimentRequest):
         f"Output ONLY the raw JSON string. Do not wrap in markdown ```json."
     )
     
-    try:
-        res = await asyncio.to_thread(query_hf_llm, prompt, max_tokens=150, temperature=0.1)
+    async def llm_answer():
+        res = await query_hf_llm(prompt, max_tokens=150, temperature=0.1)
         data = json.loads(res)
         data['source'] = 'AI (HuggingFace Serverless LLM)'
+        data['prompt_budget'] = budget.report()
         return data
-    except Exception as e:
-        print(f"[AI Backend] Fallback triggered for Sentiment: {e}")
-        frustrated_keywords = ['pain', 'hurt', 'sad', 'bad', 'tired', 'cry', 'help', 'emergency', 'stop', 'difficult', 'stuck', 'ɛyaw', 'yare']
-        happy_keywords = ['happy', 'good', 'fine', 'great', 'thank', 'love', 'nice', 'ɛyɛ', 'paa', 'medaase']
-        anxious_keywords = ['worry', 'scared', 'afraid', 'heart', 'doctor', 'hospital', 'priority', 'nsuro', 'emergency']
+
+    def heuristic_answer():
+        scan = clinical_matcher.scan(req.transcripts)
         
         frustrated_score = 0
         happy_score = 0
@@ -628,19 +406,14 @@ async def predict_sentiment(req: SentimentRequest):
                 neutral_score += 3
         
         # Incorporate transcripts
-        for t in req.transcripts:
-            t_lower = t.lower()
-            matched = False
-            if any(w in t_lower for w in frustrated_keywords):
+        for hit in scan.per_text:
+            if 'distress' in hit:
                 frustrated_score += 4
-                matched = True
-            if any(w in t_lower for w in happy_keywords):
+            if 'happy' in hit:
                 happy_score += 4
-                matched = True
-            if any(w in t_lower for w in anxious_keywords):
+            if 'anxious' in hit:
                 anxious_score += 4
-                matched = True
-            if not matched:
+            if not hit & {'distress', 'happy', 'anxious'}:
                 neutral_score += 1
                 
         total = frustrated_score + happy_score + anxious_score + neutral_score
@@ -662,7 +435,7 @@ async def predict_sentiment(req: SentimentRequest):
         reasoning = "Analyzed check-in mood and speech logs: "
         if has_low_mood:
             reasoning += f"Patient checked in with low mood ({req.mood_levels[0]}/5 today). "
-            matched_struggles = [w for w in frustrated_keywords if any(w in t.lower() for t in req.transcripts)]
+            matched_struggles = scan.matched('distress')
             if matched_struggles:
                 label_str = ", ".join(matched_struggles[:2])
                 reasoning += f"This correlates with exercise text mentioning '{label_str}', indicating physical discomfort or practice frustration."
@@ -670,7 +443,7 @@ async def predict_sentiment(req: SentimentRequest):
                 reasoning += "Lack of positive verbal expressions during exercises indicates general disengagement or fatigue."
         elif has_high_mood:
             reasoning += f"Patient checked in with a positive mood ({req.mood_levels[0]}/5 today). "
-            matched_happy = [w for w in happy_keywords if any(w in t.lower() for t in req.transcripts)]
+            matched_happy = scan.matched('happy')
             if matched_happy:
                 reasoning += f"Acoustic output confirms high engagement with optimistic words like '{matched_happy[0]}'."
             else:
@@ -694,6 +467,9 @@ async def predict_sentiment(req: SentimentRequest):
             'source': 'Heuristic Check-In & Speech Correlation Engine'
         }
 
+    return await answer_within_deadline('Sentiment', llm_answer, heuristic_answer, req.deadline_ms,
+                                        insight_cache.key('Sentiment', req, 0.1))
+
 @backend.post('/predict/recommendations')
 async def predict_recommendations(req: RecommendationRequest):
     prompt = (
@@ -708,12 +484,12 @@ async def predict_recommendations(req: RecommendationRequest):
         f"Return ONLY the raw JSON string. Do not wrap in markdown ```json."
     )
     
-    try:
-        res = await asyncio.to_thread(query_hf_llm, prompt, max_tokens=250, temperature=0.2)
+    async def llm_answer():
+        res = await query_hf_llm(prompt, max_tokens=250, temperature=0.2)
         recs = json.loads(res)
         return {'recommendations': recs, 'source': 'AI (HuggingFace Serverless LLM)'}
-    except Exception as e:
-        print(f"[AI Backend] Fallback triggered for Recommendations: {e}")
+
+    def heuristic_answer():
         # Rule-based fallback recommendations
         lang = req.language.lower()
         diff = req.difficulty.lower()
@@ -759,68 +535,33 @@ async def predict_recommendations(req: RecommendationRequest):
                 
         return {'recommendations': recs, 'source': 'Speech Pathology Heuristic Recommendation Engine'}
 
+    return await answer_within_deadline('Recommendations', llm_answer, heuristic_answer, req.deadline_ms,
+                                        insight_cache.key('Recommendations', req, 0.2))
 
-class JournalAnalysisRequest(BaseModel):
-    patient_name: str
-    journals: List[str]
 
 @backend.post('/predict/journal_analysis')
 async def predict_journal_analysis(req: JournalAnalysisRequest):
     if not req.journals:
-        return {
-            'analysis': "No voice journal entries found to analyze. Advise the patient to record their first journal entry to start receiving clinical insights.",
-            'source': 'Deterministic Heuristic Engine'
-        }
-        
-    journals_str = "\n".join([f'- "{j}"' for j in req.journals])
-    prompt = (
-        f"You are a clinical speech-language pathologist and rehabilitation AI.\n"
-        f"Analyze these recent voice journal transcripts recorded by patient '{req.patient_name}':\n"
-        f"{journals_str}\n\n"
-        f"Write a clinical analysis of their journal entries in 3 short, professional paragraphs:\n"
-        f"Paragraph 1: SPOKEN THEMES & COGNITIVE OUTLOOK. Describe what the patient is talking about (daily routines, concerns, pain, recovery progress) and what their language reveals about their mental state, mood, and cognitive clarity.\n"
-        f"Paragraph 2: CLINICAL REHABILITATION TIPS. Recommend specific breathing, voice, or articulation exercises (e.g., easy-onset phonation, pacing control, diaphragmatic breathing) based on the fatigue or discomfort mentioned.\n"
-        f"Paragraph 3: CAREGIVER COORDINATION GUIDANCE. Give practical suggestions on how the family or caregiver can support the patient in their home environment based on what they expressed."
-        f"\n\nDo NOT use markdown bold, list bullets, hashes, or list markers. Return ONLY clean, readable plain text paragraphs."
-    )
-    
-    try:
-        analysis = await asyncio.to_thread(query_hf_llm, prompt, max_tokens=350, temperature=0.3)
-        analysis = re.sub(r'\*+', '', analysis)
-        analysis = re.sub(r'#+', '', analysis)
-        analysis = re.sub(r'^- ', '', analysis, flags=re.MULTILINE)
-        return {'analysis': analysis.strip(), 'source': 'AI (HuggingFace Serverless LLM)'}
-    except Exception as e:
-        print(f"[AI Backend] Fallback triggered for Journal Analysis: {e}")
-        
-        # Heuristic fallback based on journal content
-        pain_words = ['pain', 'hurt', 'sad', 'bad', 'tired', 'cry', 'help', 'emergency', 'stop', 'difficult', 'stuck', 'ɛyaw', 'yare']
-        twi_words = ['nsuo', 'kasa', 'paa', 'twi', 'ɛyɛ', 'mami', 'dodo', 'yare', 'medaase', 'mepɛ', 'pa']
-        
-        has_pain = any(any(w in j.lower() for w in pain_words) for j in req.journals)
-        has_twi = any(any(w in j.lower() for w in twi_words) for j in req.journals)
-        
-        paragraph1 = f"Spoken Themes & Cognitive Outlook: Analysis of {len(req.journals)} voice journal recordings indicates that {req.patient_name} is actively using their voice board. "
-        if has_pain:
-            paragraph1 += "The transcripts express feelings of fatigue, pain, or difficulty with current communication targets. This suggests increased cognitive load or physical discomfort during daily rehabilitation activities."
-        else:
-            paragraph1 += "The verbal logs show a stable emotional baseline. Topics relate to standard daily activities, indicating steady cognitive clarity and willingness to communicate."
-            
-        paragraph2 = "Clinical Rehabilitation Tips: "
-        if has_pain:
-            paragraph2 += "We recommend introducing gentle vocal play and diaphragmatic breath support exercises (such as sustained vowel phonations). Advise the patient to take frequent rest breaks and avoid straining when articulation blocks occur."
-        else:
-            paragraph2 += "Continue progress with current articulation templates. Introduce conversational short-phrase cards to transition the patient from single words to natural pacing."
-            
-        paragraph3 = "Caregiver Coordination Guidance: "
-        if has_twi:
-            paragraph3 += "Caregivers should encourage communication in the patient's preferred Akan Twi dialect. Practice daily check-ins in a quiet room to reduce environmental noise and auditory fatigue."
-        else:
-            paragraph3 += "Ensure the patient feels supported during communication attempts. Allow ample time (10-15 seconds) for them to formulate responses before repeating prompts."
-            
-        analysis_text = f"{paragraph1}\n\n{paragraph2}\n\n{paragraph3}"
-        return {'analysis': analysis_text, 'source': 'Deterministic Clinical Heuristic Analyzer'}
+        return no_journals_answer()
+    _, _, llm_answer, heuristic_answer = journal_insight(req, query_hf_llm)
+    return await answer_within_deadline('Journal Analysis', llm_answer, heuristic_answer, req.deadline_ms,
+                                        insight_cache.key('Journal Analysis', req, 0.3))
+
+@backend.post('/predict/journal_analysis/stream')
+async def predict_journal_analysis_stream(req: JournalAnalysisRequest):
+    if not req.journals:
+        return sse_answer(no_journals_answer())
+    prompt, budget, _, heuristic_answer = journal_insight(req, query_hf_llm)
+    return stream_insight('Journal Analysis', 'analysis', insight_stream(prompt, 350, 0.3), budget, heuristic_answer,
+                          insight_cache, insight_cache.key('Journal Analysis', req, 0.3))
+
+
+# ── Bulk Insights ─────────────────────────────────────────────────────────
+# A therapist's whole caseload in one request, see insight_routes.bulk_response.
 
+@backend.post('/predict/bulk')
+async def predict_bulk(req: BulkInsightRequest):
+    return bulk_response(req, {'summary': predict_summary, 'sentiment': predict_sentiment})
 
 # ── Entry Point ───────────────────────────────────────────────────────────────
 # HF Docker Spaces run via uvicorn on port 7860
@@ -0,0 +1,100 @@
+"""
+Benchmark the clinical keyword matcher against the per-list `any(w in t.lower())`
+scans the heuristic fallbacks used before, and check both agree.
+
+Usage (from the hf_space directory):
+    python benchmark_heuristics.py                          # 1k, 10k and 50k transcripts
+    python benchmark_heuristics.py --sizes 5000 --repeats 5
+"""
+
+import argparse
+import random
+import time
+
+from clinical_heuristics import LEXICONS, clinical_matcher
+
+FILLER = ['me', 'wo', 'the', 'today', 'and', 'water', 'mother', 'school', 'eat', 'go', 'home',
+          'speak', 'word', 'slowly', 'again', 'nnɛ', 'fie', 'aduane', 'kɔ', 'ba', 'morning']
+
+
+def synthetic_transcripts(n: int, seed: int = 7):
+    """Short utterances, roughly one in three containing a lexicon word."""
+    rng = random.Random(seed)
+    keywords = [w for words in LEXICONS.values() for w in words]
+    transcripts = []
+    for _ in range(n):
+        words = rng.choices(FILLER, k=rng.randint(3, 14))
+        if rng.random() < 0.35:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords).capitalize())
+        transcripts.append(' '.join(words))
+    return transcripts
+
+
+def legacy_scan(transcripts):
+    """The nested-any scans from the summary, sentiment and journal fallbacks."""
+    twi = LEXICONS['twi'] + LEXICONS['twi_drill']
+    twi_count = sum(1 for t in transcripts if any(w in t.lower() for w in twi))
+    pain_count = sum(1 for t in transcripts if any(w in t.lower() for w in LEXICONS['distress']))
+    scores = [0, 0, 0, 0]
+    for t in transcripts:
+        t_lower = t.lower()
+        matched = False
+        if any(w in t_lower for w in LEXICONS['distress']):
+            scores[0] += 4
+            matched = True
+        if any(w in t_lower for w in LEXICONS['happy']):
+            scores[1] += 4
+            matched = True
+        if any(w in t_lower for w in LEXICONS['anxious']):
+            scores[2] += 4
+            matched = True
+        if not matched:
+            scores[3] += 1
+    struggles = [w for w in LEXICONS['distress'] if any(w in t.lower() for t in transcripts)]
+    happy = [w for w in LEXICONS['happy'] if any(w in t.lower() for t in transcripts)]
+    journal_twi = any(any(w in j.lower() for w in LEXICONS['twi']) for j in transcripts)
+    return twi_count, pain_count, scores, struggles, happy, journal_twi
+
+
+def matcher_scan(transcripts):
+    scan = clinical_matcher.scan(transcripts)
+    scores = [0, 0, 0, 0]
+    for hit in scan.per_text:
+        if 'distress' in hit:
+            scores[0] += 4
+        if 'happy' in hit:
+            scores[1] += 4
+        if 'anxious' in hit:
+            scores[2] += 4
+        if not hit & {'distress', 'happy', 'anxious'}:
+            scores[3] += 1
+    return (scan.count('twi', 'twi_drill'), scan.count('distress'), scores,
+            scan.matched('distress'), scan.matched('happy'), scan.count('twi') > 0)
+
+
+def timed(fn, transcripts, repeats: int) -> float:
+    fn(transcripts)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(transcripts)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the clinical keyword matcher")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        transcripts = synthetic_transcripts(n)
+        if legacy_scan(transcripts) != matcher_scan(transcripts):
+            raise SystemExit(f"❌ Results differ for {n} transcripts")
+        legacy_ms = timed(legacy_scan, transcripts, args.repeats)
+        matcher_ms = timed(matcher_scan, transcripts, args.repeats)
+        print(f"{n:>7} transcripts  legacy={legacy_ms:9.1f} ms  matcher={matcher_ms:9.1f} ms  "
+              f"speed-up={legacy_ms / max(matcher_ms, 1e-6):5.1f}x  ✅ identical")
+
+
+if __name__ == "__main__":
+    main()
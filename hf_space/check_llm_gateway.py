@@ -0,0 +1,298 @@
+"""
+Check LLMGateway failover, hedging, circuit breaking and streaming against
+stub providers. Requests never leave the process: the gateway's HTTP client
+is given an httpx.MockTransport that answers for Gemini and the HuggingFace
+models, so every check runs the real request and parsing code.
+
+The deadline, fallback and cache checks plug fake providers straight into
+the attempts() seam and drive InsightDeadlines the way the /predict
+endpoints do.
+
+Usage (from the hf_space directory):
+    python check_llm_gateway.py
+"""
+
+import asyncio
+import json
+
+import httpx
+
+from llm_gateway import LLMGateway, InsightCache, InsightDeadlines
+
+GEMINI_BASE = 'http://gemini.stub/v1beta'
+HF_BASE = 'http://hf.stub'
+
+
+class StubProviders:
+    """
+    Behaviour per provider attempt name ('gemini', 'Qwen2.5-7B-Instruct:chat',
+    ...): 'ok', 'fail' (HTTP 500), 'empty' or 'slow' (answers after `delay`).
+    Providers without a behaviour fail.
+    """
+    def __init__(self, delay=1.0, **behaviour):
+        self.behaviour = behaviour
+        self.delay = delay
+        self.calls = {}
+
+    def set(self, **behaviour):
+        self.behaviour.update(behaviour)
+
+    def provider(self, request):
+        path = request.url.path
+        if request.url.host == 'gemini.stub':
+            if path.endswith('/models'):
+                return 'gemini:models'
+            return 'gemini'
+        model = path.split('/models/', 1)[1].split('/v1/', 1)[0]
+        return f"{model.split('/')[-1]}:{'chat' if path.endswith('/chat/completions') else 'text'}"
+
+    async def handle(self, request):
+        name = self.provider(request)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if name == 'gemini:models':
+            return httpx.Response(200, json={'models': [
+                {'name': 'models/gemini-1.5-flash', 'supportedGenerationMethods': ['generateContent']},
+            ]})
+        behaviour = self.behaviour.get(name, 'fail')
+        if behaviour == 'slow':
+            await asyncio.sleep(self.delay)
+        if behaviour == 'fail':
+            return httpx.Response(500, json={'error': 'stub failure'})
+        text = '' if behaviour == 'empty' else f'answer from {name}'
+        streaming = 'streamGenerateContent' in request.url.path or json.loads(request.content).get('stream')
+        return self.stream_response(name, text) if streaming else self.response(name, text)
+
+    @staticmethod
+    def response(name, text):
+        if name == 'gemini':
+            return httpx.Response(200, json={'candidates': [{'content': {'parts': [{'text': text}]}}]})
+        if name.endswith(':chat'):
+            return httpx.Response(200, json={'choices': [{'message': {'content': text}}]})
+        return httpx.Response(200, json=[{'generated_text': text}])
+
+    @staticmethod
+    def stream_response(name, text):
+        events = []
+        for word in text.split(' ') if text else []:
+            delta = word + ' '
+            if name == 'gemini':
+                events.append({'candidates': [{'content': {'parts': [{'text': delta}]}}]})
+            elif name.endswith(':chat'):
+                events.append({'choices': [{'delta': {'content': delta}}]})
+            else:
+                events.append({'token': {'text': delta, 'special': False}})
+        body = ''.join(f'data: {json.dumps(e)}\n\n' for e in events) + 'data: [DONE]\n\n'
+        return httpx.Response(200, content=body.encode(), headers={'Content-Type': 'text/event-stream'})
+
+
+def stub_gateway(stub, hedge_delay=5.0):
+    gateway = LLMGateway()
+    gateway.gemini_base, gateway.hf_base = GEMINI_BASE, HF_BASE
+    gateway.gemini_key = lambda: 'stub-key'
+    gateway.hedge_default = hedge_delay
+    gateway._client = httpx.AsyncClient(transport=httpx.MockTransport(stub.handle))
+    return gateway
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+async def check_failover():
+    stub = StubProviders(**{'gemini': 'fail', 'Qwen2.5-7B-Instruct:chat': 'empty', 'Qwen2.5-7B-Instruct:text': 'ok'})
+    gateway = stub_gateway(stub)
+    text = await gateway.query('prompt')
+    check(text == 'answer from Qwen2.5-7B-Instruct:text', f'unexpected answer {text!r}')
+    providers = gateway.stats()['providers']
+    check(providers['gemini']['failures'] == 1, 'Gemini failure not recorded')
+    check(providers['Qwen2.5-7B-Instruct:chat']['failures'] == 1, 'empty answer not counted as a failure')
+    check(stub.calls.get('Llama-3.2-3B-Instruct:chat') is None, 'chain went past the first answer')
+    await gateway.close()
+    return 'a failed and an empty provider fall through to the next one'
+
+
+async def check_hedging():
+    stub = StubProviders(delay=1.0, **{'gemini': 'slow', 'Qwen2.5-7B-Instruct:chat': 'ok'})
+    gateway = stub_gateway(stub, hedge_delay=0.05)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    text = await gateway.query('prompt')
+    elapsed = loop.time() - start
+    check(text == 'answer from Qwen2.5-7B-Instruct:chat', f'unexpected answer {text!r}')
+    check(elapsed < 0.5, f'hedged answer took {elapsed:.2f}s')
+    await asyncio.sleep(0)  # The losing attempt records its cancellation on its next step
+    stats = gateway.stats()
+    check(stats['hedges'] == 1, f"expected one hedge, got {stats['hedges']}")
+    check(stats['providers']['gemini']['cancelled'] == 1, 'slow provider was not cancelled')
+    await gateway.close()
+    return f'a slow provider is hedged after its delay and cancelled ({elapsed * 1000:.0f} ms)'
+
+
+async def check_circuit_breaker():
+    stub = StubProviders(**{'gemini': 'fail', 'Qwen2.5-7B-Instruct:chat': 'ok'})
+    gateway = stub_gateway(stub)
+    gateway.breaker_cooldown = 0.2
+    for _ in range(gateway.breaker_failures):
+        await gateway.query('prompt')
+    check(gateway.breaker('gemini').state == 'open', 'breaker did not open')
+    calls = stub.calls['gemini']
+    await gateway.query('prompt')
+    check(stub.calls['gemini'] == calls, 'open breaker still sent a request')
+    check(gateway.breaker('gemini').skipped == 1, 'skip not recorded')
+
+    await asyncio.sleep(gateway.breaker_cooldown)
+    check(gateway.breaker('gemini').state == 'half_open', 'breaker did not half-open after the cooldown')
+    stub.set(gemini='ok')
+    text = await gateway.query('prompt')
+    check(text == 'answer from gemini', f'trial request not answered by Gemini: {text!r}')
+    check(gateway.breaker('gemini').state == 'closed', 'successful trial did not close the breaker')
+    await gateway.close()
+    return 'repeated failures open the breaker, a trial after the cooldown closes it'
+
+
+async def check_all_fail():
+    gateway = stub_gateway(StubProviders())
+    try:
+        await gateway.query('prompt')
+    except RuntimeError:
+        await gateway.close()
+        return 'an unreachable chain raises instead of returning empty text'
+    raise AssertionError('query returned with every provider failing')
+
+
+async def check_stream_failover():
+    stub = StubProviders(**{'gemini': 'fail', 'Qwen2.5-7B-Instruct:chat': 'ok'})
+    gateway = stub_gateway(stub)
+    deltas = [delta async for delta in gateway.stream('prompt')]
+    check(''.join(deltas).strip() == 'answer from Qwen2.5-7B-Instruct:chat', f'unexpected stream {deltas!r}')
+    check(len(deltas) > 1, 'stream arrived as a single delta')
+    check(gateway.breaker('gemini').failures == 1, 'stream failure not shared with the breaker')
+    await gateway.close()
+    return 'streams fail over before the first token and arrive as deltas'
+
+
+async def check_discovery_cached():
+    stub = StubProviders(gemini='ok')
+    gateway = stub_gateway(stub)
+    for _ in range(3):
+        await gateway.query('prompt')
+    check(stub.calls['gemini:models'] == 1, f"model list fetched {stub.calls['gemini:models']} times")
+    await gateway.close()
+    return 'Gemini model discovery runs once per TTL'
+
+
+class FakeProvider:
+    """Attempt for the attempts() seam: answers `text` after `delay` seconds, or raises if text is None."""
+    def __init__(self, text, delay=0.0):
+        self.text = text
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, prompt, max_tokens, temperature):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.text is None:
+            raise RuntimeError('fake provider failure')
+        return self.text
+
+
+class FakeRequest:
+    """Stands in for a pydantic request model in InsightCache.key."""
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def model_dump(self, exclude=()):
+        return {k: v for k, v in self.fields.items() if k not in exclude}
+
+
+def fake_insights(*providers):
+    gateway = LLMGateway()
+    gateway.attempts = lambda: [(f'fake{i}', provider, ()) for i, provider in enumerate(providers)]
+    deadlines = InsightDeadlines(InsightCache(16, 60), result_ttl=60)
+
+    async def llm_answer():
+        return {'summary': await gateway.query('prompt'), 'source': 'AI (fake)'}
+
+    def heuristic_answer():
+        return {'summary': 'heuristic', 'source': 'Deterministic Clinical Heuristic Analyzer'}
+
+    return gateway, deadlines, llm_answer, heuristic_answer
+
+
+async def check_deadline_upgrade():
+    provider = FakeProvider('llm summary', delay=0.2)
+    gateway, deadlines, llm_answer, heuristic_answer = fake_insights(provider)
+    key = deadlines.cache.key('Summary', FakeRequest(patient_name='Ama', deadline_ms=20), 0.3)
+    first = await deadlines.answer('Summary', llm_answer, heuristic_answer, 20, key)
+    check(first['summary'] == 'heuristic' and 'upgrade_token' in first, f'deadline miss not served by the heuristic: {first}')
+    status, body = await deadlines.upgrade(first['upgrade_token'])
+    check(status == 202, f'unfinished upgrade answered {status}')
+    status, body = await deadlines.upgrade(first['upgrade_token'], wait_ms=1000)
+    check(status == 200 and body['summary'] == 'llm summary', f'upgrade did not return the LLM answer: {status} {body}')
+    again = await deadlines.answer('Summary', llm_answer, heuristic_answer, 20, key)
+    check(again.get('cached') and again['summary'] == 'llm summary', 'late LLM answer was not cached')
+    check(provider.calls == 1, f'provider called {provider.calls} times')
+    status, _ = await deadlines.upgrade('unknown-token')
+    check(status == 404, 'unknown upgrade token not rejected')
+    return 'a missed deadline serves the heuristic, then the upgrade and cache carry the LLM answer'
+
+
+async def check_deadline_met():
+    gateway, deadlines, llm_answer, heuristic_answer = fake_insights(FakeProvider('llm summary', delay=0.01))
+    result = await deadlines.answer('Summary', llm_answer, heuristic_answer, 500)
+    check(result['summary'] == 'llm summary' and 'upgrade_token' not in result, f'fast LLM answer not served: {result}')
+    return 'an LLM answer inside the deadline is served directly'
+
+
+async def check_fallback():
+    failing = FakeProvider(None)
+    gateway, deadlines, llm_answer, heuristic_answer = fake_insights(failing, FakeProvider(''))
+    key = deadlines.cache.key('Summary', FakeRequest(patient_name='Kofi'), 0.3)
+    result = await deadlines.answer('Summary', llm_answer, heuristic_answer, None, key)
+    check(result['summary'] == 'heuristic', f'failing chain not answered by the heuristic: {result}')
+    check(deadlines.cache.get(key) is None, 'heuristic fallback was cached')
+    await deadlines.answer('Summary', llm_answer, heuristic_answer, None, key)
+    check(failing.calls == 2, 'fallback was not retried against the LLM')
+    result = await deadlines.answer('Summary', llm_answer, heuristic_answer, 50)
+    check(result['summary'] == 'heuristic' and 'upgrade_token' not in result,
+          f'failure inside the deadline not answered by the heuristic: {result}')
+    return 'failing providers fall back to the heuristic, which is never cached'
+
+
+async def check_shared_inflight():
+    provider = FakeProvider('llm summary', delay=0.05)
+    gateway, deadlines, llm_answer, heuristic_answer = fake_insights(provider)
+    key = deadlines.cache.key('Summary', FakeRequest(patient_name='Esi'), 0.3)
+    results = await asyncio.gather(*[
+        deadlines.answer('Summary', llm_answer, heuristic_answer, None, key) for _ in range(5)
+    ])
+    check(all(r['summary'] == 'llm summary' for r in results), 'concurrent requests got different answers')
+    check(provider.calls == 1, f'{provider.calls} provider calls for 5 identical requests')
+    return 'identical concurrent requests share one LLM call'
+
+
+CHECKS = [check_failover, check_hedging, check_circuit_breaker, check_all_fail,
+          check_stream_failover, check_discovery_cached,
+          check_deadline_upgrade, check_deadline_met, check_fallback, check_shared_inflight]
+
+
+async def run(checks):
+    failed = 0
+    for fn in checks:
+        try:
+            print(f'✅ {await fn()}')
+        except AssertionError as e:
+            failed += 1
+            print(f'❌ {fn.__name__}: {e}')
+    return failed
+
+
+def main():
+    failed = asyncio.run(run(CHECKS))
+    if failed:
+        raise SystemExit(f'❌ {failed} check(s) failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+VoiceAid Health — Clinical Heuristic Keyword Matcher
+Shared by hf_space/app.py and modal_backend.py for the deterministic
+fallbacks of the /predict endpoints.
+
+The English and Akan keyword lexicons are compiled once into a single regex,
+so each transcript is lowercased and scanned exactly once and every category
+is counted in that one pass. Matching keeps the original semantics: a keyword
+hits when it occurs anywhere in the lowercased text (so 'pa' also hits inside
+'pain').
+"""
+
+import re
+from collections import Counter
+
+LEXICONS = {
+    # Pain, fatigue and frustration markers (English + Akan)
+    'distress': ['pain', 'hurt', 'sad', 'bad', 'tired', 'cry', 'help', 'emergency', 'stop', 'difficult', 'stuck', 'ɛyaw', 'yare'],
+    'happy': ['happy', 'good', 'fine', 'great', 'thank', 'love', 'nice', 'ɛyɛ', 'paa', 'medaase'],
+    'anxious': ['worry', 'scared', 'afraid', 'heart', 'doctor', 'hospital', 'priority', 'nsuro', 'emergency'],
+    # Akan Twi vocabulary, and the syllable drills that only the summary counts as Twi
+    'twi': ['nsuo', 'kasa', 'paa', 'twi', 'ɛyɛ', 'mami', 'dodo', 'yare', 'medaase', 'mepɛ', 'pa'],
+    'twi_drill': ['pe', 'pi', 'po', 'pu', 'firi', 'sɔre', 'sua', 'kofi', 'kosoko'],
+}
+
+
+class HeuristicScan:
+    def __init__(self, per_text, keywords, matcher):
+        """
+        Result of scanning a list of texts
+
+        Args:
+            per_text: For each text, the frozenset of categories it hit
+            keywords: Every keyword found in any text
+            matcher: The KeywordMatcher that produced the scan
+        """
+        self.per_text = per_text
+        self.keywords = keywords
+        self.text_counts = Counter(category for categories in per_text for category in categories)
+        self._matcher = matcher
+
+    def count(self, *categories) -> int:
+        """Number of texts that hit at least one of the categories."""
+        if len(categories) == 1:
+            return self.text_counts[categories[0]]
+        wanted = set(categories)
+        return sum(1 for hit in self.per_text if hit & wanted)
+
+    def matched(self, category) -> list:
+        """Keywords of a category found in any text, in lexicon order."""
+        return [w for w in self._matcher.lexicons[category] if w in self.keywords]
+
+
+class KeywordMatcher:
+    def __init__(self, lexicons: dict):
+        """
+        Compile the lexicons
+
+        Args:
+            lexicons: category -> list of lowercase keywords (a keyword may
+                appear in several categories)
+        """
+        self.lexicons = lexicons
+        self.categories = {}
+        for category, words in lexicons.items():
+            for word in words:
+                self.categories.setdefault(word, set()).add(category)
+
+        # A zero-width lookahead is tried at every position, and with the
+        # alternatives longest-first it captures the longest keyword starting
+        # there. Every other keyword starting at that position is a prefix of
+        # it, so those are expanded from a precomputed table instead of
+        # needing overlapping regex matches.
+        words = sorted(self.categories, key=len, reverse=True)
+        self.pattern = re.compile('(?=(' + '|'.join(re.escape(w) for w in words) + '))')
+        self.prefixes = {w: frozenset(p for p in words if w.startswith(p)) for w in words}
+        self.prefix_categories = {
+            w: frozenset(c for p in prefixes for c in self.categories[p]) for w, prefixes in self.prefixes.items()
+        }
+
+    def keywords_in(self, text: str) -> set:
+        found = set()
+        for longest in set(self.pattern.findall(text.lower())):
+            found |= self.prefixes[longest]
+        return found
+
+    def scan(self, texts) -> HeuristicScan:
+        """Scans every text once, collecting category hits for all lexicons."""
+        findall, table = self.pattern.findall, self.prefix_categories
+        empty = frozenset()
+        per_text, longest = [], set()
+        for text in texts:
+            hits = set(findall(text.lower()))
+            if hits:
+                longest |= hits
+                per_text.append(frozenset().union(*[table[w] for w in hits]))
+            else:
+                per_text.append(empty)
+        keywords = set().union(*[self.prefixes[w] for w in longest])
+        return HeuristicScan(per_text, keywords, self)
+
+
+# Singleton instance
+clinical_matcher = KeywordMatcher(LEXICONS)
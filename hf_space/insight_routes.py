@@ -0,0 +1,280 @@
+"""
+VoiceAid Health — Insight Routes
+Shared by hf_space/app.py and modal_backend.py for the /predict insight
+endpoints.
+
+Holds the request models, the summary and journal prompt builders with their
+heuristic answers, the SSE helpers and the bulk caseload response. Each app
+keeps its own FastAPI routes and passes in its LLM call, stream source and
+single-item handlers.
+"""
+
+import json
+import os
+import re
+from typing import List, Optional, Dict, Any
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from clinical_heuristics import clinical_matcher
+from llm_gateway import insight_events, bulk_events
+from prompt_budget import PromptBudget
+
+
+# ── Request Models ────────────────────────────────────────────────────────
+
+class SummaryRequest(BaseModel):
+    patient_name: str
+    transcripts: List[str]
+    compliance_rate: float
+    streak: int
+    hours_practiced: float
+    struggles: Optional[List[Dict[str, Any]]] = None
+    completed_assignments: Optional[List[Dict[str, Any]]] = None
+    deadline_ms: Optional[int] = None
+
+class SentimentRequest(BaseModel):
+    transcripts: List[str]
+    mood_levels: List[int] = []
+    deadline_ms: Optional[int] = None
+
+class RecommendationRequest(BaseModel):
+    patient_name: str
+    language: str
+    difficulty: str
+    deadline_ms: Optional[int] = None
+
+class JournalAnalysisRequest(BaseModel):
+    patient_name: str
+    journals: List[str]
+    deadline_ms: Optional[int] = None
+
+
+# ── Server-Sent Events ────────────────────────────────────────────────────
+
+def sse_event(payload):
+    return f'data: {json.dumps(payload, ensure_ascii=False)}\n\n'
+
+def sse_response(events):
+    return StreamingResponse(events, media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def sse_answer(answer):
+    """SSE response carrying one finished answer, for requests with nothing to stream."""
+    async def events():
+        yield sse_event({**answer, 'done': True})
+    return sse_response(events())
+
+def stream_insight(kind, field, deltas, budget, heuristic_answer, cache, cache_key):
+    """SSE response for llm_gateway.insight_events; deltas is the app's (source, text delta) stream."""
+    async def events():
+        async for event in insight_events(kind, field, deltas, budget, heuristic_answer, cache, cache_key):
+            yield sse_event(event)
+    return sse_response(events())
+
+
+# ── Prompt Builders ───────────────────────────────────────────────────────
+
+def summary_insight(req, query):
+    """Prompt plus LLM and heuristic answers for a progress summary; query is the app's LLM call."""
+    budget = PromptBudget('Summary')
+    transcripts = budget.fit('transcripts', req.transcripts)
+    transcripts_str = "\n".join([f'- "{t}"' for t in transcripts]) if transcripts else "No recent speech recordings."
+
+    struggles = budget.fit('struggles', [
+        f'- {s.get("questTitle", "Exercise")}: {s.get("incorrectAttempts", s.get("attempts", 1))} mistake(s). Detail: {s.get("detail", "Incorrect attempt")}'
+        for s in req.struggles or []
+    ])
+    struggles_str = "\n".join(struggles) if struggles else "No recent struggles or mistakes logged."
+
+    assignments = budget.fit('assignments', [
+        f'- {a.get("title")} (Category: {a.get("category")}, Completed: {a.get("completed")})' +
+        (f' Voice Response: "{a.get("voice_transcript")}"' if a.get("voice_transcript") else '')
+        for a in req.completed_assignments or []
+    ])
+    assignments_str = "\n".join(assignments) if assignments else "No recent completed assignments."
+
+    prompt = (
+        f"You are a clinical Speech-Language Pathologist (SLP) AI reviewer.\n"
+        f"Synthesize this progress status for patient '{req.patient_name}':\n"
+        f"- Speech Exercises Compliance Rate: {req.compliance_rate}%\n"
+        f"- Consecutive Practice Streak: {req.streak} days\n"
+        f"- Total Practiced Time: {req.hours_practiced} hours\n"
+        f"- Patient Voice Journals & Transcripts:\n{transcripts_str}\n"
+        f"- Recent Game Struggles / Mistakes (Words/Quests patient got wrong):\n{struggles_str}\n"
+        f"- Completed Daily Assignments (and spoken voice responses):\n{assignments_str}\n\n"
+        f"Write a concise, professional clinical progress summary for the therapist as 3 short, standard text paragraphs:\n"
+        f"1. PATIENT PERFORMANCE SUMMARY: Describe compliance, consistency, and progress.\n"
+        f"2. JOURNAL & SENTIMENT ANALYSIS: Reflect on what the patient said in their voice journals, their emotions, and clinical symptoms (like pain, fatigue, recovery signs).\n"
+        f"3. BRAINSTORMED THERAPIST IMPROVEMENT GUIDE: Give specific, actionable tips on what the therapist should do next to help the patient improve. Brainstorm ideas based on the exact words/quests they got wrong (e.g. phoneme drills for those words) and how they completed their assignments."
+        f"\n\nDo NOT use markdown bold, list bullets, hashes, or list markers. Return ONLY clean, readable plain text paragraphs."
+    )
+    
+    async def llm_answer():
+        summary = await query(prompt, max_tokens=350, temperature=0.3)
+        # Strip any accidental markdown formatting the LLM might have returned
+        summary = re.sub(r'\*+', '', summary)
+        summary = re.sub(r'#+', '', summary)
+        summary = re.sub(r'^- ', '', summary, flags=re.MULTILINE)
+        return {'summary': summary.strip(), 'source': 'AI (HuggingFace Serverless LLM)', 'prompt_budget': budget.report()}
+
+    def heuristic_answer():
+        # 1. Dynamic compliance evaluation
+        paragraph1 = f"Clinical review for patient {req.patient_name} shows a current exercise compliance rate of {req.compliance_rate}%. "
+        if req.compliance_rate == 0:
+            paragraph1 += f"At this stage, {req.patient_name} has not registered any recent completed exercises in the database, meaning they require immediate therapist outreach to establish engagement, check device accessibility, and identify early barriers."
+        elif req.compliance_rate < 50:
+            paragraph1 += f"Engagement is currently low, showing that {req.patient_name} is completing less than half of their assigned drills. More frequent follow-ups, caregiver reinforcement, or adjusting the goal target down to shorter daily intervals is recommended to build confidence."
+        elif req.compliance_rate < 80:
+            paragraph1 += f"The patient shows moderate participation. While some sessions are missed, there is a steady baseline of practice. Encouraging a fixed daily time for speech drills could help bridge the remaining compliance gap."
+        else:
+            paragraph1 += f"This represents excellent commitment, indicating that {req.patient_name} is consistently keeping up with daily rehabilitation requirements, which establishes the necessary vocal repetitions for motor-speech neural recovery."
+
+        # 2. Dynamic habit & acoustic evaluation
+        paragraph2 = ""
+        if req.streak > 0:
+            paragraph2 += f"Consistency is supported by a continuous {req.streak}-day streak, indicating strong habit building. "
+        else:
+            paragraph2 += f"No active consecutive streak is currently logged, suggesting that practice sessions are sparse or unscheduled. "
+
+        if req.hours_practiced > 0:
+            paragraph2 += f"Across these sessions, {req.patient_name} has accumulated {req.hours_practiced} hours of voice activity. "
+
+        scan = clinical_matcher.scan(req.transcripts)
+        twi_count = scan.count('twi', 'twi_drill')
+        pain_count = scan.count('distress')
+
+        if req.transcripts:
+            recent_quotes = ", ".join([f'"{t}"' for t in req.transcripts[:2]])
+            paragraph2 += f"Review of recent acoustic output (such as {recent_quotes}) "
+            if twi_count > 0:
+                paragraph2 += "shows prominent usage of Akan Twi dialect, confirming the speech classifier is correctly parsing localized phonology and dialect-specific sound targets. "
+            else:
+                paragraph2 += "indicates primarily English speech exercises. "
+                
+            if pain_count > 0:
+                paragraph2 += f"Of clinical note, several transcript entries contain indicators of frustration, pain, or struggle, signaling that physical or vocal fatigue may be present during training."
+        else:
+            paragraph2 += f"Acoustic logs are currently empty, so active vocal characteristics and speech clarity cannot be evaluated."
+
+        # 3. Dynamic therapist recommendations (Brainstormed therapist improvement guide)
+        paragraph3 = f"Therapist Guidance & Brainstormed Tips: "
+        
+        # Inject struggle feedback if present
+        if req.struggles and len(req.struggles) > 0:
+            wrong_items = [s.get("questTitle", "drills") for s in req.struggles[:2]]
+            paragraph3 += f"Based on recent session errors, the patient is experiencing coordination blocks on {', '.join(wrong_items)}. We brainstormed that the therapist should introduce slow tactile placement drills or syllable segmentation to bypass these specific phonetic traps. "
+        else:
+            paragraph3 += f"No specific exercise struggles were logged, showing that phonetic placement is stable. "
+
+        # Inject assignment feedback if present
+        if req.completed_assignments and len(req.completed_assignments) > 0:
+            comp_list = [a.get("title") for a in req.completed_assignments if a.get("completed")]
+            if comp_list:
+                paragraph3 += f"The patient successfully completed their assigned missions: {', '.join(comp_list[:2])}. If these required voice recordings, their response shows sufficient phonation duration, and the therapist can now advance them to multi-syllable phrases."
+            else:
+                paragraph3 += "Recent assignments are currently pending completion. Therapist should check if the patient finds the instructions too complex."
+        else:
+            paragraph3 += "No clinical assignments were recently completed. Suggest assigning low-demand vocal play exercises to re-engage."
+
+        summary_text = f"{paragraph1}\n\n{paragraph2}\n\n{paragraph3}"
+        return {'summary': summary_text, 'source': 'Deterministic Clinical Heuristic Analyzer'}
+
+    return prompt, budget, llm_answer, heuristic_answer
+
+def no_journals_answer():
+    return {
+        'analysis': "No voice journal entries found to analyze. Advise the patient to record their first journal entry to start receiving clinical insights.",
+        'source': 'Deterministic Heuristic Engine'
+    }
+
+def journal_insight(req, query):
+    """Prompt plus LLM and heuristic answers for a voice journal analysis; query is the app's LLM call."""
+    budget = PromptBudget('Journal Analysis')
+    journals_str = "\n".join([f'- "{j}"' for j in budget.fit('journals', req.journals)])
+    prompt = (
+        f"You are a clinical speech-language pathologist and rehabilitation AI.\n"
+        f"Analyze these recent voice journal transcripts recorded by patient '{req.patient_name}':\n"
+        f"{journals_str}\n\n"
+        f"Write a clinical analysis of their journal entries in 3 short, professional paragraphs:\n"
+        f"Paragraph 1: SPOKEN THEMES & COGNITIVE OUTLOOK. Describe what the patient is talking about (daily routines, concerns, pain, recovery progress) and what their language reveals about their mental state, mood, and cognitive clarity.\n"
+        f"Paragraph 2: CLINICAL REHABILITATION TIPS. Recommend specific breathing, voice, or articulation exercises (e.g., easy-onset phonation, pacing control, diaphragmatic breathing) based on the fatigue or discomfort mentioned.\n"
+        f"Paragraph 3: CAREGIVER COORDINATION GUIDANCE. Give practical suggestions on how the family or caregiver can support the patient in their home environment based on what they expressed."
+        f"\n\nDo NOT use markdown bold, list bullets, hashes, or list markers. Return ONLY clean, readable plain text paragraphs."
+    )
+    
+    async def llm_answer():
+        analysis = await query(prompt, max_tokens=350, temperature=0.3)
+        analysis = re.sub(r'\*+', '', analysis)
+        analysis = re.sub(r'#+', '', analysis)
+        analysis = re.sub(r'^- ', '', analysis, flags=re.MULTILINE)
+        return {'analysis': analysis.strip(), 'source': 'AI (HuggingFace Serverless LLM)', 'prompt_budget': budget.report()}
+
+    def heuristic_answer():
+        # Heuristic fallback based on journal content
+        scan = clinical_matcher.scan(req.journals)
+        has_pain = scan.count('distress') > 0
+        has_twi = scan.count('twi') > 0
+        
+        paragraph1 = f"Spoken Themes & Cognitive Outlook: Analysis of {len(req.journals)} voice journal recordings indicates that {req.patient_name} is actively using their voice board. "
+        if has_pain:
+            paragraph1 += "The transcripts express feelings of fatigue, pain, or difficulty with current communication targets. This suggests increased cognitive load or physical discomfort during daily rehabilitation activities."
+        else:
+            paragraph1 += "The verbal logs show a stable emotional baseline. Topics relate to standard daily activities, indicating steady cognitive clarity and willingness to communicate."
+            
+        paragraph2 = "Clinical Rehabilitation Tips: "
+        if has_pain:
+            paragraph2 += "We recommend introducing gentle vocal play and diaphragmatic breath support exercises (such as sustained vowel phonations). Advise the patient to take frequent rest breaks and avoid straining when articulation blocks occur."
+        else:
+            paragraph2 += "Continue progress with current articulation templates. Introduce conversational short-phrase cards to transition the patient from single words to natural pacing."
+            
+        paragraph3 = "Caregiver Coordination Guidance: "
+        if has_twi:
+            paragraph3 += "Caregivers should encourage communication in the patient's preferred Akan Twi dialect. Practice daily check-ins in a quiet room to reduce environmental noise and auditory fatigue."
+        else:
+            paragraph3 += "Ensure the patient feels supported during communication attempts. Allow ample time (10-15 seconds) for them to formulate responses before repeating prompts."
+            
+        analysis_text = f"{paragraph1}\n\n{paragraph2}\n\n{paragraph3}"
+        return {'analysis': analysis_text, 'source': 'Deterministic Clinical Heuristic Analyzer'}
+
+    return prompt, budget, llm_answer, heuristic_answer
+
+
+# ── Bulk Insights ─────────────────────────────────────────────────────────
+# One request for a therapist's whole caseload. Summary and sentiment jobs
+# run on a bounded worker pool (llm_gateway.bulk_events) and each result is
+# streamed back as an SSE event as soon as it is ready.
+
+class BulkInsightItem(BaseModel):
+    id: str  # Client correlation id, e.g. the patient id
+    summary: Optional[SummaryRequest] = None
+    sentiment: Optional[SentimentRequest] = None
+
+class BulkInsightRequest(BaseModel):
+    items: List[BulkInsightItem]
+    concurrency: int = 6
+    deadline_ms: Optional[int] = None  # Applied to every job that does not set its own
+
+BULK_MAX_ITEMS = 100
+BULK_MAX_CONCURRENCY = int(os.environ.get('BULK_MAX_CONCURRENCY', '8'))
+
+def bulk_response(req, handlers):
+    """SSE response for a BulkInsightRequest; handlers maps 'summary' and 'sentiment' to the app's endpoints."""
+    jobs = [
+        (item.id, kind, payload)
+        for item in req.items
+        for kind, payload in (('summary', item.summary), ('sentiment', item.sentiment))
+        if payload is not None
+    ]
+    if not jobs or len(req.items) > BULK_MAX_ITEMS:
+        return JSONResponse(status_code=400, content={
+            'error': f'Send between 1 and {BULK_MAX_ITEMS} patients with a summary or sentiment payload.'
+        })
+    concurrency = max(1, min(req.concurrency, BULK_MAX_CONCURRENCY, len(jobs)))
+
+    async def events():
+        async for event in bulk_events(jobs, handlers, concurrency, req.deadline_ms):
+            yield sse_event(event)
+
+    return sse_response(events())
@@ -0,0 +1,624 @@
+"""
+VoiceAid Health — LLM Gateway and Insight Serving
+Shared by hf_space/app.py and modal_backend.py for the /predict insight
+endpoints.
+
+LLMGateway keeps one pooled keep-alive HTTP client for every hosted LLM call,
+caches Gemini model discovery for LLM_DISCOVERY_TTL seconds, and hedges and
+circuit-breaks the provider chain. Base URLs can point at a local stub server.
+InsightCache, InsightDeadlines, insight_events and bulk_events are the
+caching, deadline, streaming and caseload layers the endpoints build on; the
+FastAPI routes themselves stay in each app.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import secrets
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+
+import httpx
+
+
+class ProviderBreaker:
+    """
+    Circuit breaker and latency/error stats for one LLM provider attempt.
+    Opens after LLM_BREAKER_FAILURES consecutive failures and lets a single
+    trial request through once LLM_BREAKER_COOLDOWN seconds have passed.
+    """
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = failure_threshold
+        self.cooldown  = cooldown
+        self.latencies = deque(maxlen=200)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.calls = self.successes = self.failures = self.cancelled = self.skipped = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        self.skipped += 1
+        return False
+
+    def record_success(self, latency):
+        self.calls += 1
+        self.successes += 1
+        self.latencies.append(latency)
+        self.consecutive_failures = 0
+        self.opened_at, self.trial_in_flight = None, False
+
+    def record_failure(self):
+        self.calls += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.trial_in_flight or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def record_cancelled(self):
+        self.cancelled += 1
+        self.trial_in_flight = False
+
+    def percentile(self, q):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self):
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            'state': self.state,
+            'calls': self.calls,
+            'successes': self.successes,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'skipped': self.skipped,
+            'consecutive_failures': self.consecutive_failures,
+            'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class LLMGateway:
+    def __init__(self):
+        self.gemini_base = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')
+        self.hf_base     = os.environ.get('HF_INFERENCE_BASE', 'https://api-inference.huggingface.co')
+        self.hf_models   = ['Qwen/Qwen2.5-7B-Instruct', 'meta-llama/Llama-3.2-3B-Instruct']
+        self.discovery_ttl = float(os.environ.get('LLM_DISCOVERY_TTL', '3600'))
+        self.timeouts = {
+            'gemini': httpx.Timeout(float(os.environ.get('LLM_TIMEOUT_GEMINI', '15')), connect=3.0),
+            'hf':     httpx.Timeout(float(os.environ.get('LLM_TIMEOUT_HF', '10')), connect=3.0),
+        }
+        self._client = None
+        self._gemini_model = None
+        self._gemini_expires = 0.0
+        self._discovery_lock = asyncio.Lock()
+        # Hedging and circuit breaking (see query)
+        self.hedge_percentile = float(os.environ.get('LLM_HEDGE_PERCENTILE', '0.9'))
+        self.hedge_default    = float(os.environ.get('LLM_HEDGE_DELAY', '3.0'))
+        self.hedge_min        = float(os.environ.get('LLM_HEDGE_MIN_DELAY', '0.5'))
+        self.breaker_failures = int(os.environ.get('LLM_BREAKER_FAILURES', '3'))
+        self.breaker_cooldown = float(os.environ.get('LLM_BREAKER_COOLDOWN', '30'))
+        self.breakers = {}
+        self.wins     = {}
+        self.hedges   = 0
+
+    @property
+    def client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=120),
+                headers={'Content-Type': 'application/json'},
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def gemini_model(self, key):
+        """Exact model identifier for this key/region, discovered once per TTL."""
+        if self._gemini_model and time.monotonic() < self._gemini_expires:
+            return self._gemini_model
+        async with self._discovery_lock:
+            if self._gemini_model and time.monotonic() < self._gemini_expires:
+                return self._gemini_model
+            model_to_use, ttl = 'models/gemini-1.5-flash', self.discovery_ttl
+            try:
+                res = await self.client.get(f'{self.gemini_base}/models', params={'key': key, 'pageSize': 1000},
+                                            timeout=self.timeouts['gemini'])
+                res.raise_for_status()
+                available = [m['name'] for m in res.json().get('models', [])
+                             if 'generateContent' in m.get('supportedGenerationMethods', [])]
+                # Prefer gemini-1.5-flash, otherwise any gemini model
+                flash_models = [name for name in available if 'gemini-1.5-flash' in name.lower()]
+                any_gemini   = [name for name in available if 'gemini' in name.lower()]
+                if flash_models or any_gemini:
+                    model_to_use = (flash_models or any_gemini)[0]
+            except Exception as list_err:
+                print(f"[AI Backend] ⚠️ Could not list Gemini models dynamically, using default name: {list_err}")
+                ttl = min(ttl, 60.0)  # Retry discovery soon rather than pinning the default
+            self._gemini_model, self._gemini_expires = model_to_use, time.monotonic() + ttl
+            print(f"[AI Backend] Using GenerativeModel: {model_to_use}")
+            return model_to_use
+
+    def gemini_key(self):
+        return os.environ.get('GEMINI_API_KEY') or os.environ.get('GOOGLE_API_KEY')
+
+    async def gemini(self, prompt, max_tokens, temperature):
+        key = self.gemini_key()
+        model_name = await self.gemini_model(key)
+        res = await self.client.post(
+            f'{self.gemini_base}/{model_name}:generateContent', params={'key': key},
+            json={
+                'contents': [{'parts': [{'text': prompt}]}],
+                'generationConfig': {'maxOutputTokens': max_tokens, 'temperature': temperature},
+            },
+            timeout=self.timeouts['gemini'],
+        )
+        if res.status_code == 404:
+            self._gemini_expires = 0.0  # Model retired: rediscover next time
+        res.raise_for_status()
+        candidates = res.json().get('candidates') or [{}]
+        parts = candidates[0].get('content', {}).get('parts', [])
+        return ''.join(p.get('text', '') for p in parts).strip()
+
+    def hf_headers(self):
+        token = os.environ.get('HF_TOKEN') or os.environ.get('HUGGINGFACE_CO_RESOLVE_PROVIDER') or os.environ.get('HF_API_KEY')
+        return {'Authorization': f'Bearer {token}'} if token else {}
+
+    async def hf_chat(self, model_name, prompt, max_tokens, temperature):
+        res = await self.client.post(
+            f'{self.hf_base}/models/{model_name}/v1/chat/completions', headers=self.hf_headers(),
+            json={'messages': [{'role': 'user', 'content': prompt}], 'max_tokens': max_tokens, 'temperature': temperature},
+            timeout=self.timeouts['hf'],
+        )
+        res.raise_for_status()
+        return (res.json().get('choices', [{}])[0].get('message', {}).get('content') or '').strip()
+
+    async def hf_text(self, model_name, prompt, max_tokens, temperature):
+        res = await self.client.post(
+            f'{self.hf_base}/models/{model_name}', headers=self.hf_headers(),
+            json={'inputs': prompt, 'parameters': {
+                'max_new_tokens': max_tokens, 'temperature': temperature, 'return_full_text': False
+            }},
+            timeout=self.timeouts['hf'],
+        )
+        res.raise_for_status()
+        res_json = res.json()
+        if isinstance(res_json, list) and res_json:
+            res_json = res_json[0]
+        return (res_json.get('generated_text') or '').strip() if isinstance(res_json, dict) else ''
+
+    def attempts(self):
+        """Provider attempts in preference order: (name, coroutine function, args)."""
+        chain = [('gemini', self.gemini, ())] if self.gemini_key() else []
+        for model_name in self.hf_models:
+            short = model_name.split('/')[-1]
+            chain.append((f'{short}:chat', self.hf_chat, (model_name,)))
+            chain.append((f'{short}:text', self.hf_text, (model_name,)))
+        return chain
+
+    def breaker(self, name):
+        if name not in self.breakers:
+            self.breakers[name] = ProviderBreaker(self.breaker_failures, self.breaker_cooldown)
+        return self.breakers[name]
+
+    def hedge_delay(self, name):
+        """Wait this long for a provider before hedging: its latency percentile once it has history."""
+        observed = self.breaker(name).percentile(self.hedge_percentile)
+        if observed is None or len(self.breaker(name).latencies) < 5:
+            return self.hedge_default
+        return max(self.hedge_min, observed)
+
+    async def attempt(self, name, call, args, prompt, max_tokens, temperature):
+        stats = self.breaker(name)
+        start = time.monotonic()
+        try:
+            text = await call(*args, prompt, max_tokens, temperature)
+        except asyncio.CancelledError:
+            stats.record_cancelled()
+            raise
+        except Exception as e:
+            stats.record_failure()
+            print(f"[AI Backend] Warning: {name} request failed: {e}")
+            return ''
+        if not text:
+            stats.record_failure()
+            print(f"[AI Backend] Warning: {name} returned an empty response")
+            return ''
+        stats.record_success(time.monotonic() - start)
+        return text
+
+    async def query(self, prompt, max_tokens=250, temperature=0.3):
+        """
+        Races the provider chain: the next provider starts as soon as the current
+        one fails, or is hedged in alongside it once the current one exceeds its
+        usual latency. The first non-empty answer wins and the rest are cancelled.
+        Providers with an open circuit breaker are skipped.
+        """
+        chain = (a for a in self.attempts() if self.breaker(a[0]).allow())
+        pending = {}
+
+        def launch():
+            for name, call, args in chain:
+                task = asyncio.create_task(self.attempt(name, call, args, prompt, max_tokens, temperature))
+                pending[task] = name
+                return name
+            return None
+
+        latest = launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay(latest) if latest else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    latest = launch()
+                    if latest:
+                        self.hedges += 1
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    text = task.result()
+                    if text:
+                        print(f"[AI Backend] ✅ {name} responded successfully")
+                        self.wins[name] = self.wins.get(name, 0) + 1
+                        return text
+                # A failure starts the next provider straight away
+                latest = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise RuntimeError("All inference model APIs are unreachable or timed out.")
+
+    @staticmethod
+    async def sse_events(res):
+        async for line in res.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                return
+            if data:
+                yield json.loads(data)
+
+    async def gemini_stream(self, prompt, max_tokens, temperature):
+        key = self.gemini_key()
+        model_name = await self.gemini_model(key)
+        async with self.client.stream(
+            'POST', f'{self.gemini_base}/{model_name}:streamGenerateContent', params={'key': key, 'alt': 'sse'},
+            json={
+                'contents': [{'parts': [{'text': prompt}]}],
+                'generationConfig': {'maxOutputTokens': max_tokens, 'temperature': temperature},
+            },
+            timeout=self.timeouts['gemini'],
+        ) as res:
+            if res.status_code == 404:
+                self._gemini_expires = 0.0
+            res.raise_for_status()
+            async for event in self.sse_events(res):
+                candidates = event.get('candidates') or [{}]
+                for part in candidates[0].get('content', {}).get('parts', []):
+                    yield part.get('text', '')
+
+    async def hf_chat_stream(self, model_name, prompt, max_tokens, temperature):
+        async with self.client.stream(
+            'POST', f'{self.hf_base}/models/{model_name}/v1/chat/completions', headers=self.hf_headers(),
+            json={'messages': [{'role': 'user', 'content': prompt}], 'max_tokens': max_tokens,
+                  'temperature': temperature, 'stream': True},
+            timeout=self.timeouts['hf'],
+        ) as res:
+            res.raise_for_status()
+            async for event in self.sse_events(res):
+                choices = event.get('choices') or [{}]
+                yield choices[0].get('delta', {}).get('content') or ''
+
+    async def hf_text_stream(self, model_name, prompt, max_tokens, temperature):
+        async with self.client.stream(
+            'POST', f'{self.hf_base}/models/{model_name}', headers=self.hf_headers(),
+            json={'inputs': prompt, 'stream': True, 'parameters': {
+                'max_new_tokens': max_tokens, 'temperature': temperature, 'return_full_text': False
+            }},
+            timeout=self.timeouts['hf'],
+        ) as res:
+            res.raise_for_status()
+            async for event in self.sse_events(res):
+                token = event.get('token') or {}
+                if not token.get('special'):
+                    yield token.get('text') or ''
+
+    def stream_attempts(self):
+        chain = [('gemini', self.gemini_stream, ())] if self.gemini_key() else []
+        for model_name in self.hf_models:
+            short = model_name.split('/')[-1]
+            chain.append((f'{short}:chat', self.hf_chat_stream, (model_name,)))
+            chain.append((f'{short}:text', self.hf_text_stream, (model_name,)))
+        return chain
+
+    async def stream(self, prompt, max_tokens=250, temperature=0.3):
+        """
+        Streams text deltas from the first provider that produces any. Providers
+        fail over (and share the circuit breakers with query) only until the first
+        token; a failure after that is raised to the caller.
+        """
+        for name, call, args in self.stream_attempts():
+            stats = self.breaker(name)
+            if not stats.allow():
+                continue
+            start, started = time.monotonic(), False
+            try:
+                async for delta in call(*args, prompt, max_tokens, temperature):
+                    if delta:
+                        started = True
+                        yield delta
+            except (GeneratorExit, asyncio.CancelledError):
+                stats.record_cancelled()
+                raise
+            except Exception as e:
+                stats.record_failure()
+                if started:
+                    raise
+                print(f"[AI Backend] Warning: {name} stream failed: {e}")
+                continue
+            if started:
+                stats.record_success(time.monotonic() - start)
+                self.wins[name] = self.wins.get(name, 0) + 1
+                return
+            stats.record_failure()
+        raise RuntimeError("All inference model APIs are unreachable or timed out.")
+
+    def stats(self):
+        return {
+            'hedges': self.hedges,
+            'wins': dict(self.wins),
+            'providers': {name: b.snapshot() for name, b in self.breakers.items()},
+        }
+
+
+# ── Insight Response Cache ────────────────────────────────────────────────
+# LLM answers for /predict/* keyed by a canonical hash of the request model,
+# the prompt template version and the sampling temperature. Only LLM answers
+# are cached, so a heuristic fallback is retried against the LLM next time.
+
+# Bump an entry whenever its prompt template changes so stale answers are not served
+PROMPT_VERSIONS = {'Summary': 2, 'Sentiment': 2, 'Recommendations': 1, 'Journal Analysis': 2}
+
+class InsightCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, response)
+        self._inflight = {}            # key -> task, so identical concurrent requests share one LLM call
+        self.hits = self.misses = self.shared = 0
+
+    @staticmethod
+    def key(kind, req, temperature):
+        fields = req.model_dump(exclude={'deadline_ms'})
+        material = json.dumps([kind, PROMPT_VERSIONS[kind], temperature, fields],
+                              sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, response):
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def wrap(self, key, llm_answer):
+        """Coroutine function that joins an in-flight call for key or starts one that fills the cache."""
+        async def run():
+            response = await llm_answer()
+            self.put(key, response)
+            return response
+
+        async def cached_llm_answer():
+            task = self._inflight.get(key)
+            if task is None:
+                task = asyncio.create_task(run())
+                self._inflight[key] = task
+                task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            else:
+                self.shared += 1
+            return await asyncio.shield(task)
+        return cached_llm_answer
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'shared_inflight': self.shared}
+
+# ── Deadline-bounded insights ─────────────────────────────────────────────
+# With deadline_ms set, an insight request computes the heuristic answer
+# straight away and races it against the LLM chain. If the LLM misses the
+# deadline the heuristic is returned with an upgrade token, and the LLM
+# answer keeps generating for GET /predict/upgrade/{token}.
+
+class InsightDeadlines:
+    def __init__(self, cache, result_ttl):
+        self.cache = cache
+        self.result_ttl = result_ttl
+        self.results = {}  # token -> {'task', 'kind', 'expires'}
+
+    def prune(self):
+        now = time.monotonic()
+        for token in [t for t, entry in self.results.items() if entry['expires'] < now]:
+            self.results.pop(token)['task'].cancel()
+
+    async def answer(self, kind, llm_answer, heuristic_answer, deadline_ms=None, cache_key=None):
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return {**cached, 'cached': True}
+            llm_answer = self.cache.wrap(cache_key, llm_answer)
+            return {**await self.answer(kind, llm_answer, heuristic_answer, deadline_ms), 'cached': False}
+
+        if deadline_ms is None:
+            try:
+                return await llm_answer()
+            except Exception as e:
+                print(f"[AI Backend] Fallback triggered for {kind}: {e}")
+                return heuristic_answer()
+
+        task = asyncio.create_task(llm_answer())
+        # Mark failures as retrieved so an unfetched upgrade does not log a warning
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        fallback = heuristic_answer()
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), max(deadline_ms, 0) / 1000)
+        except asyncio.TimeoutError:
+            self.prune()
+            token = secrets.token_urlsafe(16)
+            self.results[token] = {'task': task, 'kind': kind, 'expires': time.monotonic() + self.result_ttl}
+            print(f"[AI Backend] {kind} missed its {deadline_ms} ms deadline, serving heuristic with an upgrade token")
+            return {**fallback, 'upgrade_token': token, 'upgrade_url': f'/predict/upgrade/{token}'}
+        except Exception as e:
+            print(f"[AI Backend] Fallback triggered for {kind}: {e}")
+            return fallback
+
+    async def upgrade(self, token, wait_ms=0):
+        """(status code, body) for an upgrade token. wait_ms long-polls for up to 30 s."""
+        self.prune()
+        entry = self.results.get(token)
+        if entry is None:
+            return 404, {'error': 'Unknown or expired upgrade token.'}
+        task = entry['task']
+        if not task.done() and wait_ms > 0:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), min(wait_ms, 30000) / 1000)
+            except Exception:
+                pass
+        if not task.done():
+            return 202, {'status': 'pending', 'kind': entry['kind']}
+        if task.cancelled() or task.exception() is not None:
+            return 200, {'status': 'failed', 'kind': entry['kind']}
+        return 200, {**task.result(), 'status': 'ready'}
+
+
+# ── Streaming insights ────────────────────────────────────────────────────
+# Each 'token' event carries cleaned text as it is generated; the final event
+# has done=true and the complete payload (the same shape as the non-streaming
+# endpoint), which clients should treat as authoritative.
+
+class MarkdownStripper:
+    """Incremental form of the insight clean-up: drops * and #, and '- ' at line starts."""
+    def __init__(self):
+        self.held = ''
+        self.line_start = True
+        self.started = False
+
+    def feed(self, delta):
+        text = self.held + re.sub(r'[*#]+', '', delta)
+        self.held = ''
+        # A '-' at a line start might become a list marker once the next delta arrives
+        if text.endswith('-') and (text[-2:-1] == '\n' or (len(text) == 1 and self.line_start)):
+            text, self.held = text[:-1], '-'
+        if not text:
+            return ''
+        out = re.sub(r'^- ', '', ('\n' if self.line_start else 'x') + text, flags=re.MULTILINE)[1:]
+        if out:
+            self.line_start = out.endswith('\n')
+        if not self.started:
+            out = out.lstrip()
+            self.started = bool(out)
+        return out
+
+    def finish(self):
+        held, self.held = self.held, ''
+        return held
+
+async def insight_events(kind, field, deltas, budget, heuristic_answer, cache, cache_key):
+    """Event payloads for a streamed insight; deltas yields (source, text delta) pairs."""
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield {'token': cached[field]}
+        yield {**cached, 'cached': True, 'done': True}
+        return
+
+    stripper, parts = MarkdownStripper(), []
+    try:
+        async with aclosing(deltas):  # a client disconnect closes the provider stream too
+            async for source, delta in deltas:
+                text = stripper.feed(delta)
+                if text:
+                    parts.append(text)
+                    yield {'token': text}
+        parts.append(stripper.finish())
+        text = ''.join(parts).strip()
+        if not text:
+            raise RuntimeError('LLM returned no text')
+        response = {field: text, 'source': source, 'prompt_budget': budget.report()}
+        cache.put(cache_key, response)
+        yield {**response, 'cached': False, 'done': True}
+    except Exception as e:
+        print(f"[AI Backend] Fallback triggered for {kind} stream: {e}")
+        yield {**heuristic_answer(), 'cached': False, 'done': True}
+
+
+# ── Bulk Insights ─────────────────────────────────────────────────────────
+# Caseload jobs run on a bounded pool of workers that share the LLM gateway
+# and insight cache. Each result is yielded as soon as it is ready, followed
+# by a final done event.
+
+async def bulk_events(jobs, handlers, concurrency, deadline_ms=None):
+    """Event payloads for (item id, kind, payload) jobs; deadline_ms applies to payloads without their own."""
+    pending, results = asyncio.Queue(), asyncio.Queue()
+    for job in jobs:
+        pending.put_nowait(job)
+
+    async def worker():
+        while not pending.empty():
+            item_id, kind, payload = pending.get_nowait()
+            if payload.deadline_ms is None:
+                payload.deadline_ms = deadline_ms
+            start = time.monotonic()
+            event = {'id': item_id, 'kind': kind}
+            try:
+                event['result'] = await handlers[kind](payload)
+            except Exception as e:
+                print(f"[AI Backend] Bulk {kind} failed for {item_id}: {e}")
+                event['error'] = str(e)
+            event['elapsed_ms'] = round((time.monotonic() - start) * 1000)
+            results.put_nowait(event)
+
+    started = time.monotonic()
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    failed = 0
+    try:
+        for _ in range(len(jobs)):
+            event = await results.get()
+            failed += 'error' in event
+            yield event
+        yield {
+            'done': True, 'completed': len(jobs) - failed, 'failed': failed,
+            'concurrency': concurrency, 'elapsed_ms': round((time.monotonic() - started) * 1000),
+        }
+    finally:
+        # Client went away or we finished: stop any workers still running
+        for task in workers:
+            task.cancel()
@@ -0,0 +1,145 @@
+"""
+VoiceAid Health — Prompt Budgeting
+Shared by hf_space/app.py and modal_backend.py to keep /predict prompts
+bounded for patients with long histories.
+
+Each variable section of a prompt (transcripts, struggles, assignments,
+journals) gets a token budget. Entries are de-duplicated, over-long entries
+are clipped, and the most recent and most clinically relevant entries are
+kept in their original order. The report records what was left out.
+"""
+
+import os
+import re
+
+from clinical_heuristics import clinical_matcher
+
+# Token budget per endpoint and prompt section; PROMPT_BUDGET_SCALE scales them all
+PROMPT_BUDGETS = {
+    'Summary': {'transcripts': 700, 'struggles': 250, 'assignments': 300},
+    'Sentiment': {'transcripts': 600},
+    'Journal Analysis': {'journals': 1500},
+}
+BUDGET_SCALE = float(os.environ.get('PROMPT_BUDGET_SCALE', '1.0'))
+
+# Longest single entry, in tokens, before it is clipped
+MAX_ENTRY_TOKENS = 160
+
+# Only this many of the most recent entries are considered at all
+MAX_CANDIDATES = 500
+
+# Near-duplicate detection compares against this many of the most recent kept entries
+DEDUP_WINDOW = 32
+DEDUP_JACCARD = 0.8
+
+# Recency score halves every RECENCY_HALF_LIFE entries; clinically relevant
+# categories add to it, so an older distress entry can outrank a newer neutral one
+RECENCY_WEIGHT = 3.0
+RECENCY_HALF_LIFE = 10
+RELEVANT_CATEGORIES = {'distress': 1.0, 'anxious': 1.0, 'happy': 0.5}
+
+
+def estimate_tokens(text: str) -> int:
+    """Conservative estimate of ~4 UTF-8 bytes per token; Akan ɛ/ɔ take 2 bytes and tokenize poorly."""
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+def _words(text: str) -> list:
+    return re.sub(r'[^\w\s]', ' ', text.lower()).split()
+
+
+def clip_entry(text: str, max_tokens: int = MAX_ENTRY_TOKENS) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    clipped = text.encode('utf-8')[:max_tokens * 4].decode('utf-8', errors='ignore')
+    return clipped.rsplit(' ', 1)[0] + '…'
+
+
+class PromptBudget:
+    def __init__(self, endpoint: str):
+        """
+        Budgets for one prompt
+
+        Args:
+            endpoint: Key into PROMPT_BUDGETS, e.g. 'Summary'
+        """
+        self.endpoint = endpoint
+        self.budgets = PROMPT_BUDGETS[endpoint]
+        self.sections = {}
+
+    def fit(self, section: str, entries) -> list:
+        """
+        Selects the entries of one section that fit its budget.
+
+        Args:
+            section: Section name in the endpoint's budgets
+            entries: Rendered entries, most recent first (the order clients send)
+
+        Returns:
+            Kept entries, still most recent first
+        """
+        budget = int(self.budgets[section] * BUDGET_SCALE)
+        entries = [e for e in (entries or []) if e and e.strip()]
+        candidates = entries[:MAX_CANDIDATES]
+
+        # 1. Drop near-identical entries, keeping the most recent copy
+        unique, seen, recent_sets, duplicates = [], set(), [], 0
+        for index, entry in enumerate(candidates):
+            words = _words(entry)
+            key = ' '.join(words)
+            word_set = set(words)
+            size = len(word_set)
+            # Jaccard >= DEDUP_JACCARD is impossible unless the set sizes are that close
+            near = key in seen or (size >= 4 and any(
+                DEDUP_JACCARD * size <= len(other) <= size / DEDUP_JACCARD
+                and len(word_set & other) / len(word_set | other) >= DEDUP_JACCARD
+                for other in recent_sets
+            ))
+            if near:
+                duplicates += 1
+                continue
+            seen.add(key)
+            recent_sets = (recent_sets + [word_set])[-DEDUP_WINDOW:]
+            unique.append((index, entry))
+
+        # 2. Rank by recency plus clinical relevance, then fill the budget
+        scan = clinical_matcher.scan([entry for _, entry in unique])
+        ranked = []
+        for rank, ((index, entry), hit) in enumerate(zip(unique, scan.per_text)):
+            recency = RECENCY_WEIGHT * 0.5 ** (rank / RECENCY_HALF_LIFE)
+            relevance = sum(weight for category, weight in RELEVANT_CATEGORIES.items() if category in hit)
+            ranked.append((recency + relevance, -rank, index, entry))
+        ranked.sort(reverse=True)
+
+        kept, used, clipped = [], 0, 0
+        for _, _, index, entry in ranked:
+            text = clip_entry(entry)
+            cost = estimate_tokens(text) + 2  # list marker and newline
+            if used + cost > budget:
+                continue
+            clipped += text != entry
+            kept.append((index, text))
+            used += cost
+        kept.sort()
+
+        self.sections[section] = {
+            'received': len(entries),
+            'kept': len(kept),
+            'duplicates': duplicates,
+            'dropped': len(entries) - duplicates - len(kept),
+            'clipped': clipped,
+            'tokens': used,
+            'budget': budget,
+        }
+        return [text for _, text in kept]
+
+    @property
+    def truncated(self) -> bool:
+        return any(s['duplicates'] or s['dropped'] or s['clipped'] for s in self.sections.values())
+
+    def report(self) -> dict:
+        return {
+            'truncated': self.truncated,
+            'tokens': sum(s['tokens'] for s in self.sections.values()),
+            'sections': self.sections,
+        }
@@ -5,14 +5,18 @@ Deploy with: modal deploy modal_backend.py
 
 import modal
 import io
+import os
 import re
 import json
 import base64
+from contextlib import aclosing
 
 # ─── Modal App Definition ────────────────────────────────────────────────────
 
 app = modal.App("voiceaid-health")
 
+HF_SPACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hf_space")
+
 # Docker image with all required ML dependencies
 image = (
     modal.Image.debian_slim(python_version="3.11")
@@ -30,10 +34,15 @@ image = (
         "accelerate==0.34.0",
         "librosa==0.10.2",
         "numpy==1.26.4",
-        "google-generativeai>=0.7.0",
         "huggingface_hub>=0.24.0",
+        "httpx>=0.27.0",
     )
     .apt_install("ffmpeg")  # Required by pydub for audio processing
+    # Keyword matcher, prompt budgeting and LLM gateway shared with the HF Space backend
+    .add_local_file(os.path.join(HF_SPACE_DIR, "clinical_heuristics.py"), "/root/clinical_heuristics.py")
+    .add_local_file(os.path.join(HF_SPACE_DIR, "prompt_budget.py"), "/root/prompt_budget.py")
+    .add_local_file(os.path.join(HF_SPACE_DIR, "llm_gateway.py"), "/root/llm_gateway.py")
+    .add_local_file(os.path.join(HF_SPACE_DIR, "insight_routes.py"), "/root/insight_routes.py")
 )
 
 # ─── FastAPI App (runs inside Modal container) ────────────────────────────────
@@ -51,15 +60,17 @@ def fastapi_app():
     import asyncio
     import numpy as np
     import scipy.io.wavfile
-    from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect
-    from fastapi.responses import StreamingResponse, JSONResponse
+    from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Header
+    from fastapi.responses import StreamingResponse, JSONResponse, Response
     from fastapi.middleware.cors import CORSMiddleware
     from pydantic import BaseModel
     from starlette.types import ASGIApp, Receive, Scope, Send
     from transformers import (
         AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline,
-        VitsModel, AutoTokenizer, AutoModelForCausalLM
+        VitsModel, AutoTokenizer, AutoModelForCausalLM,
+        StoppingCriteria, StoppingCriteriaList
     )
+    import threading
 
     # ── PERMANENT FIX: Patch Whisper _need_fallback ──
     import transformers.models.whisper.generation_whisper as _gw
@@ -182,7 +193,7 @@ def fastapi_app():
             return
         mid = 'Qwen/Qwen2.5-1.5B-Instruct'
         print(f'🧠 Loading LLM ({mid})...')
-        llm_tok   = AutoTokenizer.from_pretrained(mid)
+        llm_tok   = AutoTokenizer.from_pretrained(mid, padding_side='left')
         llm_model = AutoModelForCausalLM.from_pretrained(mid, torch_dtype=DTYPE, device_map=DEVICE)
         print('✅ LLM Loaded!')
 
@@ -216,316 +227,426 @@ def fastapi_app():
         result = asr_pipes[model_id](samples, generate_kwargs=gen_kwargs)
         return {'text': dysarthric_filter(result['text']), 'model': model_id, 'language': language}
 
+    # ── Stream Cancellation ───────────────────────────────────────────────────
+    # Work for a socket is cancelled as soon as the client disconnects: queued
+    # chunks are dropped and a running generation stops at the next token.
+
+    stream_metrics = {
+        'sessions_cancelled': 0, 'chunks_dropped': 0,
+        'generations_aborted': 0, 'audio_seconds_aborted': 0.0,
+        'chunks_shed': 0,
+    }
+    # Chunks waiting for inference per socket; the oldest is shed beyond this
+    STREAM_MAX_PENDING = int(os.environ.get('STREAM_MAX_PENDING_CHUNKS', '8'))
+    stream_metrics_lock = threading.Lock()
+
+    class CancelOnDisconnect(StoppingCriteria):
+        def __init__(self, cancel_event): self.cancel_event, self.triggered = cancel_event, False
+        def __call__(self, input_ids, scores, **kwargs):
+            if self.cancel_event.is_set():
+                self.triggered = True
+            return torch.full((input_ids.shape[0],), self.triggered, dtype=torch.bool, device=input_ids.device)
+
+    def transcribe_chunk(audio_b64, language, cancel_event):
+        """Blocking decode + ASR for one stream chunk; returns (text, model_id, seconds, aborted)."""
+        from pydub import AudioSegment
+        audio = (
+            AudioSegment.from_file(io.BytesIO(base64.b64decode(audio_b64)))
+            .set_channels(1).set_frame_rate(16000)
+        )
+        samples = np.array(audio.get_array_of_samples()).astype(np.float32) / 32768.0
+        seconds = len(samples) / 16000
+        if cancel_event.is_set():
+            return '', None, seconds, True
+        model_id = load_asr(language)
+        gen_kwargs = ASR_KWARGS.copy()
+        if language in ['en', 'eng', 'english']:
+            gen_kwargs['language'] = 'english'
+        stop = CancelOnDisconnect(cancel_event)
+        gen_kwargs['stopping_criteria'] = StoppingCriteriaList([stop])
+        result = asr_pipes[model_id](samples, generate_kwargs=gen_kwargs)
+        return dysarthric_filter(result['text']), model_id, seconds, stop.triggered
+
+    @backend.get('/asr/stream/metrics')
+    async def stream_metrics_snapshot():
+        with stream_metrics_lock:
+            return dict(stream_metrics, audio_seconds_aborted=round(stream_metrics['audio_seconds_aborted'], 2))
+
     @backend.websocket('/asr/stream')
     async def stream_transcription(websocket: WebSocket):
         await websocket.accept()
         print(f'✅ WebSocket connected ({DEVICE.upper()} mode)')
-        try:
+        queue        = asyncio.Queue(maxsize=STREAM_MAX_PENDING)
+        cancel_event = threading.Event()
+
+        async def inference_worker():
             while True:
-                data     = await websocket.receive_text()
-                message  = json.loads(data)
-                audio_b64 = message.get('audio')
-                language  = message.get('language', 'tw')
-                chunk_id  = message.get('chunk_id', 0)
-                if not audio_b64:
+                message = await queue.get()
+                if message is None or cancel_event.is_set():
+                    return
+                language = message.get('language', 'tw')
+                chunk_id = message.get('chunk_id', 0)
+                try:
+                    clean, model_id, seconds, aborted = await asyncio.to_thread(
+                        transcribe_chunk, message['audio'], language, cancel_event
+                    )
+                except Exception as e:
+                    print(f'[ASR] Error processing chunk {chunk_id}: {e}')
                     continue
-
-                from pydub import AudioSegment
-                audio = (
-                    AudioSegment.from_file(io.BytesIO(base64.b64decode(audio_b64)))
-                    .set_channels(1).set_frame_rate(16000)
-                )
-                samples = np.array(audio.get_array_of_samples()).astype(np.float32) / 32768.0
-                model_id = load_asr(language)
-                gen_kwargs = ASR_KWARGS.copy()
-                if language in ['en', 'eng', 'english']:
-                    gen_kwargs['language'] = 'english'
-                result   = asr_pipes[model_id](samples, generate_kwargs=gen_kwargs)
-                clean    = dysarthric_filter(result['text'])
+                if aborted and model_id is None:
+                    # Cancelled before inference began: a dropped chunk, not an aborted generation
+                    with stream_metrics_lock:
+                        stream_metrics['chunks_dropped'] += 1
+                    return
+                if aborted:
+                    with stream_metrics_lock:
+                        stream_metrics['generations_aborted'] += 1
+                        stream_metrics['audio_seconds_aborted'] += seconds
+                    print(f'[ASR] ⏹️ Aborted chunk {chunk_id} after disconnect')
+                    return
 
                 if not clean or len(clean.strip()) < 2:
                     print(f'[ASR] ⏭️ Skipping silent chunk {chunk_id}')
                     continue
 
-                await websocket.send_json({
-                    'text': clean, 'chunk_id': chunk_id,
-                    'model': model_id, 'is_final': False, 'language': language,
-                })
+                try:
+                    await websocket.send_json({
+                        'text': clean, 'chunk_id': chunk_id,
+                        'model': model_id, 'is_final': False, 'language': language,
+                    })
+                except RuntimeError:
+                    cancel_event.set()
+                    return
+
+        worker = asyncio.create_task(inference_worker())
+        try:
+            while True:
+                data     = await websocket.receive_text()
+                message  = json.loads(data)
+                if not message.get('audio'):
+                    continue
+                if queue.full():
+                    # Inference is behind: drop the oldest chunk, keep results live
+                    queue.get_nowait()
+                    with stream_metrics_lock:
+                        stream_metrics['chunks_shed'] += 1
+                queue.put_nowait(message)
         except WebSocketDisconnect:
             print('📴 WebSocket client disconnected.')
+        finally:
+            cancel_event.set()
+            dropped = 0
+            while not queue.empty():
+                if queue.get_nowait() is not None:
+                    dropped += 1
+            queue.put_nowait(None)
+            with stream_metrics_lock:
+                stream_metrics['sessions_cancelled'] += 1
+                stream_metrics['chunks_dropped'] += dropped
+            await worker
+
+    # ── Local LLM Server ──────────────────────────────────────────────────────
+    # Runs the local Qwen model on one worker thread, off the event loop.
+    # Requests that arrive within LLM_BATCH_WINDOW_MS of each other and share a
+    # system prompt are generated as one batch, the system prompt's KV cache is
+    # computed once and reused, and text is streamed back per request. A job
+    # whose client disconnects is dropped from the queue, or stops its row of a
+    # running batch.
+    import time
+    import queue as queue_mod
+    from collections import OrderedDict
+    from transformers import DynamicCache
+    from transformers.generation.streamers import BaseStreamer
+
+    class LocalLLMJob:
+        def __init__(self, system, user, max_new_tokens, temperature, loop):
+            self.system, self.user = system, user
+            self.max_new_tokens, self.temperature = max_new_tokens, temperature
+            self.loop   = loop
+            self.deltas = asyncio.Queue()  # text deltas, then None (or an exception)
+            self.ids    = []
+            self.text   = ''
+            self.done   = False
+            self.cancelled = False  # set by the event loop when the client goes away
+
+        def emit(self, item):
+            self.loop.call_soon_threadsafe(self.deltas.put_nowait, item)
+
+    class BatchStreamer(BaseStreamer):
+        """Routes each row of a batched generate() to its job as decoded text deltas."""
+        def __init__(self, jobs, tokenizer, eos_ids):
+            self.jobs, self.tokenizer, self.eos_ids = jobs, tokenizer, eos_ids
+            self.prompt_seen = False
+
+        def put(self, value):
+            if not self.prompt_seen:  # generate() passes the prompt ids first
+                self.prompt_seen = True
+                return
+            for job, token in zip(self.jobs, value.reshape(len(self.jobs), -1)[:, -1].tolist()):
+                if job.done or job.cancelled:
+                    continue
+                if token in self.eos_ids:
+                    job.done = True
+                    continue
+                job.ids.append(token)
+                text = self.tokenizer.decode(job.ids, skip_special_tokens=True)
+                if not text.endswith('�'):  # Hold back incomplete UTF-8 sequences
+                    job.emit(text[len(job.text):])
+                    job.text = text
+                job.done = len(job.ids) >= job.max_new_tokens
+
+        def end(self):
+            for job in self.jobs:
+                job.done = True
+                job.emit(None)
+
+    class JobsFinished(StoppingCriteria):
+        """Finishes each row once its job is done or cancelled, so a batch of disconnected clients stops early."""
+        def __init__(self, jobs):
+            self.jobs = jobs
+
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.tensor([job.done or job.cancelled for job in self.jobs], dtype=torch.bool, device=input_ids.device)
+
+    class LocalLLMServer:
+        def __init__(self, max_batch, batch_window, prefix_entries=16):
+            self.max_batch    = max_batch
+            self.batch_window = batch_window
+            self.prefix_entries = prefix_entries
+            self.jobs   = queue_mod.Queue()
+            self.prefix_cache = OrderedDict()  # system prompt -> (prefix text, prefix ids, DynamicCache)
+            self.thread = None
+            self.batches = self.requests = self.prefix_hits = self.prefix_misses = self.cancelled = 0
+
+        async def stream(self, system, user, max_new_tokens=50, temperature=0.3):
+            """Yields the reply to one chat turn as text deltas."""
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name='local-llm')
+                self.thread.start()
+            job = LocalLLMJob(system, user, max_new_tokens, temperature, asyncio.get_running_loop())
+            self.jobs.put(job)
+            finished = False
+            try:
+                while True:
+                    delta = await job.deltas.get()
+                    if delta is None or isinstance(delta, Exception):
+                        finished = True
+                        if delta is None:
+                            return
+                        raise delta
+                    yield delta
+            finally:
+                # GeneratorExit / CancelledError on client disconnect: free the batch slot
+                if not finished:
+                    job.cancelled = True
+                    self.cancelled += 1
+
+        async def generate(self, system, user, max_new_tokens=50, temperature=0.3):
+            return ''.join([d async for d in self.stream(system, user, max_new_tokens, temperature)]).strip()
+
+        def stats(self):
+            return {
+                'requests': self.requests,
+                'batches': self.batches,
+                'avg_batch_size': round(self.requests / self.batches, 2) if self.batches else 0,
+                'prefix_cache_hits': self.prefix_hits,
+                'prefix_cache_misses': self.prefix_misses,
+                'cancelled': self.cancelled,
+            }
+
+        def _run(self):
+            while True:
+                jobs = [self.jobs.get()]
+                deadline = time.monotonic() + self.batch_window
+                while len(jobs) < self.max_batch:
+                    try:
+                        jobs.append(self.jobs.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue_mod.Empty:
+                        break
+                jobs = [job for job in jobs if not job.cancelled]
+                groups = {}
+                for job in jobs:
+                    groups.setdefault((job.system, job.temperature), []).append(job)
+                for group in groups.values():
+                    try:
+                        self._generate(group)
+                    except Exception as e:
+                        print(f'⚠️ [Local LLM] Batch of {len(group)} failed: {e}')
+                        for job in group:
+                            job.emit(e)
+
+        def _prefix(self, system):
+            entry = self.prefix_cache.get(system)
+            if entry is not None:
+                self.prefix_cache.move_to_end(system)
+                self.prefix_hits += 1
+                return entry
+            self.prefix_misses += 1
+            text = llm_tok.apply_chat_template([{'role': 'system', 'content': system}], tokenize=False)
+            ids  = llm_tok(text, return_tensors='pt', add_special_tokens=False).input_ids.to(DEVICE)
+            with torch.inference_mode():
+                cache = llm_model(ids, past_key_values=DynamicCache(), use_cache=True).past_key_values
+            entry = self.prefix_cache[system] = (text, ids, cache)
+            while len(self.prefix_cache) > self.prefix_entries:
+                self.prefix_cache.popitem(last=False)
+            return entry
+
+        def _generate(self, group):
+            prefix_text, prefix_ids, prefix_cache = self._prefix(group[0].system)
+            suffixes = []
+            for job in group:
+                full = llm_tok.apply_chat_template(
+                    [{'role': 'system', 'content': job.system}, {'role': 'user', 'content': job.user}],
+                    tokenize=False, add_generation_prompt=True
+                )
+                if not full.startswith(prefix_text):
+                    raise ValueError('chat template does not start with the system prompt prefix')
+                suffixes.append(full[len(prefix_text):])
+
+            # Layout per row: [shared prefix][left padding][user turn]. Padding is
+            # masked out and position ids come from the mask, so every row
+            # continues from the cached prefix.
+            batch  = len(group)
+            suffix = llm_tok(suffixes, return_tensors='pt', padding=True, add_special_tokens=False).to(DEVICE)
+            input_ids = torch.cat([prefix_ids.expand(batch, -1), suffix.input_ids], dim=1)
+            attention_mask = torch.cat([torch.ones_like(prefix_ids).expand(batch, -1), suffix.attention_mask], dim=1)
+            cache = DynamicCache.from_legacy_cache(tuple(
+                (k.expand(batch, -1, -1, -1).contiguous(), v.expand(batch, -1, -1, -1).contiguous())
+                for k, v in prefix_cache.to_legacy_cache()
+            ))
+            eos = llm_model.generation_config.eos_token_id
+            eos_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) | {llm_tok.eos_token_id}
+            eos_ids.discard(None)
+            temperature = group[0].temperature
+            self.batches += 1
+            self.requests += batch
+            with torch.inference_mode():
+                llm_model.generate(
+                    input_ids=input_ids, attention_mask=attention_mask, past_key_values=cache,
+                    max_new_tokens=max(job.max_new_tokens for job in group),
+                    do_sample=temperature > 0, temperature=temperature if temperature > 0 else None,
+                    pad_token_id=llm_tok.eos_token_id,
+                    streamer=BatchStreamer(group, llm_tok, eos_ids),
+                    stopping_criteria=StoppingCriteriaList([JobsFinished(group)]),
+                )
+
+    local_llm = LocalLLMServer(
+        max_batch=int(os.environ.get('LLM_MAX_BATCH', '8')),
+        batch_window=float(os.environ.get('LLM_BATCH_WINDOW_MS', '10')) / 1000,
+    )
+
+    from insight_routes import sse_event, sse_response
 
     # ── Intent Predictor (LLM) ────────────────────────────────────────────────
 
     class PredictRequest(BaseModel):
         text: str
         language: str = 'tw'
+        stream: bool = False
+
+    def intent_system_prompt(lang_name):
+        return (
+            f'You are a medical AI for a speech-impaired patient. '
+            f'Expand their fragmented {lang_name} speech into ONE complete, '
+            f'polite sentence in {lang_name}. Output ONLY the sentence.'
+        )
 
     @backend.post('/predict/intent')
     async def predict_intent(req: PredictRequest):
         if not LLM_ENABLED:
             return JSONResponse(status_code=501,
                 content={'error': 'LLM disabled — GPU not available.'})
-        load_llm()
+        await asyncio.to_thread(load_llm)
         lang_name = (
             'Akan/Twi' if req.language in ['tw', 'twi', 'akan']
             else 'Ga' if req.language == 'ga' else 'English'
         )
-        messages = [
-            {'role': 'system', 'content': (
-                f'You are a medical AI for a speech-impaired patient. '
-                f'Expand their fragmented {lang_name} speech into ONE complete, '
-                f'polite sentence in {lang_name}. Output ONLY the sentence.'
-            )},
-            {'role': 'user', 'content': req.text},
-        ]
-        text_in = llm_tok.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        inputs  = llm_tok(text_in, return_tensors='pt').to(DEVICE)
-        with torch.no_grad():
-            out = llm_model.generate(
-                **inputs, max_new_tokens=50, temperature=0.3,
-                do_sample=True, pad_token_id=llm_tok.eos_token_id
-            )
-        predicted = llm_tok.decode(
-            out[0][inputs.input_ids.shape[1]:], skip_special_tokens=True
-        ).strip()
+        system = intent_system_prompt(lang_name)
+        if req.stream:
+            async def events():
+                parts = []
+                async with aclosing(local_llm.stream(system, req.text, max_new_tokens=50, temperature=0.3)) as deltas:
+                    async for delta in deltas:
+                        parts.append(delta)
+                        yield sse_event({'token': delta})
+                yield sse_event({'predicted': ''.join(parts).strip(), 'language': req.language, 'done': True})
+            return sse_response(events())
+
+        predicted = await local_llm.generate(system, req.text, max_new_tokens=50, temperature=0.3)
         return {'predicted': predicted, 'language': req.language}
 
     # ── AI Diagnostics and Therapist Insights (LLM) ──────────────────────────
 
-    from typing import List, Optional, Dict, Any
+    from typing import List, Optional
+    from clinical_heuristics import clinical_matcher
+    from prompt_budget import PromptBudget
+    from llm_gateway import LLMGateway, InsightCache, InsightDeadlines
+    from insight_routes import (
+        SummaryRequest, SentimentRequest, RecommendationRequest, JournalAnalysisRequest, BulkInsightRequest,
+        sse_answer, stream_insight, summary_insight, no_journals_answer, journal_insight, bulk_response,
+    )
 
-    class SummaryRequest(BaseModel):
-        patient_name: str
-        transcripts: List[str]
-        compliance_rate: float
-        streak: int
-        hours_practiced: float
-        struggles: Optional[List[Dict[str, Any]]] = None
-        completed_assignments: Optional[List[Dict[str, Any]]] = None
+    # ── LLM Gateway ───────────────────────────────────────────────────────────
+    # Provider chain, insight cache, deadlines and streaming live in llm_gateway.py
 
-    class SentimentRequest(BaseModel):
-        transcripts: List[str]
-        mood_levels: List[int] = []
+    llm_gateway = LLMGateway()
+    insight_cache = InsightCache(int(os.environ.get('INSIGHT_CACHE_SIZE', '512')),
+                                 float(os.environ.get('INSIGHT_CACHE_TTL', '3600')))
+    insight_deadlines = InsightDeadlines(insight_cache, float(os.environ.get('INSIGHT_RESULT_TTL', '900')))
+    answer_within_deadline = insight_deadlines.answer
 
-    class RecommendationRequest(BaseModel):
-        patient_name: str
-        language: str
-        difficulty: str
+    @backend.on_event('shutdown')
+    async def close_llm_gateway():
+        await llm_gateway.close()
 
-    def query_hf_llm(prompt: str, max_tokens: int = 250, temperature: float = 0.3) -> str:
+    async def query_hf_llm(prompt: str, max_tokens: int = 250, temperature: float = 0.3) -> str:
         """Query LLM with Google Gemini as primary, HuggingFace as fallback."""
-        import os
+        return await llm_gateway.query(prompt, max_tokens, temperature)
 
-        # ── Layer 0: Try Google Gemini (best quality) ────────────────────────────
-        gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-        if gemini_key:
-            try:
-                import google.generativeai as genai
-                genai.configure(api_key=gemini_key)
-                # Try listing models to get the exact matching identifier for this key/region
-                model_to_use = 'gemini-1.5-flash'
-                try:
-                    available = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-                    if available:
-                        # Match case-insensitively for gemini-1.5-flash
-                        flash_models = [name for name in available if 'gemini-1.5-flash' in name.lower()]
-                        if flash_models:
-                            model_to_use = flash_models[0]
-                        else:
-                            # Fallback to any model containing 'gemini'
-                            any_gemini = [name for name in available if 'gemini' in name.lower()]
-                            if any_gemini:
-                                model_to_use = any_gemini[0]
-                except Exception as list_err:
-                    print(f"[AI Backend] ⚠️ Could not list Gemini models dynamically, using default name: {list_err}")
-
-                print(f"[AI Backend] Using GenerativeModel: {model_to_use}")
-                gemini_model = genai.GenerativeModel(model_to_use)
-                response = gemini_model.generate_content(
-                    prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=max_tokens,
-                        temperature=temperature,
-                    )
-                )
-                if response and response.text and response.text.strip():
-                    print(f"[AI Backend] ✅ Gemini ({model_to_use}) responded successfully")
-                    return response.text.strip()
-            except Exception as e:
-                print(f"[AI Backend] ⚠️ Gemini failed, falling back to HuggingFace: {e}")
+    @backend.get('/predict/llm/stats')
+    async def llm_stats():
+        """Per-provider latency, error and circuit-breaker state for the LLM chain, plus insight cache stats."""
+        return {**llm_gateway.stats(), 'insight_cache': insight_cache.stats(), 'local': local_llm.stats()}
 
-        # ── Layer 1: Fallback to Hugging Face Serverless API ─────────────────────
-        import urllib.request
-        import json
-        
-        token = os.environ.get("HF_TOKEN") or os.environ.get("HUGGINGFACE_CO_RESOLVE_PROVIDER") or os.environ.get("HF_API_KEY")
-        headers = {
-            "Content-Type": "application/json"
-        }
-        if token:
-            headers["Authorization"] = f"Bearer {token}"
-            
-        models = [
-            "Qwen/Qwen2.5-7B-Instruct",
-            "meta-llama/Llama-3.2-3B-Instruct"
-        ]
-        
-        for model_name in models:
-            # Try chat completions endpoint first
-            chat_url = f"https://api-inference.huggingface.co/models/{model_name}/v1/chat/completions"
-            chat_payload = {
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": max_tokens,
-                "temperature": temperature
-            }
-            try:
-                data_bytes = json.dumps(chat_payload).encode("utf-8")
-                req = urllib.request.Request(chat_url, data=data_bytes, headers=headers, method="POST")
-                with urllib.request.urlopen(req, timeout=10) as response:
-                    res_json = json.loads(response.read().decode("utf-8"))
-                    text = res_json.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-                    if text:
-                        return text
-            except Exception as e:
-                print(f"[AI Backend] Warning: chat request failed for {model_name} via urllib: {e}")
-
-            # Fall back to text generation endpoint
-            text_url = f"https://api-inference.huggingface.co/models/{model_name}"
-            text_payload = {
-                "inputs": prompt,
-                "parameters": {
-                    "max_new_tokens": max_tokens,
-                    "temperature": temperature,
-                    "return_full_text": False
-                }
-            }
-            try:
-                data_bytes = json.dumps(text_payload).encode("utf-8")
-                req = urllib.request.Request(text_url, data=data_bytes, headers=headers, method="POST")
-                with urllib.request.urlopen(req, timeout=10) as response:
-                    res_json = json.loads(response.read().decode("utf-8"))
-                    if isinstance(res_json, list) and len(res_json) > 0:
-                        text = res_json[0].get("generated_text", "").strip()
-                        if text:
-                            return text
-                    elif isinstance(res_json, dict):
-                        text = res_json.get("generated_text", "").strip()
-                        if text:
-                            return text
-            except Exception as e:
-                print(f"[AI Backend] Warning: text request failed for {model_name} via urllib: {e}")
-                
-        raise RuntimeError("All inference model APIs are unreachable or timed out.")
+    @backend.get('/predict/upgrade/{token}')
+    async def predict_upgrade(token: str, wait_ms: int = 0):
+        """LLM version of an insight that missed its deadline. wait_ms long-polls for up to 30 s."""
+        status, body = await insight_deadlines.upgrade(token, wait_ms)
+        return body if status == 200 else JSONResponse(status_code=status, content=body)
 
-    @backend.post('/predict/summary')
-    async def predict_summary(req: SummaryRequest):
-        transcripts_str = "\n".join([f'- "{t}"' for t in req.transcripts]) if req.transcripts else "No recent speech recordings."
-        
-        struggles_str = ""
-        if req.struggles:
-            struggles_str = "\n".join([
-                f'- {s.get("questTitle", "Exercise")}: {s.get("incorrectAttempts", s.get("attempts", 1))} mistake(s). Detail: {s.get("detail", "Incorrect attempt")}'
-                for s in req.struggles
-            ])
-        else:
-            struggles_str = "No recent struggles or mistakes logged."
-
-        assignments_str = ""
-        if req.completed_assignments:
-            assignments_str = "\n".join([
-                f'- {a.get("title")} (Category: {a.get("category")}, Completed: {a.get("completed")})' +
-                (f' Voice Response: "{a.get("voice_transcript")}"' if a.get("voice_transcript") else '')
-                for a in req.completed_assignments
-            ])
-        else:
-            assignments_str = "No recent completed assignments."
+    # ── Streaming insights ────────────────────────────────────────────────────
+    # SSE variants of the long-form insights, see insight_routes.stream_insight.
 
-        prompt = (
-            f"You are a clinical Speech-Language Pathologist (SLP) AI reviewer.\n"
-            f"Synthesize this progress status for patient '{req.patient_name}':\n"
-            f"- Speech Exercises Compliance Rate: {req.compliance_rate}%\n"
-            f"- Consecutive Practice Streak: {req.streak} days\n"
-            f"- Total Practiced Time: {req.hours_practiced} hours\n"
-            f"- Patient Voice Journals & Transcripts:\n{transcripts_str}\n"
-            f"- Recent Game Struggles / Mistakes (Words/Quests patient got wrong):\n{struggles_str}\n"
-            f"- Completed Daily Assignments (and spoken voice responses):\n{assignments_str}\n\n"
-            f"Write a concise, professional clinical progress summary for the therapist as 3 short, standard text paragraphs:\n"
-            f"1. PATIENT PERFORMANCE SUMMARY: Describe compliance, consistency, and progress.\n"
-            f"2. JOURNAL & SENTIMENT ANALYSIS: Reflect on what the patient said in their voice journals, their emotions, and clinical symptoms (like pain, fatigue, recovery signs).\n"
-            f"3. BRAINSTORMED THERAPIST IMPROVEMENT GUIDE: Give specific, actionable tips on what the therapist should do next to help the patient improve. Brainstorm ideas based on the exact words/quests they got wrong (e.g. phoneme drills for those words) and how they completed their assignments."
-            f"\n\nDo NOT use markdown bold, list bullets, hashes, or list markers. Return ONLY clean, readable plain text paragraphs."
-        )
-        
+    INSIGHT_SYSTEM_PROMPT = 'You are a clinical speech-language pathology assistant.'
+
+    async def insight_stream(prompt, max_tokens, temperature):
+        """(source, text delta) pairs from the hosted providers, falling back to the local Qwen model on GPU."""
+        started = False
         try:
-            # Run the blocking query in a separate thread to keep fastapi responsive
-            summary = await asyncio.to_thread(query_hf_llm, prompt, max_tokens=350, temperature=0.3)
-            # Strip any accidental markdown formatting the LLM might have returned
-            summary = re.sub(r'\*+', '', summary)
-            summary = re.sub(r'#+', '', summary)
-            summary = re.sub(r'^- ', '', summary, flags=re.MULTILINE)
-            return {'summary': summary.strip(), 'source': 'AI (HuggingFace Serverless LLM)'}
+            async for delta in llm_gateway.stream(prompt, max_tokens, temperature):
+                started = True
+                yield 'AI (HuggingFace Serverless LLM)', delta
+            return
         except Exception as e:
-            print(f"[AI Backend] Fallback triggered for Summary: {e}")
-            
-            # 1. Dynamic compliance evaluation
-            paragraph1 = f"Clinical review for patient {req.patient_name} shows a current exercise compliance rate of {req.compliance_rate}%. "
-            if req.compliance_rate == 0:
-                paragraph1 += f"At this stage, {req.patient_name} has not registered any recent completed exercises in the database, meaning they require immediate therapist outreach to establish engagement, check device accessibility, and identify early barriers."
-            elif req.compliance_rate < 50:
-                paragraph1 += f"Engagement is currently low, showing that {req.patient_name} is completing less than half of their assigned drills. More frequent follow-ups, caregiver reinforcement, or adjusting the goal target down to shorter daily intervals is recommended to build confidence."
-            elif req.compliance_rate < 80:
-                paragraph1 += f"The patient shows moderate participation. While some sessions are missed, there is a steady baseline of practice. Encouraging a fixed daily time for speech drills could help bridge the remaining compliance gap."
-            else:
-                paragraph1 += f"This represents excellent commitment, indicating that {req.patient_name} is consistently keeping up with daily rehabilitation requirements, which establishes the necessary vocal repetitions for motor-speech neural recovery."
-
-            # 2. Dynamic habit & acoustic evaluation
-            paragraph2 = ""
-            if req.streak > 0:
-                paragraph2 += f"Consistency is supported by a continuous {req.streak}-day streak, indicating strong habit building. "
-            else:
-                paragraph2 += f"No active consecutive streak is currently logged, suggesting that practice sessions are sparse or unscheduled. "
-
-            if req.hours_practiced > 0:
-                paragraph2 += f"Across these sessions, {req.patient_name} has accumulated {req.hours_practiced} hours of voice activity. "
-
-            twi_count = sum(1 for t in req.transcripts if any(w in t.lower() for w in ['nsuo', 'kasa', 'paa', 'twi', 'ɛyɛ', 'mami', 'dodo', 'yare', 'medaase', 'mepɛ', 'pa', 'pe', 'pi', 'po', 'pu', 'firi', 'sɔre', 'sua', 'kofi', 'kosoko']))
-            pain_count = sum(1 for t in req.transcripts if any(w in t.lower() for w in ['pain', 'hurt', 'sad', 'bad', 'tired', 'cry', 'help', 'emergency', 'stop', 'difficult', 'stuck', 'ɛyaw', 'yare']))
-
-            if req.transcripts:
-                recent_quotes = ", ".join([f'"{t}"' for t in req.transcripts[:2]])
-                paragraph2 += f"Review of recent acoustic output (such as {recent_quotes}) "
-                if twi_count > 0:
-                    paragraph2 += "shows prominent usage of Akan Twi dialect, confirming the speech classifier is correctly parsing localized phonology and dialect-specific sound targets. "
-                else:
-                    paragraph2 += "indicates primarily English speech exercises. "
-                    
-                if pain_count > 0:
-                    paragraph2 += f"Of clinical note, several transcript entries contain indicators of frustration, pain, or struggle, signaling that physical or vocal fatigue may be present during training."
-            else:
-                paragraph2 += f"Acoustic logs are currently empty, so active vocal characteristics and speech clarity cannot be evaluated."
-
-            # 3. Dynamic therapist recommendations (Brainstormed therapist improvement guide)
-            paragraph3 = f"Therapist Guidance & Brainstormed Tips: "
-            
-            # Inject struggle feedback if present
-            if req.struggles and len(req.struggles) > 0:
-                wrong_items = [s.get("questTitle", "drills") for s in req.struggles[:2]]
-                paragraph3 += f"Based on recent session errors, the patient is experiencing coordination blocks on {', '.join(wrong_items)}. We brainstormed that the therapist should introduce slow tactile placement drills or syllable segmentation to bypass these specific phonetic traps. "
-            else:
-                paragraph3 += f"No specific exercise struggles were logged, showing that phonetic placement is stable. "
+            if started or not LLM_ENABLED:
+                raise
+            print(f"[AI Backend] Hosted LLMs unavailable, streaming from local Qwen: {e}")
+        await asyncio.to_thread(load_llm)
+        async with aclosing(local_llm.stream(INSIGHT_SYSTEM_PROMPT, prompt, max_tokens, temperature)) as deltas:
+            async for delta in deltas:
+                yield 'AI (Local Qwen2.5 LLM)', delta
 
-            # Inject assignment feedback if present
-            if req.completed_assignments and len(req.completed_assignments) > 0:
-                comp_list = [a.get("title") for a in req.completed_assignments if a.get("completed")]
-                if comp_list:
-                    paragraph3 += f"The patient successfully completed their assigned missions: {', '.join(comp_list[:2])}. If these required voice recordings, their response shows sufficient phonation duration, and the therapist can now advance them to multi-syllable phrases."
-                else:
-                    paragraph3 += "Recent assignments are currently pending completion. Therapist should check if the patient finds the instructions too complex."
-            else:
-                paragraph3 += "No clinical assignments were recently completed. Suggest assigning low-demand vocal play exercises to re-engage."
+    @backend.post('/predict/summary')
+    async def predict_summary(req: SummaryRequest):
+        _, _, llm_answer, heuristic_answer = summary_insight(req, query_hf_llm)
+        return await answer_within_deadline('Summary', llm_answer, heuristic_answer, req.deadline_ms,
+                                            insight_cache.key('Summary', req, 0.3))
 
-            summary_text = f"{paragraph1}\n\n{paragraph2}\n\n{paragraph3}"
-            return {'summary': summary_text, 'source': 'Deterministic Clinical Heuristic Analyzer'}
+    @backend.post('/predict/summary/stream')
+    async def predict_summary_stream(req: SummaryRequest):
+        prompt, budget, _, heuristic_answer = summary_insight(req, query_hf_llm)
+        return stream_insight('Summary', 'summary', insight_stream(prompt, 350, 0.3), budget, heuristic_answer,
+                              insight_cache, insight_cache.key('Summary', req, 0.3))
 
     @backend.post('/predict/sentiment')
     async def predict_sentiment(req: SentimentRequest):
@@ -537,7 +658,8 @@ def fastapi_app():
             }
             
         mood_str = f"Recent daily self-reported moods (1=Very Sad, 2=Sad, 3=Okay, 4=Good, 5=Very Happy): {req.mood_levels}" if req.mood_levels else "No self-reported daily moods logged today."
-        transcripts_str = "\n".join([f'- "{t}"' for t in req.transcripts])
+        budget = PromptBudget('Sentiment')
+        transcripts_str = "\n".join([f'- "{t}"' for t in budget.fit('transcripts', req.transcripts)])
         prompt = (
             f"Analyze the emotional state of a speech-impaired patient.\n"
             f"Their daily self-reported mood levels from the app check-in are:\n{mood_str}\n\n"
@@ -550,16 +672,15 @@ def fastapi_app():
             f"Output ONLY the raw JSON string. Do not wrap in markdown ```json."
         )
         
-        try:
-            res = await asyncio.to_thread(query_hf_llm, prompt, max_tokens=150, temperature=0.1)
+        async def llm_answer():
+            res = await query_hf_llm(prompt, max_tokens=150, temperature=0.1)
             data = json.loads(res)
             data['source'] = 'AI (HuggingFace Serverless LLM)'
+            data['prompt_budget'] = budget.report()
             return data
-        except Exception as e:
-            print(f"[AI Backend] Fallback triggered for Sentiment: {e}")
-            frustrated_keywords = ['pain', 'hurt', 'sad', 'bad', 'tired', 'cry', 'help', 'emergency', 'stop', 'difficult', 'stuck', 'ɛyaw', 'yare']
-            happy_keywords = ['happy', 'good', 'fine', 'great', 'thank', 'love', 'nice', 'ɛyɛ', 'paa', 'medaase']
-            anxious_keywords = ['worry', 'scared', 'afraid', 'heart', 'doctor', 'hospital', 'priority', 'nsuro', 'emergency']
+
+        def heuristic_answer():
+            scan = clinical_matcher.scan(req.transcripts)
             
             frustrated_score = 0
             happy_score = 0
@@ -577,19 +698,14 @@ def fastapi_app():
                     neutral_score += 3
             
             # Incorporate transcripts
-            for t in req.transcripts:
-                t_lower = t.lower()
-                matched = False
-                if any(w in t_lower for w in frustrated_keywords):
+            for hit in scan.per_text:
+                if 'distress' in hit:
                     frustrated_score += 4
-                    matched = True
-                if any(w in t_lower for w in happy_keywords):
+                if 'happy' in hit:
                     happy_score += 4
-                    matched = True
-                if any(w in t_lower for w in anxious_keywords):
+                if 'anxious' in hit:
                     anxious_score += 4
-                    matched = True
-                if not matched:
+                if not hit & {'distress', 'happy', 'anxious'}:
                     neutral_score += 1
                     
             total = frustrated_score + happy_score + anxious_score + neutral_score
@@ -611,7 +727,7 @@ def fastapi_app():
             reasoning = "Analyzed check-in mood and speech logs: "
             if has_low_mood:
                 reasoning += f"Patient checked in with low mood ({req.mood_levels[0]}/5 today). "
-                matched_struggles = [w for w in frustrated_keywords if any(w in t.lower() for t in req.transcripts)]
+                matched_struggles = scan.matched('distress')
                 if matched_struggles:
                     label_str = ", ".join(matched_struggles[:2])
                     reasoning += f"This correlates with exercise text mentioning '{label_str}', indicating physical discomfort or practice frustration."
@@ -619,7 +735,7 @@ def fastapi_app():
                     reasoning += "Lack of positive verbal expressions during exercises indicates general disengagement or fatigue."
             elif has_high_mood:
                 reasoning += f"Patient checked in with a positive mood ({req.mood_levels[0]}/5 today). "
-                matched_happy = [w for w in happy_keywords if any(w in t.lower() for t in req.transcripts)]
+                matched_happy = scan.matched('happy')
                 if matched_happy:
                     reasoning += f"Acoustic output confirms high engagement with optimistic words like '{matched_happy[0]}'."
                 else:
@@ -643,6 +759,9 @@ def fastapi_app():
                 'source': 'Heuristic Check-In & Speech Correlation Engine'
             }
 
+        return await answer_within_deadline('Sentiment', llm_answer, heuristic_answer, req.deadline_ms,
+                                            insight_cache.key('Sentiment', req, 0.1))
+
     @backend.post('/predict/recommendations')
     async def predict_recommendations(req: RecommendationRequest):
         prompt = (
@@ -657,12 +776,12 @@ def fastapi_app():
             f"Return ONLY the raw JSON string. Do not wrap in markdown ```json."
         )
         
-        try:
-            res = await asyncio.to_thread(query_hf_llm, prompt, max_tokens=250, temperature=0.2)
+        async def llm_answer():
+            res = await query_hf_llm(prompt, max_tokens=250, temperature=0.2)
             recs = json.loads(res)
             return {'recommendations': recs, 'source': 'AI (HuggingFace Serverless LLM)'}
-        except Exception as e:
-            print(f"[AI Backend] Fallback triggered for Recommendations: {e}")
+
+        def heuristic_answer():
             lang = req.language.lower()
             diff = req.difficulty.lower()
             
@@ -707,115 +826,447 @@ def fastapi_app():
                     
             return {'recommendations': recs, 'source': 'Speech Pathology Heuristic Recommendation Engine'}
 
-    class JournalAnalysisRequest(BaseModel):
-        patient_name: str
-        journals: List[str]
+        return await answer_within_deadline('Recommendations', llm_answer, heuristic_answer, req.deadline_ms,
+                                            insight_cache.key('Recommendations', req, 0.2))
 
     @backend.post('/predict/journal_analysis')
     async def predict_journal_analysis(req: JournalAnalysisRequest):
         if not req.journals:
-            return {
-                'analysis': "No voice journal entries found to analyze. Advise the patient to record their first journal entry to start receiving clinical insights.",
-                'source': 'Deterministic Heuristic Engine'
-            }
-            
-        journals_str = "\n".join([f'- "{j}"' for j in req.journals])
-        prompt = (
-            f"You are a clinical speech-language pathologist and rehabilitation AI.\n"
-            f"Analyze these recent voice journal transcripts recorded by patient '{req.patient_name}':\n"
-            f"{journals_str}\n\n"
-            f"Write a clinical analysis of their journal entries in 3 short, professional paragraphs:\n"
-            f"Paragraph 1: SPOKEN THEMES & COGNITIVE OUTLOOK. Describe what the patient is talking about (daily routines, concerns, pain, recovery progress) and what their language reveals about their mental state, mood, and cognitive clarity.\n"
-            f"Paragraph 2: CLINICAL REHABILITATION TIPS. Recommend specific breathing, voice, or articulation exercises (e.g., easy-onset phonation, pacing control, diaphragmatic breathing) based on the fatigue or discomfort mentioned.\n"
-            f"Paragraph 3: CAREGIVER COORDINATION GUIDANCE. Give practical suggestions on how the family or caregiver can support the patient in their home environment based on what they expressed."
-            f"\n\nDo NOT use markdown bold, list bullets, hashes, or list markers. Return ONLY clean, readable plain text paragraphs."
-        )
-        
-        try:
-            analysis = await asyncio.to_thread(query_hf_llm, prompt, max_tokens=350, temperature=0.3)
-            analysis = re.sub(r'\*+', '', analysis)
-            analysis = re.sub(r'#+', '', analysis)
-            analysis = re.sub(r'^- ', '', analysis, flags=re.MULTILINE)
-            return {'analysis': analysis.strip(), 'source': 'AI (HuggingFace Serverless LLM)'}
-        except Exception as e:
-            print(f"[AI Backend] Fallback triggered for Journal Analysis: {e}")
-            
-            # Heuristic fallback based on journal content
-            pain_words = ['pain', 'hurt', 'sad', 'bad', 'tired', 'cry', 'help', 'emergency', 'stop', 'difficult', 'stuck', 'ɛyaw', 'yare']
-            twi_words = ['nsuo', 'kasa', 'paa', 'twi', 'ɛyɛ', 'mami', 'dodo', 'yare', 'medaase', 'mepɛ', 'pa']
-            
-            has_pain = any(any(w in j.lower() for w in pain_words) for j in req.journals)
-            has_twi = any(any(w in j.lower() for w in twi_words) for j in req.journals)
-            
-            paragraph1 = f"Spoken Themes & Cognitive Outlook: Analysis of {len(req.journals)} voice journal recordings indicates that {req.patient_name} is actively using their voice board. "
-            if has_pain:
-                paragraph1 += "The transcripts express feelings of fatigue, pain, or difficulty with current communication targets. This suggests increased cognitive load or physical discomfort during daily rehabilitation activities."
-            else:
-                paragraph1 += "The verbal logs show a stable emotional baseline. Topics relate to standard daily activities, indicating steady cognitive clarity and willingness to communicate."
-                
-            paragraph2 = "Clinical Rehabilitation Tips: "
-            if has_pain:
-                paragraph2 += "We recommend introducing gentle vocal play and diaphragmatic breath support exercises (such as sustained vowel phonations). Advise the patient to take frequent rest breaks and avoid straining when articulation blocks occur."
-            else:
-                paragraph2 += "Continue progress with current articulation templates. Introduce conversational short-phrase cards to transition the patient from single words to natural pacing."
-                
-            paragraph3 = "Caregiver Coordination Guidance: "
-            if has_twi:
-                paragraph3 += "Caregivers should encourage communication in the patient's preferred Akan Twi dialect. Practice daily check-ins in a quiet room to reduce environmental noise and auditory fatigue."
-            else:
-                paragraph3 += "Ensure the patient feels supported during communication attempts. Allow ample time (10-15 seconds) for them to formulate responses before repeating prompts."
-                
-            analysis_text = f"{paragraph1}\n\n{paragraph2}\n\n{paragraph3}"
-            return {'analysis': analysis_text, 'source': 'Deterministic Clinical Heuristic Analyzer'}
+            return no_journals_answer()
+        _, _, llm_answer, heuristic_answer = journal_insight(req, query_hf_llm)
+        return await answer_within_deadline('Journal Analysis', llm_answer, heuristic_answer, req.deadline_ms,
+                                            insight_cache.key('Journal Analysis', req, 0.3))
+
+    @backend.post('/predict/journal_analysis/stream')
+    async def predict_journal_analysis_stream(req: JournalAnalysisRequest):
+        if not req.journals:
+            return sse_answer(no_journals_answer())
+        prompt, budget, _, heuristic_answer = journal_insight(req, query_hf_llm)
+        return stream_insight('Journal Analysis', 'analysis', insight_stream(prompt, 350, 0.3), budget, heuristic_answer,
+                              insight_cache, insight_cache.key('Journal Analysis', req, 0.3))
+
+    # ── Bulk Insights ─────────────────────────────────────────────────────────
+    # A therapist's whole caseload in one request, see insight_routes.bulk_response.
+
+    @backend.post('/predict/bulk')
+    async def predict_bulk(req: BulkInsightRequest):
+        return bulk_response(req, {'summary': predict_summary, 'sentiment': predict_sentiment})
 
     # ── TTS Route ─────────────────────────────────────────────────────────────
 
     class TTSRequest(BaseModel):
         text: str
         language: str = 'tw'
+        stream: bool = False
+        format: Optional[str] = None
+        speed: float = 1.0
+        voice: str = 'default'
 
-    @backend.post('/tts/synthesize')
-    async def synthesize_post(req: TTSRequest):
-        if req.language in ['ga', 'gaa']:
-            lang_id = 'ga'
-        elif req.language in ['tw', 'twi', 'akan']:
-            lang_id = 'tw'
-        else:
-            lang_id = 'eng'
+    def tts_lang_id(language):
+        if language in ['ga', 'gaa']:
+            return 'ga'
+        if language in ['tw', 'twi', 'akan']:
+            return 'tw'
+        return 'eng'
+
+    TTS_MODEL_IDS = {'tw': 'facebook/mms-tts-aka', 'ga': 'facebook/mms-tts-gaa', 'eng': 'facebook/mms-tts-eng'}
+
+    # ── TTS Cache (memory LRU + size-capped disk tier) ────────────────────────
+    # Keyed by normalized text, language, model id and output format; the key
+    # doubles as the ETag so phones can revalidate with If-None-Match.
+    import hashlib, unicodedata
+
+    TTS_CACHE_DIR       = os.environ.get('TTS_CACHE_DIR', '/tmp/voiceaid_tts_cache')
+    TTS_CACHE_MEM_BYTES = int(os.environ.get('TTS_CACHE_MEMORY_MB', '64')) * 1024 * 1024
+    TTS_CACHE_DISK_BYTES = int(os.environ.get('TTS_CACHE_DISK_MB', '512')) * 1024 * 1024
+    tts_cache       = OrderedDict()
+    tts_cache_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'memory_bytes': 0, 'disk_bytes': None}
+    tts_cache_lock  = threading.Lock()
+
+    def tts_cache_key(text, lang_id, fmt='wav', variant=''):
+        norm = ' '.join(unicodedata.normalize('NFC', text or '').lower().split())
+        material = '\x1f'.join([norm, lang_id, TTS_MODEL_IDS[lang_id], fmt] + ([variant] if variant else []))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def tts_cache_remember(key, audio):
+        with tts_cache_lock:
+            if key in tts_cache:
+                return
+            tts_cache[key] = audio
+            tts_cache_stats['memory_bytes'] += len(audio)
+            while tts_cache_stats['memory_bytes'] > TTS_CACHE_MEM_BYTES and tts_cache:
+                _, evicted = tts_cache.popitem(last=False)
+                tts_cache_stats['memory_bytes'] -= len(evicted)
+
+    def tts_cache_get(key):
+        with tts_cache_lock:
+            if key in tts_cache:
+                tts_cache.move_to_end(key)
+                tts_cache_stats['hits'] += 1
+                return tts_cache[key]
+        path = os.path.join(TTS_CACHE_DIR, f'{key}.bin')
+        try:
+            with open(path, 'rb') as f:
+                audio = f.read()
+            os.utime(path, None)
+        except OSError:
+            with tts_cache_lock:
+                tts_cache_stats['misses'] += 1
+            return None
+        with tts_cache_lock:
+            tts_cache_stats['disk_hits'] += 1
+        tts_cache_remember(key, audio)
+        return audio
+
+    def tts_cache_put(key, audio):
+        tts_cache_remember(key, audio)
+        if len(audio) > TTS_CACHE_DISK_BYTES:
+            return
+        try:
+            os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+            path = os.path.join(TTS_CACHE_DIR, f'{key}.bin')
+            # Per-writer temp file: concurrent puts of one key must not share it
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(audio)
+            existed = os.path.exists(path)
+            os.replace(tmp_path, path)
+            with tts_cache_lock:
+                # Size is scanned once, then tracked per write
+                if tts_cache_stats['disk_bytes'] is None:
+                    tts_cache_stats['disk_bytes'] = sum(
+                        e.stat().st_size for e in os.scandir(TTS_CACHE_DIR) if e.name.endswith('.bin'))
+                elif not existed:
+                    tts_cache_stats['disk_bytes'] += len(audio)
+                if tts_cache_stats['disk_bytes'] > TTS_CACHE_DISK_BYTES:
+                    tts_cache_evict_disk()
+        except OSError as e:
+            print(f'⚠️ [TTS Cache] Disk write failed: {e}')
+
+    def tts_cache_evict_disk():
+        """Deletes least recently used files until the disk tier fits; call with tts_cache_lock held."""
+        entries = sorted(
+            (e for e in os.scandir(TTS_CACHE_DIR) if e.name.endswith('.bin')),
+            key=lambda e: e.stat().st_mtime,
+        )
+        for e in entries:
+            if tts_cache_stats['disk_bytes'] <= TTS_CACHE_DISK_BYTES:
+                break
+            try:
+                size = e.stat().st_size
+                os.unlink(e.path)
+                tts_cache_stats['disk_bytes'] -= size
+            except OSError:
+                pass
+
+    # ── Phrase Packs (pre-rendered, memory-mapped) ────────────────────────────
+    # <lang_id>.pack files built by backend/scripts/build_phrase_pack.py share the
+    # TTS cache key, so hits are served from the mapping without loading VITS.
+    # Mount them (e.g. from a Modal Volume) at TTS_PHRASE_PACK_DIR.
+    import mmap, struct
+
+    PHRASE_PACK_DIR = os.environ.get('TTS_PHRASE_PACK_DIR', '/root/phrase_packs')
+    phrase_packs = {}
+    if os.path.isdir(PHRASE_PACK_DIR):
+        for name in sorted(os.listdir(PHRASE_PACK_DIR)):
+            if not name.endswith('.pack'):
+                continue
+            try:
+                with open(os.path.join(PHRASE_PACK_DIR, name), 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, count = struct.unpack_from('<4sHI', mm, 0)
+                if magic != b'VAPP' or version != 1 or len(mm) < 10 + count * 44:
+                    mm.close()
+                    raise ValueError('not a complete version 1 phrase pack')
+            except (OSError, ValueError, struct.error) as e:
+                # Empty or truncated packs must not take the container down
+                print(f'⚠️ Skipping phrase pack {name}: {e}')
+                continue
+            phrase_packs[name[:-5]] = (mm, count)
+            print(f'📦 Mapped phrase pack {name} ({count} phrases)')
+
+    def phrase_pack_get(lang_id, key):
+        if lang_id not in phrase_packs:
+            return None
+        mm, count = phrase_packs[lang_id]
+        digest, lo, hi = bytes.fromhex(key), 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = 10 + mid * 44
+            probe = mm[pos:pos + 32]
+            if probe < digest:
+                lo = mid + 1
+            elif probe > digest:
+                hi = mid
+            else:
+                offset, length = struct.unpack_from('<QI', mm, pos + 32)
+                start = 10 + count * 44 + offset
+                return mm[start:start + length]
+        return None
+
+    # ── Speed & Voice ─────────────────────────────────────────────────────────
+    # Speed goes through the VITS speaking rate; pitch is shifted by polyphase
+    # resampling, with the speaking rate pre-slowed by the same ratio so the
+    # duration is unchanged. Replaces the librosa phase vocoder used by the
+    # notebook backends, which cost more than synthesis itself.
+    from fractions import Fraction
+    from scipy.signal import resample_poly
+
+    VOICE_PITCH_SEMITONES = {'default': 0.0, 'male': 0.0, 'female': 3.5, 'deep': -2.0}
+    # speaking_rate is set on the shared model for each call, so generation is
+    # serialized per model; other languages render in parallel
+    tts_generate_locks = {}
+    tts_generate_locks_guard = threading.Lock()
+
+    def tts_generate_lock(model):
+        with tts_generate_locks_guard:
+            return tts_generate_locks.setdefault(id(model), threading.Lock())
+
+    def voice_variant(speed, voice):
+        if speed == 1.0 and VOICE_PITCH_SEMITONES.get(voice, 0.0) == 0.0:
+            return ''
+        return f'speed={speed:.2f};voice={voice}'
+
+    def render_pcm(text, lang_id, speed=1.0, voice='default'):
         model, tokenizer = load_tts(lang_id)
-        inputs = tokenizer(req.text, return_tensors='pt')
+        speed = min(max(speed, 0.5), 2.0)
+        ratio = 2.0 ** (VOICE_PITCH_SEMITONES.get(voice, 0.0) / 12.0)
+        inputs = tokenizer(text, return_tensors='pt')
         inputs = {k: (v.to(DEVICE).long() if k in ['input_ids', 'attention_mask'] else v.to(DEVICE)) for k, v in inputs.items()}
-        with torch.no_grad():
-            output = model(**inputs).waveform
+        with tts_generate_lock(model):
+            default_rate = model.speaking_rate
+            model.speaking_rate = speed / ratio
+            try:
+                with torch.inference_mode():
+                    output = model(**inputs).waveform
+            finally:
+                model.speaking_rate = default_rate
         audio_np = output.squeeze().cpu().numpy()
-        sr       = model.config.sampling_rate
+        if ratio != 1.0:
+            frac = Fraction(ratio).limit_denominator(64)
+            audio_np = resample_poly(audio_np, frac.denominator, frac.numerator)
+        return (np.clip(audio_np, -1.0, 1.0) * 32767.0).astype(np.int16), model.config.sampling_rate
+
+    def render_tts(text, lang_id, speed=1.0, voice='default'):
+        audio_np, sr = render_pcm(text, lang_id, speed, voice)
         audio_np = np.pad(audio_np, (0, int(0.5 * sr)), mode='constant')
-        audio_np = (audio_np * 32767.0).astype(np.int16)
         audio_io = io.BytesIO()
         scipy.io.wavfile.write(audio_io, sr, audio_np)
-        audio_io.seek(0)
-        return StreamingResponse(audio_io, media_type='audio/wav')
+        return audio_io.getvalue()
+
+    # ── Streaming TTS ─────────────────────────────────────────────────────────
+    # Sentence/clause-level synthesis streamed behind an open-ended WAV header.
+    # The first clause is rendered alone so time-to-first-audio stays short.
+    def split_tts_segments(text, max_chars=120):
+        segments = []
+        for sentence in re.split(r'(?<=[.!?])\s+', text.strip()):
+            current = ''
+            for clause in re.split(r'(?<=[,;:])\s+', sentence):
+                clause = clause.strip()
+                if not clause:
+                    continue
+                if not segments and not current:
+                    segments.append(clause)
+                elif current and len(current) + len(clause) + 1 > max_chars:
+                    segments.append(current)
+                    current = clause
+                else:
+                    current = f'{current} {clause}' if current else clause
+            if current:
+                segments.append(current)
+        return segments
+
+    def wav_stream_header(sr):
+        return (
+            b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, sr, sr * 2, 2, 16)
+            + b'data' + struct.pack('<I', 0xFFFFFFFF - 36)
+        )
+
+    def stream_tts_response(text, language, speed=1.0, voice='default'):
+        lang_id  = tts_lang_id(language)
+        segments = split_tts_segments(text)
+
+        async def audio_stream():
+            start = time.time()
+            for i, segment in enumerate(segments):
+                audio_np, sr = await asyncio.to_thread(render_pcm, segment, lang_id, speed, voice)
+                if i == 0:
+                    yield wav_stream_header(sr)
+                    print(f'[TTS] ⏱️ First audio in {time.time() - start:.3f}s ({len(segments)} segments)')
+                pause = int(0.15 * sr) if segment[-1] in '.!?' else 0
+                if i == len(segments) - 1:
+                    pause = int(0.5 * sr)  # same phone-truncation padding as the full WAV
+                yield np.pad(audio_np, (0, pause), mode='constant').astype('<i2').tobytes()
+
+        return StreamingResponse(audio_stream(), media_type='audio/wav')
+
+    # ── Output Format Negotiation ─────────────────────────────────────────────
+    # Opus/MP3/FLAC are encoded in-process by libsndfile; the encoders linked
+    # into this container are probed once at startup. The padded silence costs
+    # almost nothing once compressed.
+    import soundfile as sf
+
+    TTS_FORMATS = {
+        'wav':  ('WAV', 'PCM_16', 'audio/wav'),
+        'flac': ('FLAC', 'PCM_16', 'audio/flac'),
+        'opus': ('OGG', 'OPUS', 'audio/ogg; codecs=opus'),
+        'mp3':  ('MP3', 'MPEG_LAYER_III', 'audio/mpeg'),
+    }
+    TTS_MEDIA_TYPES = {
+        'audio/wav': 'wav', 'audio/x-wav': 'wav', 'audio/wave': 'wav',
+        'audio/flac': 'flac', 'audio/x-flac': 'flac',
+        'audio/ogg': 'opus', 'audio/opus': 'opus',
+        'audio/mpeg': 'mp3', 'audio/mp3': 'mp3',
+    }
+    _sf_formats = sf.available_formats()
+    TTS_AVAILABLE_FORMATS = {
+        name for name, (container, subtype, _) in TTS_FORMATS.items()
+        if container in _sf_formats and subtype in sf.available_subtypes(container)
+    } | {'wav'}
+    print(f'🎧 TTS output formats: {sorted(TTS_AVAILABLE_FORMATS)}')
+
+    def negotiate_tts_format(accept, requested):
+        if requested and requested.lower() in TTS_AVAILABLE_FORMATS:
+            return requested.lower()
+        best, best_q = 'wav', 0.0
+        for part in (accept or '').split(','):
+            fields = [f.strip() for f in part.split(';')]
+            q = next((float(p[2:]) for p in fields[1:] if p.startswith('q=') and p[2:].replace('.', '', 1).isdigit()), 1.0)
+            fmt = TTS_MEDIA_TYPES.get(fields[0].lower())
+            if fmt in TTS_AVAILABLE_FORMATS and q > best_q:
+                best, best_q = fmt, q
+        return best
+
+    def encode_tts(wav_bytes, fmt):
+        if fmt == 'wav':
+            return wav_bytes
+        sr, audio_np = scipy.io.wavfile.read(io.BytesIO(wav_bytes))
+        container, subtype, _ = TTS_FORMATS[fmt]
+        out = io.BytesIO()
+        sf.write(out, audio_np, sr, format=container, subtype=subtype)
+        return out.getvalue()
+
+    def tts_response(text, language, if_none_match, fmt='wav', speed=1.0, voice='default'):
+        if not 0.5 <= speed <= 2.0 or voice not in VOICE_PITCH_SEMITONES:
+            return JSONResponse(status_code=400, content={
+                'error': f'speed must be 0.5-2.0 and voice one of {list(VOICE_PITCH_SEMITONES)}'})
+        lang_id = tts_lang_id(language)
+        variant = voice_variant(speed, voice)
+        key     = tts_cache_key(text, lang_id, fmt, variant)
+        headers = {'ETag': f'"{key}"', 'Cache-Control': 'public, max-age=86400', 'Vary': 'Accept'}
+        if if_none_match and headers['ETag'] in [t.strip() for t in if_none_match.split(',')]:
+            return Response(status_code=304, headers=headers)
+        audio = tts_cache_get(key)
+        if audio is None:
+            wav_key = tts_cache_key(text, lang_id, 'wav', variant)
+            wav = (phrase_pack_get(lang_id, wav_key) if not variant else None) or \
+                  (tts_cache_get(wav_key) if fmt != 'wav' else None)
+            if wav is None:
+                wav = render_tts(text, lang_id, speed, voice)
+            # The cache holds the encoded bytes for each format
+            audio = encode_tts(wav, fmt)
+            tts_cache_put(key, audio)
+        # Cached bytes are handed to the response as-is, without copying
+        return Response(content=audio, media_type=TTS_FORMATS[fmt][2], headers=headers)
+
+    @backend.post('/tts/synthesize')
+    async def synthesize_post(req: TTSRequest, accept: Optional[str] = Header(None),
+                              if_none_match: Optional[str] = Header(None)):
+        if req.stream:
+            return stream_tts_response(req.text, req.language, req.speed, req.voice)
+        # Rendering, encoding and cache I/O block, so they run off the event loop
+        return await asyncio.to_thread(tts_response, req.text, req.language, if_none_match,
+                                       negotiate_tts_format(accept, req.format), req.speed, req.voice)
 
     @backend.get('/tts/synthesize')
-    async def synthesize_get(text: str = '', language: str = 'tw'):
-        if language in ['ga', 'gaa']:
-            lang_id = 'ga'
-        elif language in ['tw', 'twi', 'akan']:
-            lang_id = 'tw'
-        else:
-            lang_id = 'eng'
+    async def synthesize_get(text: str = '', language: str = 'tw', stream: bool = False, format: Optional[str] = None,
+                             speed: float = 1.0, voice: str = 'default',
+                             accept: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)):
+        if stream:
+            return stream_tts_response(text, language, speed, voice)
+        return await asyncio.to_thread(tts_response, text, language, if_none_match,
+                                       negotiate_tts_format(accept, format), speed, voice)
+
+    # ── Batched TTS (phrase-board preloading) ─────────────────────────────────
+
+    class TTSBatchItem(BaseModel):
+        text: str
+        language: str = 'tw'
+
+    class TTSBatchRequest(BaseModel):
+        items: List[TTSBatchItem]
+
+    def render_tts_batch(texts, lang_id, batch_size=8):
+        """Padded VITS passes over same-language phrases; waveforms trimmed to sequence_lengths."""
         model, tokenizer = load_tts(lang_id)
-        inputs = tokenizer(text, return_tensors='pt')
-        inputs = {k: (v.to(DEVICE).long() if k in ['input_ids', 'attention_mask'] else v.to(DEVICE)) for k, v in inputs.items()}
-        with torch.no_grad():
-            output = model(**inputs).waveform
-        audio_np = output.squeeze().cpu().numpy()
-        sr       = model.config.sampling_rate
-        audio_np = np.pad(audio_np, (0, int(0.5 * sr)), mode='constant')
-        audio_np = (audio_np * 32767.0).astype(np.int16)
-        audio_io = io.BytesIO()
-        scipy.io.wavfile.write(audio_io, sr, audio_np)
-        audio_io.seek(0)
-        return StreamingResponse(audio_io, media_type='audio/wav')
+        sr      = model.config.sampling_rate
+        results = [None] * len(texts)
+        order   = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            try:
+                inputs = tokenizer([texts[i] for i in idx], padding=True, return_tensors='pt')
+                inputs = {k: (v.to(DEVICE).long() if k in ['input_ids', 'attention_mask'] else v.to(DEVICE)) for k, v in inputs.items()}
+                with tts_generate_lock(model), torch.inference_mode():
+                    output = model(**inputs)
+                waves   = output.waveform.cpu().numpy()
+                lengths = output.sequence_lengths.cpu().tolist()
+            except Exception as e:
+                print(f'⚠️ [TTS Batch] Batch failed: {e}')
+                continue
+            for i, wave, length in zip(idx, waves, lengths):
+                audio_np = np.pad(wave[:int(length)], (0, int(0.5 * sr)), mode='constant')
+                audio_io = io.BytesIO()
+                scipy.io.wavfile.write(audio_io, sr, (np.clip(audio_np, -1.0, 1.0) * 32767.0).astype(np.int16))
+                results[i] = audio_io.getvalue()
+        return results
+
+    @backend.post('/tts/synthesize_batch')
+    async def synthesize_batch(req: TTSBatchRequest):
+        """
+        Indexed archive response: b"VAPK" | uint32 LE index length | JSON index | WAV clips.
+        Index entries carry text, language, etag and offset/length (or error).
+        """
+        if not req.items or len(req.items) > 100:
+            return JSONResponse(status_code=400, content={'error': 'Send between 1 and 100 items.'})
+
+        index, blobs, misses = [], [], {}
+        for i, item in enumerate(req.items):
+            lang_id = tts_lang_id(item.language)
+            key     = tts_cache_key(item.text, lang_id)
+            index.append({'text': item.text, 'language': item.language, 'etag': f'"{key}"'})
+            audio = (phrase_pack_get(lang_id, key) or tts_cache_get(key)) if item.text.strip() else None
+            if not item.text.strip():
+                index[i]['error'] = 'Empty text'
+            elif audio is None:
+                misses.setdefault(lang_id, []).append((i, key))
+            blobs.append(audio)
+
+        for lang_id, pending in misses.items():
+            rendered = await asyncio.to_thread(render_tts_batch, [req.items[i].text for i, _ in pending], lang_id)
+            fresh = []
+            for (i, key), audio in zip(pending, rendered):
+                if audio is None:
+                    index[i]['error'] = 'Generation failed'
+                    continue
+                fresh.append((key, audio))
+                blobs[i] = audio
+            # Disk writes stay off the event loop
+            await asyncio.to_thread(lambda: [tts_cache_put(key, audio) for key, audio in fresh])
+
+        offset = 0
+        for entry, blob in zip(index, blobs):
+            entry['offset'], entry['length'] = offset, len(blob) if blob else 0
+            offset += entry['length']
+        index_bytes = json.dumps(index, ensure_ascii=False).encode('utf-8')
+        body = b''.join([b'VAPK', struct.pack('<I', len(index_bytes)), index_bytes] + [b for b in blobs if b])
+        return Response(content=body, media_type='application/vnd.voiceaid.audio-pack')
+
+    @backend.get('/tts/cache/stats')
+    async def tts_cache_stats_route():
+        with tts_cache_lock:
+            return dict(tts_cache_stats, memory_entries=len(tts_cache),
+                        phrase_packs={lang: count for lang, (_, count) in phrase_packs.items()})
 
     return backend
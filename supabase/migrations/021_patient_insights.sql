@@ -0,0 +1,87 @@
+-- Migration 021: Precomputed patient insights
+-- The insight precompute job (backend/app/services/insight_precompute.py)
+-- recomputes /predict summaries and sentiment for patients whose data changed
+-- and stores them here, so dashboards read them with an indexed lookup
+-- instead of waiting on an LLM call.
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 1: Results table, one row per patient and insight kind
+-- ────────────────────────────────────────────────────────────
+CREATE TABLE IF NOT EXISTS patient_insights (
+    patient_id UUID NOT NULL REFERENCES patient_profiles(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL CHECK (kind IN ('summary', 'sentiment')),
+    input_hash TEXT NOT NULL,           -- SHA-256 of the canonical /predict payload
+    result JSONB NOT NULL,              -- The /predict response body
+    source TEXT,
+    is_fallback BOOLEAN NOT NULL DEFAULT false, -- Heuristic answer after an LLM failure; retried on the next run
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (patient_id, kind)
+);
+
+CREATE INDEX IF NOT EXISTS idx_patient_insights_fallback ON patient_insights(patient_id) WHERE is_fallback;
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 2: Watermark of the last completed run per job
+-- ────────────────────────────────────────────────────────────
+CREATE TABLE IF NOT EXISTS insight_job_runs (
+    job TEXT PRIMARY KEY,
+    last_run_at TIMESTAMPTZ NOT NULL,   -- Changes after this are picked up by the next run
+    patients_checked INT NOT NULL DEFAULT 0,
+    insights_computed INT NOT NULL DEFAULT 0,
+    insights_skipped INT NOT NULL DEFAULT 0,
+    finished_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 3: RLS. The job writes with the service role (bypasses RLS);
+-- patients and their therapists can read
+-- ────────────────────────────────────────────────────────────
+ALTER TABLE patient_insights ENABLE ROW LEVEL SECURITY;
+ALTER TABLE insight_job_runs ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Patients can view own insights" ON patient_insights;
+CREATE POLICY "Patients can view own insights"
+    ON patient_insights FOR SELECT
+    USING (
+        patient_id IN (SELECT id FROM patient_profiles WHERE user_id = auth.uid())
+    );
+
+DROP POLICY IF EXISTS "Therapists can view assigned patient insights" ON patient_insights;
+CREATE POLICY "Therapists can view assigned patient insights"
+    ON patient_insights FOR SELECT
+    USING (
+        patient_id IN (
+            SELECT id FROM patient_profiles
+            WHERE therapist_id IN (
+                SELECT id FROM therapist_profiles WHERE user_id = auth.uid()
+            )
+        )
+    );
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 4: Indexes for change detection (rows newer than the watermark)
+-- voice_journals, mood_logs and patient_goals were created outside these
+-- migrations. Goals are completed in place, so they get an updated_at kept
+-- current by the trigger function from 003
+-- ────────────────────────────────────────────────────────────
+CREATE INDEX IF NOT EXISTS idx_patient_analytics_created ON patient_analytics(created_at);
+
+DO $$
+BEGIN
+    IF to_regclass('public.voice_journals') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS idx_voice_journals_created ON voice_journals(created_at);
+    END IF;
+    IF to_regclass('public.mood_logs') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS idx_mood_logs_created ON mood_logs(created_at);
+    END IF;
+    IF to_regclass('public.patient_goals') IS NOT NULL THEN
+        ALTER TABLE patient_goals ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+        DROP TRIGGER IF EXISTS update_patient_goals_updated_at ON patient_goals;
+        CREATE TRIGGER update_patient_goals_updated_at
+            BEFORE UPDATE ON patient_goals
+            FOR EACH ROW
+            EXECUTE FUNCTION update_updated_at_column();
+        CREATE INDEX IF NOT EXISTS idx_patient_goals_created ON patient_goals(created_at);
+        CREATE INDEX IF NOT EXISTS idx_patient_goals_updated ON patient_goals(updated_at);
+    END IF;
+END $$;
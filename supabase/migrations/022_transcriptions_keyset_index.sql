@@ -0,0 +1,16 @@
+-- Migration 022: Keyset pagination index for transcription history
+-- GET /transcriptions/users/{user_id} pages through PostgREST with
+--   WHERE user_id = $1 AND created_at <= $2
+--     AND (created_at < $2 OR (created_at = $2 AND id < $3))
+--   ORDER BY created_at DESC, id DESC LIMIT n
+-- The created_at <= $2 bound is what the planner uses to start the range
+-- scan on this index; the OR only filters the rows that share $2, so each
+-- page costs the same whatever its depth. The index replaces
+-- idx_transcriptions_user_created (migration 009), which is a prefix of it.
+
+CREATE INDEX IF NOT EXISTS idx_transcriptions_user_created_id
+    ON transcriptions (user_id, created_at DESC, id DESC);
+
+DROP INDEX IF EXISTS idx_transcriptions_user_created;
+
+ANALYZE transcriptions;
@@ -0,0 +1,108 @@
+-- Migration 023: Server-side search over transcriptions and voice journals
+-- Backs GET /transcriptions/search. Therapists look for symptom words such
+-- as "yare", "pain" or "nsuo" across a patient's history.
+--   * Full-text: a generated tsvector per row ('simple' config, so mixed
+--     English/Akan text is neither stemmed nor stop-worded), matched by prefix
+--   * Trigram: fuzzy/partial matches for misspellings and word fragments
+-- Both are built on akan_fold(), which lowercases, strips combining tone
+-- marks and folds ɛ/ɔ/ŋ to e/o/n, so "ɛyɛ", "Ɛyɛ" and "eye" all match.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 1: Folding function (IMMUTABLE so it can feed generated columns
+-- and expression indexes)
+-- ────────────────────────────────────────────────────────────
+CREATE OR REPLACE FUNCTION public.akan_fold(input TEXT)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT translate(
+        regexp_replace(normalize(lower(coalesce(input, '')), NFD), '[\u0300-\u036f]', '', 'g'),
+        'ɛɔŋƐƆŊ',
+        'eoneon'
+    )
+$$;
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 2: Search columns and indexes
+-- ────────────────────────────────────────────────────────────
+ALTER TABLE transcriptions
+    ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('simple', public.akan_fold(text))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_transcriptions_search_tsv ON transcriptions USING GIN (search_tsv);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_text_trgm ON transcriptions USING GIN (public.akan_fold(text) gin_trgm_ops);
+
+ALTER TABLE voice_journals
+    ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('simple', public.akan_fold(transcript))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_voice_journals_search_tsv ON voice_journals USING GIN (search_tsv);
+CREATE INDEX IF NOT EXISTS idx_voice_journals_transcript_trgm ON voice_journals USING GIN (public.akan_fold(transcript) gin_trgm_ops);
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 3: Ranked search. SECURITY INVOKER, so the caller's RLS policies on
+-- transcriptions and voice_journals decide which rows can be returned
+-- ────────────────────────────────────────────────────────────
+CREATE OR REPLACE FUNCTION public.search_history(
+    query TEXT,
+    patient_id UUID DEFAULT NULL,          -- patient_profiles.id; NULL searches everything visible
+    include_transcriptions BOOLEAN DEFAULT true,
+    include_journals BOOLEAN DEFAULT true,
+    result_limit INT DEFAULT 20,
+    result_offset INT DEFAULT 0
+)
+RETURNS TABLE (
+    source TEXT,
+    id UUID,
+    patient_profile_id UUID,
+    text TEXT,
+    created_at TIMESTAMPTZ,
+    rank REAL
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+SET search_path = public
+AS $$
+    WITH q AS (
+        SELECT
+            folded,
+            -- Every word as a prefix term: 'yare' also finds 'yareɛ'
+            to_tsquery('simple', coalesce(nullif(array_to_string(ARRAY(
+                SELECT quote_literal(word) || ':*'
+                FROM regexp_split_to_table(folded, '\s+') AS word
+                WHERE word <> ''
+            ), ' & '), ''), quote_literal(''))) AS tsq
+        FROM (SELECT trim(regexp_replace(akan_fold(query), '[^[:alnum:][:space:]]', ' ', 'g')) AS folded) f
+    ),
+    owner AS (
+        SELECT pp.id, pp.user_id FROM patient_profiles pp WHERE pp.id = search_history.patient_id
+    ),
+    hits AS (
+        SELECT 'transcription'::TEXT AS source, t.id, t.patient_profile_id, t.text, t.created_at,
+               (ts_rank_cd(t.search_tsv, q.tsq) + word_similarity(q.folded, akan_fold(t.text)))::REAL AS rank
+        FROM transcriptions t, q
+        WHERE include_transcriptions
+          AND (t.search_tsv @@ q.tsq OR akan_fold(t.text) %> q.folded)
+          AND (search_history.patient_id IS NULL
+               OR t.patient_profile_id = search_history.patient_id
+               OR t.user_id = (SELECT user_id FROM owner))
+        UNION ALL
+        SELECT 'journal'::TEXT, j.id, j.patient_id, j.transcript, j.created_at,
+               (ts_rank_cd(j.search_tsv, q.tsq) + word_similarity(q.folded, akan_fold(j.transcript)))::REAL
+        FROM voice_journals j, q
+        WHERE include_journals
+          AND (j.search_tsv @@ q.tsq OR akan_fold(j.transcript) %> q.folded)
+          AND (search_history.patient_id IS NULL OR j.patient_id = search_history.patient_id)
+    )
+    SELECT source, id, patient_profile_id, text, created_at, rank
+    FROM hits
+    ORDER BY rank DESC, created_at DESC, id
+    LIMIT least(greatest(result_limit, 1), 100)
+    OFFSET greatest(result_offset, 0)
+$$;
+
+GRANT EXECUTE ON FUNCTION public.search_history(TEXT, UUID, BOOLEAN, BOOLEAN, INT, INT) TO anon, authenticated;
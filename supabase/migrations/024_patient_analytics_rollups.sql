@@ -0,0 +1,223 @@
+-- Migration 024: Daily and weekly rollups of patient_analytics
+-- Dashboards and GET /analytics/{patient_id}/metrics read these instead of
+-- aggregating raw session rows. Statement-level triggers keep them current
+-- incrementally: each INSERT/UPDATE/DELETE on patient_analytics applies one
+-- grouped delta per (subject, day) and (subject, week), however many rows
+-- the statement touched.
+--
+-- subject_id is patient_profile_id when set, else user_id, matching how the
+-- app looks a patient up (either column equal to the patient's id).
+-- Days are UTC calendar days (Ghana time); weeks start on Monday.
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 1: Rollup tables
+-- ────────────────────────────────────────────────────────────
+CREATE TABLE IF NOT EXISTS patient_analytics_daily (
+    subject_id UUID NOT NULL,
+    day DATE NOT NULL,
+    sessions INT NOT NULL DEFAULT 0,
+    duration_s DOUBLE PRECISION NOT NULL DEFAULT 0,
+    word_count BIGINT NOT NULL DEFAULT 0,
+    message_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (subject_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS patient_analytics_weekly (
+    subject_id UUID NOT NULL,
+    week_start DATE NOT NULL,
+    sessions INT NOT NULL DEFAULT 0,
+    active_days INT NOT NULL DEFAULT 0,
+    duration_s DOUBLE PRECISION NOT NULL DEFAULT 0,
+    word_count BIGINT NOT NULL DEFAULT 0,
+    message_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (subject_id, week_start)
+);
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 2: Incremental maintenance
+-- ────────────────────────────────────────────────────────────
+-- Recomputes the weekly rows of the given subjects and weeks from the daily
+-- rows (a week has at most 7, and active_days needs them), after clearing
+-- days whose sessions were all deleted. Concurrent statements for the same
+-- subject queue on a per-subject advisory lock, taken in subject order so
+-- they cannot deadlock; the recompute then sees every committed daily change
+-- and the weekly rows are upserted, never deleted and re-inserted
+CREATE OR REPLACE FUNCTION public.refresh_patient_analytics_weeks(subjects UUID[], weeks DATE[])
+RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    subject UUID;
+BEGIN
+    FOR subject IN SELECT DISTINCT s FROM unnest(subjects) AS s ORDER BY s LOOP
+        PERFORM pg_advisory_xact_lock(24, hashtext(subject::text));
+    END LOOP;
+
+    DELETE FROM patient_analytics_daily
+    WHERE subject_id = ANY(subjects) AND date_trunc('week', day)::date = ANY(weeks) AND sessions <= 0;
+
+    -- Weeks left without any sessions
+    DELETE FROM patient_analytics_weekly w
+    WHERE w.subject_id = ANY(subjects) AND w.week_start = ANY(weeks)
+      AND NOT EXISTS (
+          SELECT 1 FROM patient_analytics_daily d
+          WHERE d.subject_id = w.subject_id AND d.day >= w.week_start AND d.day < w.week_start + 7
+      );
+
+    INSERT INTO patient_analytics_weekly (subject_id, week_start, sessions, active_days, duration_s, word_count, message_count)
+    SELECT subject_id, date_trunc('week', day)::date, sum(sessions), count(*), sum(duration_s), sum(word_count), sum(message_count)
+    FROM patient_analytics_daily
+    WHERE subject_id = ANY(subjects)
+      AND day >= (SELECT min(w) FROM unnest(weeks) AS w)
+      AND day < (SELECT max(w) FROM unnest(weeks) AS w) + 7
+      AND date_trunc('week', day)::date = ANY(weeks)
+    GROUP BY subject_id, date_trunc('week', day)::date
+    ON CONFLICT (subject_id, week_start) DO UPDATE SET
+        sessions = EXCLUDED.sessions,
+        active_days = EXCLUDED.active_days,
+        duration_s = EXCLUDED.duration_s,
+        word_count = EXCLUDED.word_count,
+        message_count = EXCLUDED.message_count,
+        updated_at = NOW();
+END;
+$$;
+
+-- Adds (direction = 1) or removes (direction = -1) a set of session rows,
+-- given as a JSON array, with one grouped upsert into the daily rollup
+CREATE OR REPLACE FUNCTION public.apply_patient_analytics_delta(changed JSONB, direction INT)
+RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    subjects UUID[];
+    weeks DATE[];
+BEGIN
+    WITH sessions AS (
+        SELECT coalesce(r.patient_profile_id, r.user_id) AS subject_id,
+               (r.created_at AT TIME ZONE 'UTC')::date AS day,
+               r.duration, r.word_count, r.message_count
+        FROM jsonb_to_recordset(changed) AS r(
+            patient_profile_id UUID, user_id UUID, created_at TIMESTAMPTZ,
+            duration DOUBLE PRECISION, word_count INT, message_count INT)
+        WHERE coalesce(r.patient_profile_id, r.user_id) IS NOT NULL
+    ),
+    upserted AS (
+        INSERT INTO patient_analytics_daily AS d (subject_id, day, sessions, duration_s, word_count, message_count)
+        SELECT subject_id, day, direction * count(*), direction * sum(duration),
+               direction * sum(word_count), direction * sum(message_count)
+        FROM sessions
+        GROUP BY subject_id, day
+        ON CONFLICT (subject_id, day) DO UPDATE SET
+            sessions = d.sessions + EXCLUDED.sessions,
+            duration_s = d.duration_s + EXCLUDED.duration_s,
+            word_count = d.word_count + EXCLUDED.word_count,
+            message_count = d.message_count + EXCLUDED.message_count,
+            updated_at = NOW()
+        RETURNING d.subject_id, d.day
+    )
+    SELECT array_agg(DISTINCT subject_id), array_agg(DISTINCT date_trunc('week', day)::date)
+    INTO subjects, weeks
+    FROM upserted;
+
+    IF subjects IS NOT NULL THEN
+        PERFORM refresh_patient_analytics_weeks(subjects, weeks);
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.patient_analytics_rollup_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    -- Transition tables only exist for the events they were declared for
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        PERFORM apply_patient_analytics_delta((
+            SELECT coalesce(jsonb_agg(o), '[]')
+            FROM (SELECT patient_profile_id, user_id, created_at, duration, word_count, message_count FROM old_rows) o
+        ), -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_patient_analytics_delta((
+            SELECT coalesce(jsonb_agg(n), '[]')
+            FROM (SELECT patient_profile_id, user_id, created_at, duration, word_count, message_count FROM new_rows) n
+        ), 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS patient_analytics_rollup_insert ON patient_analytics;
+CREATE TRIGGER patient_analytics_rollup_insert
+    AFTER INSERT ON patient_analytics
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION patient_analytics_rollup_trigger();
+
+DROP TRIGGER IF EXISTS patient_analytics_rollup_update ON patient_analytics;
+CREATE TRIGGER patient_analytics_rollup_update
+    AFTER UPDATE ON patient_analytics
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION patient_analytics_rollup_trigger();
+
+DROP TRIGGER IF EXISTS patient_analytics_rollup_delete ON patient_analytics;
+CREATE TRIGGER patient_analytics_rollup_delete
+    AFTER DELETE ON patient_analytics
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION patient_analytics_rollup_trigger();
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 3: Full rebuild (backfill now; reconciliation if ever needed)
+-- ────────────────────────────────────────────────────────────
+CREATE OR REPLACE FUNCTION public.rebuild_patient_analytics_rollups()
+RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    LOCK TABLE patient_analytics IN SHARE MODE;  -- No writes while rebuilding
+    TRUNCATE patient_analytics_daily, patient_analytics_weekly;
+
+    INSERT INTO patient_analytics_daily (subject_id, day, sessions, duration_s, word_count, message_count)
+    SELECT coalesce(patient_profile_id, user_id), (created_at AT TIME ZONE 'UTC')::date,
+           count(*), sum(duration), sum(word_count), sum(message_count)
+    FROM patient_analytics
+    WHERE coalesce(patient_profile_id, user_id) IS NOT NULL
+    GROUP BY 1, 2;
+
+    INSERT INTO patient_analytics_weekly (subject_id, week_start, sessions, active_days, duration_s, word_count, message_count)
+    SELECT subject_id, date_trunc('week', day)::date, sum(sessions), count(*), sum(duration_s), sum(word_count), sum(message_count)
+    FROM patient_analytics_daily
+    GROUP BY 1, 2;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.rebuild_patient_analytics_rollups() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.apply_patient_analytics_delta(JSONB, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.refresh_patient_analytics_weeks(UUID[], DATE[]) FROM PUBLIC, anon, authenticated;
+
+SELECT public.rebuild_patient_analytics_rollups();
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 4: RLS, mirroring patient_analytics (migration 012)
+-- ────────────────────────────────────────────────────────────
+ALTER TABLE patient_analytics_daily ENABLE ROW LEVEL SECURITY;
+ALTER TABLE patient_analytics_weekly ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Authenticated users can view daily rollups" ON patient_analytics_daily;
+CREATE POLICY "Authenticated users can view daily rollups"
+    ON patient_analytics_daily FOR SELECT
+    USING (auth.uid() IS NOT NULL);
+
+DROP POLICY IF EXISTS "Authenticated users can view weekly rollups" ON patient_analytics_weekly;
+CREATE POLICY "Authenticated users can view weekly rollups"
+    ON patient_analytics_weekly FOR SELECT
+    USING (auth.uid() IS NOT NULL);
@@ -0,0 +1,164 @@
+-- Migration 025: Flatten therapist → patient RLS checks
+-- The therapist policies from migrations 010, 015, 017, 018, 019 and 021
+-- nest patient_profiles/therapist_profiles subqueries, which Postgres
+-- evaluates per row (each with those tables' own RLS applied), so therapist
+-- dashboards slow down as analytics and transcriptions grow.
+--
+-- The caller's patient set is now resolved by STABLE SECURITY DEFINER
+-- helpers. Policies call them as `col = ANY ((SELECT helper()))`: the
+-- sub-SELECT becomes an InitPlan that runs once per query, and the array
+-- comparison can use the composite indexes below. auth.uid()/auth.role() are
+-- wrapped the same way. Who can see what is unchanged.
+--
+-- Benchmark: backend/scripts/benchmark_rls.py
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 1: Access-mapping helpers. SECURITY DEFINER so the lookups skip RLS
+-- on the profile tables; each only returns rows tied to auth.uid()
+-- ────────────────────────────────────────────────────────────
+
+-- patient_profiles.id of the calling therapist's patients
+CREATE OR REPLACE FUNCTION public.therapist_patient_ids()
+RETURNS UUID[]
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT coalesce(array_agg(pp.id), '{}')
+    FROM therapist_profiles tp
+    JOIN patient_profiles pp ON pp.therapist_id = tp.id
+    WHERE tp.user_id = auth.uid()
+$$;
+
+-- Auth user ids of the calling therapist's patients (guest patients have none)
+CREATE OR REPLACE FUNCTION public.therapist_patient_user_ids()
+RETURNS UUID[]
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT coalesce(array_agg(pp.user_id), '{}')
+    FROM therapist_profiles tp
+    JOIN patient_profiles pp ON pp.therapist_id = tp.id
+    WHERE tp.user_id = auth.uid() AND pp.user_id IS NOT NULL
+$$;
+
+-- patient_profiles.id of the calling patient
+CREATE OR REPLACE FUNCTION public.own_patient_profile_ids()
+RETURNS UUID[]
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT coalesce(array_agg(id), '{}')
+    FROM patient_profiles
+    WHERE user_id = auth.uid()
+$$;
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 2: Indexes. The helpers become index-only scans; each policy column
+-- is the leading key of an index that also serves the dashboard ordering
+-- ────────────────────────────────────────────────────────────
+CREATE INDEX IF NOT EXISTS idx_patient_profiles_therapist_access ON patient_profiles(therapist_id, id, user_id);
+DROP INDEX IF EXISTS idx_patient_profiles_therapist_id;  -- Prefix of the index above
+
+CREATE INDEX IF NOT EXISTS idx_patient_analytics_profile_date ON patient_analytics(patient_profile_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_profile_created ON transcriptions(patient_profile_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_voice_journals_patient_created ON voice_journals(patient_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_patient_goals_patient_date ON patient_goals(patient_id, assigned_date);
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 3: patient_analytics (010)
+-- ────────────────────────────────────────────────────────────
+DROP POLICY IF EXISTS "Patients can view own analytics" ON patient_analytics;
+CREATE POLICY "Patients can view own analytics"
+    ON patient_analytics FOR SELECT
+    USING ((SELECT auth.uid()) = user_id);
+
+DROP POLICY IF EXISTS "Therapists can view assigned patient analytics" ON patient_analytics;
+CREATE POLICY "Therapists can view assigned patient analytics"
+    ON patient_analytics FOR SELECT
+    USING (user_id = ANY ((SELECT therapist_patient_user_ids())));
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 4: transcriptions (018)
+-- ────────────────────────────────────────────────────────────
+DROP POLICY IF EXISTS "Anyone can view transcriptions" ON transcriptions;
+CREATE POLICY "Anyone can view transcriptions"
+  ON transcriptions FOR SELECT
+  USING (
+    (SELECT auth.uid()) = user_id
+    OR patient_profile_id = ANY ((SELECT therapist_patient_ids()))
+    OR (SELECT auth.role()) = 'anon'
+  );
+
+DROP POLICY IF EXISTS "Anyone can delete transcriptions" ON transcriptions;
+CREATE POLICY "Anyone can delete transcriptions"
+  ON transcriptions FOR DELETE
+  USING (
+    (SELECT auth.uid()) = user_id
+    OR patient_profile_id = ANY ((SELECT therapist_patient_ids()))
+    OR (SELECT auth.role()) = 'anon'
+  );
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 5: patient_goals (019)
+-- ────────────────────────────────────────────────────────────
+DROP POLICY IF EXISTS "Anyone can view patient goals" ON patient_goals;
+CREATE POLICY "Anyone can view patient goals"
+  ON patient_goals FOR SELECT
+  USING (
+    patient_id = ANY ((SELECT own_patient_profile_ids()))
+    OR patient_id = ANY ((SELECT therapist_patient_ids()))
+    OR (SELECT auth.role()) = 'anon'
+  );
+
+DROP POLICY IF EXISTS "Anyone can delete patient goals" ON patient_goals;
+CREATE POLICY "Anyone can delete patient goals"
+  ON patient_goals FOR DELETE
+  USING (
+    patient_id = ANY ((SELECT therapist_patient_ids()))
+    OR (SELECT auth.role()) = 'anon'
+  );
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 6: voice_journals (017)
+-- ────────────────────────────────────────────────────────────
+DROP POLICY IF EXISTS "Patients can view own journals" ON voice_journals;
+CREATE POLICY "Patients can view own journals"
+ON voice_journals FOR SELECT
+TO authenticated
+USING (patient_id = ANY ((SELECT own_patient_profile_ids())));
+
+DROP POLICY IF EXISTS "Patients can delete own journals" ON voice_journals;
+CREATE POLICY "Patients can delete own journals"
+ON voice_journals FOR DELETE
+TO authenticated
+USING (patient_id = ANY ((SELECT own_patient_profile_ids())));
+
+DROP POLICY IF EXISTS "Therapists can view patient journals" ON voice_journals;
+CREATE POLICY "Therapists can view patient journals"
+ON voice_journals FOR SELECT
+TO authenticated
+USING (patient_id = ANY ((SELECT therapist_patient_ids())));
+
+-- ────────────────────────────────────────────────────────────
+-- STEP 7: patient_insights (021) and patient_push_tokens (015)
+-- ────────────────────────────────────────────────────────────
+DROP POLICY IF EXISTS "Patients can view own insights" ON patient_insights;
+CREATE POLICY "Patients can view own insights"
+    ON patient_insights FOR SELECT
+    USING (patient_id = ANY ((SELECT own_patient_profile_ids())));
+
+DROP POLICY IF EXISTS "Therapists can view assigned patient insights" ON patient_insights;
+CREATE POLICY "Therapists can view assigned patient insights"
+    ON patient_insights FOR SELECT
+    USING (patient_id = ANY ((SELECT therapist_patient_ids())));
+
+DROP POLICY IF EXISTS "Therapists can read patient tokens" ON patient_push_tokens;
+CREATE POLICY "Therapists can read patient tokens"
+    ON patient_push_tokens FOR SELECT
+    USING (patient_id = ANY ((SELECT therapist_patient_ids())));